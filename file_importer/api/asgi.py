@@ -0,0 +1,53 @@
+from django.core.handlers.asgi import ASGIHandler
+
+from api.lib.thread_pool import iterate_in_thread_pool
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """
+    Django's ASGI handler, other than that streamed responses (eg. CSV and NDJSON query responses,
+    batch query responses and error reports) are produced in the thread pool as they are sent.
+
+    Django iterates over a streamed response in the event loop, where the database can't be used
+    and where reading a file would hold up every other request, so each streamed response is
+    produced by a thread of the thread pool instead (see iterate_in_thread_pool) - which it holds
+    until the response has been sent.
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': _get_response_headers(response),
+        })
+
+        # The response is closed by the thread that produced it, once it has been sent
+        parts = iterate_in_thread_pool(response)
+        try:
+            async for part in parts:
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            await parts.aclose()
+
+        await send({'type': 'http.response.body'})
+
+
+def _get_response_headers(response):
+    # The headers (including cookies) are sent as bytes, as by Django's own ASGI handler
+    response_headers = []
+    for header, value in response.items():
+        if isinstance(header, str):
+            header = header.encode('ascii')
+        if isinstance(value, str):
+            value = value.encode('latin1')
+        response_headers.append((bytes(header), bytes(value)))
+    for cookie in response.cookies.values():
+        response_headers.append(
+            (b'Set-Cookie', cookie.output(header='').encode('ascii').strip()))
+
+    return response_headers
+
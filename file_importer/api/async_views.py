@@ -0,0 +1,91 @@
+"""
+Async versions of the views, used instead of the sync views (see ASYNC_VIEWS) when the app is run
+by an ASGI server.
+
+A single process can then have many more requests in flight than it has threads: anything that
+blocks, ie. authenticating the request and every database query, is run in the bounded thread pool
+(see run_sync) and the event loop is free to handle other requests while it waits. Every view is
+async, as Django would otherwise run a sync view in the single thread that it shares between every
+request. Streamed responses are produced in the thread pool too, by api.asgi.StreamingASGIHandler.
+"""
+from django.http import HttpResponse
+
+from api import views
+from api.decorators import require_api_authentication, require_streamed_api_authentication
+from api.lib.thread_pool import run_sync
+
+
+def async_csrf_exempt(view):
+    # Django's csrf_exempt wraps views in a sync function, which would hide that they are async
+    view.csrf_exempt = True
+    return view
+
+
+async def heartbeat_view(request):
+    return HttpResponse("OK.")
+
+
+async def metrics_view(request):
+    return await run_sync(views.metrics_view)(request)
+
+
+@async_csrf_exempt
+@require_api_authentication
+async def import_transactions_view(request, json_body):
+    from api.lib import EXCHANGE_RATES
+
+    # The exchange rates are needed to validate and convert the transactions
+    await EXCHANGE_RATES.ensure_loaded_async()
+    return await run_sync(views.handle_import_request)(request, json_body)
+
+
+@async_csrf_exempt
+@require_streamed_api_authentication
+async def import_transactions_stream_view(request, body_file):
+    from api.lib import EXCHANGE_RATES
+
+    # The exchange rates are needed to validate and convert the transactions
+    await EXCHANGE_RATES.ensure_loaded_async()
+    return await run_sync(views.handle_import_stream_request)(request, body_file)
+
+
+@async_csrf_exempt
+@require_api_authentication
+async def import_job_status_view(request, json_body, job_id):
+    return await run_sync(views.handle_import_job_status_request)(request, json_body, job_id)
+
+
+@async_csrf_exempt
+@require_api_authentication
+async def import_error_report_view(request, json_body, report_id):
+    return await run_sync(views.handle_error_report_request)(request, json_body, report_id)
+
+
+@async_csrf_exempt
+@require_api_authentication
+async def query_transactions_view(request, json_body):
+    from api.lib import EXCHANGE_RATES
+
+    # The exchange rates are needed to validate the country code
+    await EXCHANGE_RATES.ensure_loaded_async()
+    return await run_sync(views.handle_query_request)(request, json_body)
+
+
+@async_csrf_exempt
+@require_api_authentication
+async def batch_query_transactions_view(request, json_body):
+    from api.lib import EXCHANGE_RATES
+
+    # The exchange rates are needed to validate the country codes
+    await EXCHANGE_RATES.ensure_loaded_async()
+    return await run_sync(views.handle_batch_query_request)(request, json_body)
+
+
+@async_csrf_exempt
+@require_api_authentication
+async def summarise_transactions_view(request, json_body):
+    from api.lib import EXCHANGE_RATES
+
+    # The exchange rates are needed to validate the country code
+    await EXCHANGE_RATES.ensure_loaded_async()
+    return await run_sync(views.handle_summary_request)(request, json_body)
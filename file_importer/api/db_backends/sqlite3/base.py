@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    SQLite, set up for imports and queries made at the same time (by different processes).
+
+    Every connection is set up with SQLITE_PRAGMAS, eg. WAL mode so that queries aren't blocked by
+    imports, and waits up to SQLITE_TIMEOUT seconds for another connection to finish writing.
+
+    Transactions take SQLite's write lock as soon as they begin (BEGIN IMMEDIATE). Otherwise a
+    transaction that reads before it writes, eg. a conversion, fails with "database is locked"
+    rather than waiting for the lock if another connection has written in the meantime.
+    """
+
+    def get_connection_params(self):
+        connection_params = super().get_connection_params()
+        connection_params.setdefault('timeout', settings.SQLITE_TIMEOUT)
+        return connection_params
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        for pragma, value in settings.SQLITE_PRAGMAS.items():
+            connection.execute(f'PRAGMA {pragma} = {value}')
+        return connection
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
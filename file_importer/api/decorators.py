@@ -1,14 +1,27 @@
+import asyncio
 import hashlib
 import hmac
 import json
 import os
+import tempfile
 
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig
 from django.http import JsonResponse
 from dotenv import load_dotenv
 from functools import wraps
 
+from api.lib.codecs import encoded_response, get_request_codec
+from api.lib.metrics import timed
+from api.lib.thread_pool import run_sync
+
 load_dotenv()
 
+SECURITY_HASH_HEADER = 'HTTP_X_SECURITY_HASH'
+
+# The number of bytes of a streamed request's body that are read at a time
+STREAM_CHUNK_SIZE = 64 * 1024
+
 
 def require_api_authentication(func):
     """
@@ -16,22 +29,185 @@ def require_api_authentication(func):
 
     To confirm that the message is entirely untouched from the sending party, the message contents
     will be hashed and that hash compared to the given hash.
+
+    The hash can be sent in one of two ways:
+    - in the X-Security-Hash header, calculated over the raw body, ie. HMAC-SHA256(secret, body),
+      which allows the request to be authenticated without parsing and re-encoding its contents
+    - as the security_hash value in the body, calculated over the rest of the body, re-encoded as
+      JSON with its keys sorted (the original scheme, still supported for older clients)
+
+    The body is JSON or, with a Content-Type of application/msgpack, MessagePack (see
+    api.lib.codecs), and is given to the view as the json_body argument either way. Bodies larger
+    than DATA_UPLOAD_MAX_MEMORY_SIZE bytes are rejected (with a 413 status) without being read.
+
+    Async views are validated in the thread pool (see run_sync), as hashing and parsing a large
+    request would otherwise hold up every other request.
     """
+    if asyncio.iscoroutinefunction(func):
+        @wraps(func)
+        async def validate_async_request(request, *args, **kwargs):
+            codec = get_request_codec(request)
+            if codec is None:
+                return _unsupported_content_type_response(request)
+
+            try:
+                json_data = await run_sync(_authenticate_request)(request, codec)
+            except RequestDataTooBig:
+                return _request_too_large_response(request)
+            if json_data is None:
+                return encoded_response(request, {'error': 'Invalid security hash'}, status=403)
+
+            return await func(request, json_data, *args, **kwargs)
+
+        return validate_async_request
+
     @wraps(func)
     def validate_request(request, *args, **kwargs):
-        json_data = json.loads(request.body)
-        provided_security_hash = json_data.pop('security_hash')
+        codec = get_request_codec(request)
+        if codec is None:
+            return _unsupported_content_type_response(request)
+
+        try:
+            json_data = _authenticate_request(request, codec)
+        except RequestDataTooBig:
+            return _request_too_large_response(request)
+        if json_data is None:
+            return encoded_response(request, {'error': 'Invalid security hash'}, status=403)
+
+        return func(request, json_data, *args, **kwargs)
+
+    return validate_request
 
-        api_secret = os.environ['API_SECRET_KEY']
 
+def _authenticate_request(request, codec):
+    """Return the decoded body of the request, or None if its security hash isn't valid."""
+    api_secret = os.environ['API_SECRET_KEY']
+
+    if SECURITY_HASH_HEADER in request.META:
+        with timed('authenticate'):
+            calculated_security_hash = hmac.new(
+                api_secret.encode(), request.body, hashlib.sha256).hexdigest()
+
+        if not _is_security_hash(request.META[SECURITY_HASH_HEADER], calculated_security_hash):
+            return None
+
+        with timed('parse'):
+            return codec.decode(request.body)
+
+    with timed('parse'):
+        json_data = codec.decode(request.body)
+    provided_security_hash = json_data.pop('security_hash', None)
+
+    # The hash is always of the standard library's encoding, as that is what clients calculate it
+    # of
+    with timed('authenticate'):
         calculated_security_hash = hmac.new(
             api_secret.encode(),
             json.dumps(json_data, sort_keys=True).encode(),
             hashlib.sha256).hexdigest()
 
-        if provided_security_hash == calculated_security_hash:
-            return func(request, json_data, *args, **kwargs)
-        else:
-            return JsonResponse({'error': 'Invalid security hash'}, status=403)
+    if _is_security_hash(provided_security_hash, calculated_security_hash):
+        return json_data
+
+    return None
+
+
+def _is_security_hash(provided_security_hash, calculated_security_hash):
+    """
+    Return True if the security hash given with a request is the one calculated for it.
+
+    The given hash comes from the request, so it could be anything - compare_digest only accepts
+    ASCII strings or bytes, so it is compared as UTF-8 encoded bytes.
+    """
+    if not isinstance(provided_security_hash, str):
+        return False
+
+    return hmac.compare_digest(
+        provided_security_hash.encode('utf-8', 'surrogateescape'),
+        calculated_security_hash.encode())
+
+
+def _request_too_large_response(request):
+    return encoded_response(request, {
+        'error': (
+            f'The request body is larger than {settings.DATA_UPLOAD_MAX_MEMORY_SIZE} bytes - '
+            f'larger files can be streamed to /api/v1/transactions/import/stream')}, status=413)
+
+
+def _unsupported_content_type_response(request):
+    return JsonResponse(
+        {'error': f'Unsupported content type "{request.content_type}"'}, status=415)
+
+
+def require_streamed_api_authentication(func):
+    """
+    Validate an incoming API request whose body is streamed.
+
+    The security hash of a streamed request is sent in the X-Security-Hash header and is calculated
+    over the query string, a new line and then the raw body, ie.
+    HMAC-SHA256(secret, query string + "\n" + body)
+
+    The body is copied to a temporary file while it is read and hashed (in memory, until it is
+    larger than IMPORT_STREAM_SPOOL_SIZE bytes) and the view is only called, with that file as the
+    body_file argument, once the request has been authenticated - so nothing is validated or saved
+    while the body is still being sent, and nothing at all for an unauthenticated request. Async
+    views have the body read and hashed in the thread pool (see run_sync).
+    """
+    if asyncio.iscoroutinefunction(func):
+        @wraps(func)
+        async def validate_async_request(request, *args, **kwargs):
+            if SECURITY_HASH_HEADER not in request.META:
+                return encoded_response(request, {'error': 'Invalid security hash'}, status=403)
+
+            with _create_body_file() as body_file:
+                if not await run_sync(_authenticate_streamed_request)(request, body_file):
+                    return encoded_response(
+                        request, {'error': 'Invalid security hash'}, status=403)
+
+                return await func(request, body_file, *args, **kwargs)
+
+        return validate_async_request
+
+    @wraps(func)
+    def validate_request(request, *args, **kwargs):
+        if SECURITY_HASH_HEADER not in request.META:
+            return encoded_response(request, {'error': 'Invalid security hash'}, status=403)
+
+        with _create_body_file() as body_file:
+            if not _authenticate_streamed_request(request, body_file):
+                return encoded_response(request, {'error': 'Invalid security hash'}, status=403)
+
+            return func(request, body_file, *args, **kwargs)
 
     return validate_request
+
+
+def _create_body_file():
+    return tempfile.SpooledTemporaryFile(
+        max_size=settings.IMPORT_STREAM_SPOOL_SIZE, dir=settings.FILE_UPLOAD_TEMP_DIR)
+
+
+def _authenticate_streamed_request(request, body_file):
+    """Spool the body of a streamed request to body_file, returning True if it's authentic."""
+    with timed('authenticate'):
+        calculated_security_hash = _spool_request_body(request, body_file)
+
+    if not _is_security_hash(request.META[SECURITY_HASH_HEADER], calculated_security_hash):
+        return False
+
+    body_file.seek(0)
+    return True
+
+
+def _spool_request_body(request, body_file):
+    """Copy the body of a streamed request to body_file, returning its calculated security hash."""
+    request_hmac = hmac.new(
+        os.environ['API_SECRET_KEY'].encode(),
+        request.META.get('QUERY_STRING', '').encode() + b'\n',
+        hashlib.sha256)
+
+    for chunk in iter(lambda: request.read(STREAM_CHUNK_SIZE), b''):
+        request_hmac.update(chunk)
+        body_file.write(chunk)
+
+    return request_hmac.hexdigest()
@@ -1,8 +1,14 @@
-__all__ = ['ExchangeRateClient', 'FileImportService']
+__all__ = ['ExchangeRateClient', 'ExchangeRateStore', 'FileImportService']
 
 from api.lib.exchange_rate_client import ExchangeRateClient
+from api.lib.exchange_rate_store import ExchangeRateStore
 from api.lib.file_import_service import FileImportService
+from api.lib.query_cache import get_query_cache
 
-# This is done here so that it is run once when the app starts. It should be run and the results
-# cached in Redis or memory but this should be sufficient for a first release
-EXCHANGE_RATES = ExchangeRateClient.get_exchange_rates()
+# The exchange rates are only fetched when first used and are then cached in memory (and on disk,
+# for the next time the app starts) and refreshed once a day - see ExchangeRateStore
+EXCHANGE_RATES = ExchangeRateStore(ExchangeRateClient)
+
+# Encoded query responses are cached until transactions on their day are imported or converted -
+# see QUERY_CACHE_BACKEND
+QUERY_CACHE = get_query_cache()
@@ -0,0 +1,133 @@
+import json
+
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+from api.lib.garbage_collection import gc_paused
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+CONTENT_TYPE_JSON = 'application/json'
+CONTENT_TYPE_MSGPACK = 'application/msgpack'
+
+_DJANGO_ENCODER = DjangoJSONEncoder()
+
+
+class JSONCodec():
+    """
+    Encode and decode JSON, with orjson when it is installed (unless use_orjson is False) and the
+    standard library otherwise.
+
+    Decimals are encoded as strings and dates and times as ISO 8601 strings, exactly as
+    DjangoJSONEncoder (and so JsonResponse) does, whichever library is used.
+    """
+    name = 'json'
+    content_type = CONTENT_TYPE_JSON
+
+    def __init__(self, use_orjson=True):
+        self.use_orjson = use_orjson and orjson is not None
+
+    @property
+    def library(self):
+        return 'orjson' if self.use_orjson else 'json'
+
+    def is_available(self):
+        return True
+
+    def encode(self, data):
+        if self.use_orjson:
+            # Dates and times are left to DjangoJSONEncoder, which writes times to the millisecond
+            return orjson.dumps(
+                data, default=_encode_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        return json.dumps(data, cls=DjangoJSONEncoder).encode()
+
+    def decode(self, content):
+        if self.use_orjson:
+            try:
+                return _without_gc(orjson.loads, content)
+            except orjson.JSONDecodeError:
+                # orjson is stricter than the standard library (eg. about NaN or Infinity), so
+                # anything it can't read is left to the standard library to read or reject
+                pass
+        return _without_gc(json.loads, content)
+
+
+class MessagePackCodec():
+    """
+    Encode and decode MessagePack, when msgpack is installed.
+
+    Values that MessagePack has no type for, like decimals and dates, are encoded as the same
+    strings as they are in JSON.
+    """
+    name = 'msgpack'
+    content_type = CONTENT_TYPE_MSGPACK
+    library = 'msgpack'
+
+    def is_available(self):
+        return msgpack is not None
+
+    def encode(self, data):
+        return msgpack.packb(data, default=_encode_default)
+
+    def decode(self, content):
+        return _without_gc(msgpack.unpackb, content)
+
+
+JSON = JSONCodec()
+MSGPACK = MessagePackCodec()
+
+# The codecs of each supported content type of request and response bodies
+CODECS = {
+    CONTENT_TYPE_JSON: JSON,
+    CONTENT_TYPE_MSGPACK: MSGPACK,
+    'application/x-msgpack': MSGPACK
+}
+
+
+def get_request_codec(request):
+    """
+    Return the codec of the request's body (given by its Content-Type), or None if it isn't
+    supported. Bodies without a recognised content type are read as JSON, as they always have been.
+    """
+    codec = CODECS.get(request.content_type, JSON)
+    return codec if codec.is_available() else None
+
+
+def get_response_codec(request):
+    """Return the codec to encode the response with - the first one accepted by the request."""
+    for media_type in request.META.get('HTTP_ACCEPT', '').split(','):
+        codec = CODECS.get(media_type.split(';')[0].strip().lower())
+        if codec and codec.is_available():
+            return codec
+
+    return JSON
+
+
+def encoded_response(request, data, status=200):
+    """Return a response of the data, encoded in the format accepted by the request."""
+    codec = get_response_codec(request)
+    return HttpResponse(codec.encode(data), content_type=codec.content_type, status=status)
+
+
+def _without_gc(decode, content):
+    # Decoding a large body creates many objects in quick succession, so the garbage collector is
+    # paused until the body has been decoded
+    with gc_paused():
+        return decode(content)
+
+
+def _encode_default(value):
+    # Called for every value that orjson or msgpack has no type for, eg. every decimal amount
+    if type(value) is Decimal:
+        return str(value)
+    return _DJANGO_ENCODER.default(value)
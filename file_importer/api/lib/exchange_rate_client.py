@@ -1,5 +1,15 @@
+import json
 import requests
 
+from django.conf import settings
+
+from api.lib.thread_pool import run_sync
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
 
 class ExchangeRateClient():
     """
@@ -9,6 +19,8 @@ class ExchangeRateClient():
     (https://sdw-wsrest.ecb.europa.eu/help/) but multiple clients could be used to handle multiple
     exchange rate sources.
     """
+    ECB_EXCHANGE_RATES_URL = 'https://sdw-wsrest.ecb.europa.eu/service/data/EXR/D..EUR.SP00.A'
+    REQUEST_TIMEOUT = 30
 
     @classmethod
     def get_exchange_rates(cls):
@@ -32,23 +44,62 @@ class ExchangeRateClient():
         }
         """
         # This will get all of the daily exchange rates for all currencies against the Euro and
-        # return the data in a JSON format (last occurance only - previous exchange rates are not
-        # relevant at this time)
-        response = requests.get(
-            'https://sdw-wsrest.ecb.europa.eu/service/data/EXR/D..EUR.SP00.A?'
-            'lastNObservations=1&format=jsondata')
+        # return the data in a JSON format (last occurance only)
+        exchange_rate_data = cls._get_exchange_rate_data({'lastNObservations': 1})
+
+        return {
+            exchange_rate_code: {
+                'name': exchange_rate['name'],
+                'value': exchange_rate['values'][-1]
+            } for exchange_rate_code, exchange_rate in cls._parse_exchange_rates(
+                exchange_rate_data).items()}
 
-        exchange_rate_data = response.json()
-        attribute_series = exchange_rate_data['structure']['attributes']['series']
+    @classmethod
+    def get_exchange_rate_history(cls, start_date):
+        """
+        Return the daily exchange rates available via the European Central Bank since start_date.
 
-        # The UNIT series is the 3-letter currency abbreviation paired with the more description
-        # form of the currency, i.e. "South African rand"
-        exchange_rate_units = [d for d in attribute_series if d['id'] == 'UNIT']
+        The data will be in the form:
+        {
+            3-letter currency: {
+                name: description of currency
+                dates: a list of the dates with an exchange rate (YYYY-MM-DD), in ascending order
+                values: a list of the exchange rates on each of those dates
+            }
+        }
 
-        # "exchange_rates" will have the form: (3-letter currency, long-form currency name)
-        # in the original order presented - this is important when looking up the actual exchange
-        # rate information
-        exchange_rates = [(eru['id'], eru['name']) for eru in exchange_rate_units[0]['values']]
+        Eg.
+        {
+            'ZAR': {
+                'name': 'South African rand',
+                'dates': ['2021-12-09', '2021-12-10'],
+                'values': [18.0841, 18.0003]
+            }
+        }
+        """
+        exchange_rate_data = cls._get_exchange_rate_data({'startPeriod': start_date.isoformat()})
+        return cls._parse_exchange_rates(exchange_rate_data)
+
+    @classmethod
+    async def get_exchange_rate_history_async(cls, start_date):
+        """The same as get_exchange_rate_history, for async views."""
+        exchange_rate_data = await cls._get_exchange_rate_data_async(
+            {'startPeriod': start_date.isoformat()})
+        return cls._parse_exchange_rates(exchange_rate_data)
+
+    @classmethod
+    def _parse_exchange_rates(cls, exchange_rate_data):
+        # The currency dimension is the list of 3-letter currency abbreviations paired with the
+        # more descriptive form of the currency, i.e. "South African rand", in the original order
+        # presented - this is important when looking up the actual exchange rate information
+        series_dimensions = exchange_rate_data['structure']['dimensions']['series']
+        currency_dimension = [d for d in series_dimensions if d['id'] == 'CURRENCY'][0]
+        exchange_rates = [(c['id'], c['name']) for c in currency_dimension['values']]
+
+        # Each observation is keyed by its position in the list of time periods
+        observation_dimensions = exchange_rate_data['structure']['dimensions']['observation']
+        time_period_dimension = [d for d in observation_dimensions if d['id'] == 'TIME_PERIOD'][0]
+        time_periods = [t['id'] for t in time_period_dimension['values']]
 
         dataset_series = exchange_rate_data['dataSets'][0]['series']
         final_exchange_rates = {}
@@ -56,13 +107,58 @@ class ExchangeRateClient():
             exchange_rate_code, exchange_rate_name = exchange_rate
 
             # The API for the ECB is really horrible and terribly documented but it appears that
-            # this will get the exchange rate for the last observation available
-            observations = dataset_series[f'0:{index}:0:0:0']['observations']
-            latest_exchange_rate = list(observations.values())[0][0]
+            # each currency's series is identified by its position in the currency dimension
+            series = dataset_series.get(f'0:{index}:0:0:0')
+            if not series:
+                continue
+
+            observations = sorted(
+                (time_periods[int(position)], observation[0])
+                for position, observation in series['observations'].items()
+                if observation[0] is not None)
+            if not observations:
+                continue
 
             final_exchange_rates[exchange_rate_code.upper()] = {
                 'name': exchange_rate_name,
-                'value': latest_exchange_rate
+                'dates': [date for date, value in observations],
+                'values': [value for date, value in observations]
             }
 
         return final_exchange_rates
+
+    @classmethod
+    def _get_exchange_rate_data(cls, parameters):
+        """
+        Return the raw exchange rate data from the European Central Bank.
+
+        When EXCHANGE_RATE_FIXTURE is set, the data will be read from that file instead (it must be
+        in the same format as the ECB's response) which allows the app to be tested and run
+        offline.
+        """
+        if settings.EXCHANGE_RATE_FIXTURE:
+            with open(settings.EXCHANGE_RATE_FIXTURE) as fixture_file:
+                return json.load(fixture_file)
+
+        response = requests.get(
+            cls.ECB_EXCHANGE_RATES_URL, params={**parameters, 'format': 'jsondata'},
+            timeout=cls.REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    @classmethod
+    async def _get_exchange_rate_data_async(cls, parameters):
+        """
+        Return the raw exchange rate data from the European Central Bank, without blocking.
+
+        The request is made with httpx, when it is installed, and otherwise (or when reading the
+        EXCHANGE_RATE_FIXTURE) in the thread pool.
+        """
+        if settings.EXCHANGE_RATE_FIXTURE or httpx is None:
+            return await run_sync(cls._get_exchange_rate_data)(parameters)
+
+        async with httpx.AsyncClient(timeout=cls.REQUEST_TIMEOUT) as client:
+            response = await client.get(
+                cls.ECB_EXCHANGE_RATES_URL, params={**parameters, 'format': 'jsondata'})
+        response.raise_for_status()
+        return response.json()
@@ -0,0 +1,58 @@
+import bisect
+import datetime
+
+from decimal import Decimal
+
+
+class ExchangeRateHistory():
+    """
+    An index of the daily exchange rates of each currency, by date.
+
+    The ECB only publishes exchange rates on business days, so the exchange rate on any other day
+    is the one published on the nearest previous business day. Each currency's dates are kept in a
+    sorted list so that this can be found with a binary search, rather than a lookup per day.
+    """
+
+    def __init__(self, exchange_rate_history, start_date=None):
+        """
+        exchange_rate_history: the exchange rates in the form returned by
+                               ExchangeRateClient.get_exchange_rate_history
+        start_date: the date that the exchange rates were fetched from (default the date of the
+                    earliest exchange rate)
+        """
+        self._dates = {}
+        self._values = {}
+        for currency, exchange_rates in exchange_rate_history.items():
+            self._dates[currency] = [
+                datetime.date.fromisoformat(date) for date in exchange_rates['dates']]
+            self._values[currency] = [Decimal(str(value)) for value in exchange_rates['values']]
+
+        if start_date is None:
+            start_date = min((dates[0] for dates in self._dates.values() if dates), default=None)
+        self.start_date = start_date
+
+    def get_rate(self, currency, date):
+        """Return the exchange rate of the currency on the given date (None if it isn't known)."""
+        dates = self._dates.get(currency, [])
+        index = bisect.bisect_right(dates, date) - 1
+        if index < 0:
+            return None
+
+        return self._values[currency][index]
+
+    def get_rate_periods(self, currency, start_date, end_date):
+        """
+        Return the exchange rates of the currency that apply from start_date until end_date.
+
+        The output shall be a list of (first date, date the next rate applies from (None if it is
+        the latest rate), exchange rate), in date order. Any days before the first known exchange
+        rate are not covered.
+        """
+        dates = self._dates.get(currency, [])
+        values = self._values.get(currency, [])
+        first_index = max(bisect.bisect_right(dates, start_date) - 1, 0)
+        last_index = bisect.bisect_right(dates, end_date)
+
+        return [
+            (dates[index], dates[index + 1] if index + 1 < len(dates) else None, values[index])
+            for index in range(first_index, last_index)]
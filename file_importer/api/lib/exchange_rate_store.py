@@ -0,0 +1,199 @@
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+from collections.abc import Mapping
+from django.conf import settings
+
+from api.lib.exchange_rate_history import ExchangeRateHistory
+from api.lib.thread_pool import run_sync
+
+logger = logging.getLogger(__name__)
+
+
+class ExchangeRateStore(Mapping):
+    """
+    A read-only mapping of the latest exchange rates, in the form returned by the exchange rate
+    client, ie. {3-letter currency: {'name': ..., 'value': ...}}. The exchange rates of the last
+    EXCHANGE_RATE_HISTORY_DAYS days are available, by date, through the history property, and
+    earlier exchange rates through get_history.
+
+    The rates are only loaded when they are first used, rather than when the app starts, and are
+    kept in memory until they are older than EXCHANGE_RATE_TTL seconds. Every set of rates that is
+    fetched is also saved to EXCHANGE_RATE_SNAPSHOT_PATH, so a newly started process will read the
+    last snapshot instead of waiting on (or failing because of) the exchange rate API.
+
+    Stale rates continue to be used while fresh rates are fetched in a background thread. If that
+    fetch fails, the stale rates are kept and the fetch is retried after
+    EXCHANGE_RATE_RETRY_INTERVAL seconds.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._rates = None
+        self._history = None
+        self._next_refresh_at = 0
+        self._lock = threading.Lock()
+        self._history_lock = threading.Lock()
+        self._refreshing = False
+
+    @property
+    def rates(self):
+        self._ensure_fresh()
+        return self._rates
+
+    @property
+    def history(self):
+        self._ensure_fresh()
+        return self._history
+
+    def get_history(self, start_date):
+        """
+        Return the exchange rate history, including the exchange rates since start_date.
+
+        When start_date is before the history that is kept (eg. for backdated transactions), the
+        exchange rates since start_date are fetched and kept, in memory only, until the rates are
+        next refreshed. If they can't be fetched, the history that is kept is returned.
+        """
+        history = self.history
+        if history.start_date is not None and start_date >= history.start_date:
+            return history
+
+        with self._history_lock:
+            history = self._history
+            if history.start_date is not None and start_date >= history.start_date:
+                return history
+
+            try:
+                history = ExchangeRateHistory(
+                    self.client.get_exchange_rate_history(start_date), start_date)
+            except Exception:
+                logger.exception(f'Unable to fetch the exchange rates since {start_date}')
+                return self._history
+
+            self._history = history
+            return history
+
+    def refresh(self):
+        """Fetch the latest exchange rates and save them as the new snapshot."""
+        start_date = _get_history_start_date()
+        history = self.client.get_exchange_rate_history(start_date)
+        fetched_at = time.time()
+        self._set_history(history, fetched_at, start_date)
+        self._save_snapshot(history, fetched_at, start_date)
+
+    async def ensure_loaded_async(self):
+        """
+        Load the rates, if they haven't been loaded yet, without blocking the event loop.
+
+        Async views call this before using the rates, which then never block (stale rates are
+        refreshed in the background). Requests that arrive while the rates are first being fetched
+        may each fetch them, which only happens when there is no snapshot to read.
+        """
+        if self._rates is not None:
+            return
+
+        snapshot = await run_sync(self._read_snapshot)()
+        if self._rates is not None:
+            return
+
+        if snapshot and 'history' in snapshot:
+            self._set_snapshot(snapshot)
+            return
+
+        start_date = _get_history_start_date()
+        history = await self.client.get_exchange_rate_history_async(start_date)
+        fetched_at = time.time()
+        self._set_history(history, fetched_at, start_date)
+        await run_sync(self._save_snapshot)(history, fetched_at, start_date)
+
+    def __getitem__(self, currency):
+        return self.rates[currency]
+
+    def __contains__(self, currency):
+        return currency in self.rates
+
+    def __iter__(self):
+        return iter(self.rates)
+
+    def __len__(self):
+        return len(self.rates)
+
+    def _ensure_fresh(self):
+        if self._rates is None:
+            with self._lock:
+                if self._rates is None:
+                    self._load()
+        elif time.time() >= self._next_refresh_at:
+            self._refresh_in_background()
+
+    def _load(self):
+        snapshot = self._read_snapshot()
+        if snapshot and 'history' in snapshot:
+            self._set_snapshot(snapshot)
+        else:
+            self.refresh()
+
+    def _set_snapshot(self, snapshot):
+        # Older snapshots don't have the start date, which is then the date of the earliest rate
+        start_date = snapshot.get('start_date')
+        self._set_history(
+            snapshot['history'], snapshot['fetched_at'],
+            datetime.date.fromisoformat(start_date) if start_date else None)
+
+    def _set_history(self, history, fetched_at, start_date):
+        self._history = ExchangeRateHistory(history, start_date)
+        self._rates = {
+            currency: {
+                'name': exchange_rates['name'],
+                'value': exchange_rates['values'][-1]
+            } for currency, exchange_rates in history.items()}
+        self._next_refresh_at = fetched_at + settings.EXCHANGE_RATE_TTL
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        threading.Thread(target=self._background_refresh, daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception(
+                'Unable to refresh the exchange rates, the previous rates will be used')
+            self._next_refresh_at = time.time() + settings.EXCHANGE_RATE_RETRY_INTERVAL
+        finally:
+            self._refreshing = False
+
+    def _read_snapshot(self):
+        try:
+            with open(settings.EXCHANGE_RATE_SNAPSHOT_PATH) as snapshot_file:
+                return json.load(snapshot_file)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger.warning('Ignoring the corrupt exchange rate snapshot')
+            return None
+
+    def _save_snapshot(self, history, fetched_at, start_date):
+        # Write to a temporary file first so that other processes never read a partial snapshot
+        snapshot_path = str(settings.EXCHANGE_RATE_SNAPSHOT_PATH)
+        temporary_path = f'{snapshot_path}.{os.getpid()}.tmp'
+        try:
+            with open(temporary_path, 'w') as snapshot_file:
+                json.dump({
+                    'fetched_at': fetched_at, 'start_date': start_date.isoformat(),
+                    'history': history}, snapshot_file)
+            os.replace(temporary_path, snapshot_path)
+        except OSError:
+            logger.exception('Unable to save the exchange rate snapshot')
+
+
+def _get_history_start_date():
+    return datetime.date.today() - datetime.timedelta(days=settings.EXCHANGE_RATE_HISTORY_DAYS)
@@ -1,31 +1,51 @@
+import csv
+import io
+
+from django.conf import settings
+from django.db import NotSupportedError, connection
+from django.db.models import Max
+from django.db.transaction import atomic, on_commit
 from itertools import islice
 
 from api.models import Transaction
 from api.lib.file_validation_service import FileValidationService
+from api.lib.import_schemas import get_import_schema
+from api.lib.metrics import count_rows, timed
 from api.lib.transaction_conversion_service import TransactionConversionService
-from api.lib.file_import_fields import FIELD_COUNTRY, FIELD_CURRENCY, FIELD_DATE, FIELD_MONEY, \
-    FIELD_TRX_TYPE, TRX_TYPE_PURCHASE
+from api.lib.transaction_summary_service import TransactionSummaryService
 
 
 class FileImportService():
     """
     This will handle the importing of transaction data, including validation, to the database.
 
-    Note! This is a very specific handling for this one kind of file (VAT Imports). Ideally,
-          differences would be abstracted into a file-specific format, ie. the file import service
-          receives an object telling it what fields are in what order, any pre- and post-validation
-          checks, etc.
+    The layout of the file - what fields are in what order and any pre- and post-validation
+    changes - is given by an import schema (see api.lib.import_schemas), by default the VAT import
+    file (see DEFAULT_IMPORT_SCHEMA).
+
+    The validation errors are either returned in full or summarised, and validation can stop after
+    a number of errors - see api.lib.validation_errors.
     """
-    FILE_STRUCTURE = [
-        FIELD_DATE, FIELD_TRX_TYPE, FIELD_COUNTRY, FIELD_CURRENCY, FIELD_MONEY, FIELD_MONEY]
 
-    def __init__(self, transaction_data, ignore_first_row):
+    def __init__(
+            self, transaction_data, ignore_first_row, batch_size=None, row_offset=0, schema=None,
+            validation_errors=None):
         self.transaction_data = transaction_data[1:] if ignore_first_row else transaction_data
+        self.schema = schema or get_import_schema()
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.row_offset = row_offset
+        self.validation_errors = validation_errors
         self.file_validation = None
+        self.imported_ids = []
 
     def validate_transaction_data(self):
-        self.file_validation = FileValidationService(self.transaction_data)
-        return self.file_validation.validate(self.FILE_STRUCTURE)
+        self.file_validation = FileValidationService(
+            self.transaction_data, row_offset=self.row_offset,
+            validation_errors=self.validation_errors)
+        with timed('validate'):
+            is_valid = self.file_validation.validate(self.schema)
+        count_rows('validate', len(self.transaction_data))
+        return is_valid
 
     def save_transactions(self, ignore_invalid_transactions=False):
         """
@@ -34,52 +54,282 @@ class FileImportService():
         ignore_invalid_transactions: True if the importer should import all valid transactions
                                      even in the presense of some bad transactions or whether
                                      it should not save anything at all.
+
+        The transactions are written in batches of IMPORT_BATCH_SIZE rows within a single database
+        transaction, so either the whole import is saved or none of it is. The daily transaction
+        summaries are updated in the same database transaction and any cached queries of the
+        imported days are invalidated once it is committed.
         """
+        from api.lib import QUERY_CACHE
+
         if self.file_validation.validation_errors and not ignore_invalid_transactions:
             return
 
-        self._post_validation_updates()
+        transactions = self.file_validation.valid_transactions
+        with atomic():
+            with timed('insert'):
+                if self._use_postgres_copy():
+                    self.imported_ids = self._copy_transactions(transactions)
+                else:
+                    self.imported_ids = self._insert_transactions(transactions)
+            count_rows('insert', len(self.imported_ids))
 
-        transaction_count = 0
+            if self.imported_ids:
+                imported_days = set()
+                with timed('summarise'):
+                    for imported_transactions in Transaction.objects.get_batches_by_ids(
+                            self.imported_ids):
+                        imported_days |= TransactionSummaryService.add_transactions(
+                            imported_transactions)
+
+                # Cached queries of the imported days no longer match the transactions
+                on_commit(lambda: QUERY_CACHE.invalidate(imported_days))
+
+        with timed('convert'):
+            self._post_import_updates()
 
-        # This method of saving transactions in batches may be premature optimisation...
-        # It's here as an alternative if my test is used to spawn a real feature  :-D
+        return len(self.imported_ids)
 
-        # transactions_to_save = []
-        for transaction in self.file_validation.valid_transactions:
-            created_at, transaction_type, country, currency, net, vat = transaction
-            transaction_count += 1
+    def _insert_transactions(self, transactions):
+        """
+        Save the transactions in batches to optimise database usage when saving many rows.
+
+        Returns the IDs of the new transactions. The database must either return the IDs of bulk
+        inserted rows (eg. PostgreSQL) or be SQLite (see below) - NotSupportedError is raised,
+        before anything is inserted, for any other database (eg. MySQL).
+        """
+        if settings.IMPORT_SKIP_DUPLICATE_ROWS:
+            return self._insert_new_transactions(transactions)
+
+        can_return_ids = connection.features.can_return_rows_from_bulk_insert
+        if not can_return_ids and connection.vendor != 'sqlite':
+            raise _get_unsupported_database_error()
 
+        new_transactions = (
             Transaction(
                 created_at=created_at, transaction_type=transaction_type, country=country,
-                currency=currency, net=net, vat=vat).save()
+                currency=currency, net=net, vat=vat,
+                country_code=Transaction.get_country_code(currency))
+            for created_at, transaction_type, country, currency, net, vat in transactions)
+
+        imported_ids = []
+        transaction_count = 0
+        while True:
+            batch = list(islice(new_transactions, self.batch_size))
+            if not batch:
+                break
+            Transaction.objects.bulk_create(batch)
+            transaction_count += len(batch)
+            if can_return_ids:
+                imported_ids.extend(t.pk for t in batch)
+
+        if can_return_ids or not transaction_count:
+            return imported_ids
+
+        # SQLite doesn't return the IDs of bulk inserted rows but, because SQLite locks the whole
+        # database for writing until this transaction completes, the new rows are guaranteed to be
+        # the last ones in the table
+        last_id = Transaction.objects.aggregate(last_id=Max('id'))['last_id']
+        return range(last_id - transaction_count + 1, last_id + 1)
+
+    def _insert_new_transactions(self, transactions):
+        """
+        Save the transactions that haven't been imported before, ie. that have a new fingerprint.
+
+        Transactions that were already imported are found a batch at a time and skipped, as are
+        repeats within the batch. The transactions are then inserted ignoring conflicts, so a
+        transaction imported by another import in the meantime is skipped by the database.
+
+        Only the transactions actually inserted by this import are counted as imported: the
+        database returns their IDs, where it can (see _insert_ignoring_conflicts). Otherwise they
+        are found by their fingerprints, which is only safe because SQLite locks the database for
+        writing, so no other import can have inserted any of them in the meantime
+        (NotSupportedError is raised for any other database that can't return them).
+
+        Returns the IDs of the new transactions.
+        """
+        if not _can_return_inserted_ids() and connection.vendor != 'sqlite':
+            raise _get_unsupported_database_error()
+
+        imported_ids = []
+        rows = iter(transactions)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+
+            new_transactions = {}
+            for created_at, transaction_type, country, currency, net, vat in batch:
+                fingerprint = Transaction.get_fingerprint(
+                    created_at, transaction_type, country, currency, net, vat)
+                new_transactions[fingerprint] = Transaction(
+                    created_at=created_at, transaction_type=transaction_type, country=country,
+                    currency=currency, net=net, vat=vat,
+                    country_code=Transaction.get_country_code(currency), fingerprint=fingerprint)
+
+            existing_fingerprints = _get_by_fingerprints(list(new_transactions), 'fingerprint')
+            for fingerprint in existing_fingerprints:
+                del new_transactions[fingerprint]
+
+            if not new_transactions:
+                continue
+
+            if _can_return_inserted_ids():
+                imported_ids.extend(_insert_ignoring_conflicts(new_transactions.values()))
+            else:
+                Transaction.objects.bulk_create(new_transactions.values(), ignore_conflicts=True)
+                imported_ids.extend(_get_by_fingerprints(list(new_transactions), 'id'))
+
+        return imported_ids
 
-            # transactions_to_save.append(
-            #     Transaction(
-            #         created_at=created_at, transaction_type=transaction_type, country=country,
-            #         currency=currency, net=net, vat=vat))
+    def _use_postgres_copy(self):
+        # COPY can't skip duplicate transactions
+        return (
+            settings.IMPORT_USE_POSTGRES_COPY and connection.vendor == 'postgresql'
+            and not settings.IMPORT_SKIP_DUPLICATE_ROWS)
 
-        # Save the transactions in batches to optimise database usage when saving many rows at once
-        # batch_size = 100
-        # while True:
-        #     batch = list(islice(transactions_to_save, batch_size))
-        #     if not batch:
-        #         break
-        #     Transaction.objects.bulk_create(batch, batch_size)
+    def _copy_transactions(self, transactions):
+        """
+        Save the transactions using PostgreSQL's COPY command.
+
+        COPY skips the parsing and planning of an INSERT statement per batch, making it the fastest
+        way to load many rows into PostgreSQL. The rows are streamed to the database in CSV format,
+        one batch at a time, so that the whole file never has to be held in memory as CSV.
+
+        COPY doesn't return the IDs of the new rows, so they are allocated from the table's
+        sequence up front and written along with the rest of the data. Returns the IDs of the new
+        transactions.
+        """
+        table = Transaction._meta.db_table
+        columns = [
+            'id', 'created_at', 'transaction_type', 'country', 'currency', 'net', 'vat',
+            'country_code']
+        copy_sql = (
+            f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)')
 
-        self._post_import_updates()
+        imported_ids = []
+        rows = iter(transactions)
+        with connection.cursor() as cursor:
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    break
 
-        return transaction_count
+                cursor.execute(
+                    "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                    [table, len(batch)])
+                batch_ids = [row[0] for row in cursor.fetchall()]
 
-    def _post_validation_updates(self):
-        """Update the validated transactions."""
-        for transaction in self.file_validation.valid_transactions:
-            trx_type = transaction[1]
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for transaction_id, transaction in zip(batch_ids, batch):
+                    created_at, transaction_type, country, currency, net, vat = transaction
+                    writer.writerow([
+                        transaction_id, created_at.isoformat(), transaction_type, country,
+                        currency, net, vat, Transaction.get_country_code(currency)])
+                buffer.seek(0)
+                cursor.copy_expert(copy_sql, buffer)
+                imported_ids.extend(batch_ids)
 
-            if trx_type == TRX_TYPE_PURCHASE:
-                transaction[4] *= -1
-                transaction[5] *= -1
+        return imported_ids
 
     def _post_import_updates(self):
         """Update the newly imported transactions."""
-        TransactionConversionService.convert_to_EUR()
+        TransactionConversionService.convert_to_EUR(self.imported_ids)
+
+
+def _can_return_inserted_ids():
+    return connection.vendor == 'postgresql' or (
+        connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 35))
+
+
+def _get_unsupported_database_error():
+    return NotSupportedError(
+        f'Transactions can\'t be imported into {connection.display_name}, which doesn\'t '
+        'return the IDs of inserted rows')
+
+
+def _insert_ignoring_conflicts(transactions):
+    """
+    Insert the transactions, skipping any whose fingerprint already exists, using INSERT ... ON
+    CONFLICT DO NOTHING RETURNING (PostgreSQL and SQLite 3.35+), which returns the IDs of the
+    inserted rows only.
+
+    Some databases, like SQLite, limit the number of parameters in a query, so the transactions are
+    inserted in batches of the size that bulk_create would use.
+    """
+    table = Transaction._meta.db_table
+    columns = [
+        'created_at', 'transaction_type', 'country', 'currency', 'net', 'vat', 'country_code',
+        'fingerprint']
+    fields = [Transaction._meta.get_field(column) for column in columns]
+    row_sql = f'({", ".join(["%s"] * len(columns))})'
+
+    transactions = list(transactions)
+    batch_size = connection.ops.bulk_batch_size(fields, transactions)
+    inserted_ids = []
+    with connection.cursor() as cursor:
+        for index in range(0, len(transactions), batch_size):
+            batch = transactions[index:index + batch_size]
+            insert_sql = (
+                f'INSERT INTO {table} ({", ".join(columns)}) VALUES '
+                f'{", ".join([row_sql] * len(batch))} ON CONFLICT (fingerprint) DO NOTHING '
+                'RETURNING id')
+
+            parameters = []
+            for transaction in batch:
+                parameters.extend(
+                    field.get_db_prep_save(getattr(transaction, field.attname), connection)
+                    for field in fields)
+            cursor.execute(insert_sql, parameters)
+            inserted_ids.extend(row[0] for row in cursor.fetchall())
+
+    return inserted_ids
+
+
+def _get_by_fingerprints(fingerprints, field):
+    """Return the field of the transactions with the given fingerprints."""
+    # Some databases, like SQLite, limit the number of parameters in a query
+    query_size = connection.ops.bulk_batch_size(['fingerprint'], fingerprints)
+    values = []
+    for index in range(0, len(fingerprints), query_size):
+        values.extend(Transaction.objects.filter(
+            fingerprint__in=fingerprints[index:index + query_size]).values_list(field, flat=True))
+
+    return values
+
+
+def get_import_result(imported, successful_rows, transaction_count, validation_errors):
+    """
+    Return the summary of an import, as returned to the API partner.
+
+    The errors are given in full ("errors") or summarised ("error_summary"), depending on the
+    validation errors (see api.lib.validation_errors).
+    """
+    invalid_row_count = len(validation_errors)
+    if imported:
+        message = f'{successful_rows} / {transaction_count} row(s) were successfully imported'
+        if invalid_row_count:
+            message = f'{message}, {invalid_row_count} invalid row(s) were ignored'
+
+        return {
+            'success': True,
+            'message': message,
+            **validation_errors.get_result()
+        }
+
+    if validation_errors.is_full:
+        message = (
+            f'Validation stopped after {invalid_row_count} error(s) (the "max_errors" limit) - '
+            'nothing was imported')
+    else:
+        message = (
+            f'There were {invalid_row_count} / {transaction_count} invalid row(s) preventing '
+            'the import of the data - try setting the "ignore_errors" flag to True to import '
+            'all valid transactions and ignore the invalid transactions')
+
+    return {
+        'success': False,
+        'message': message,
+        **validation_errors.get_result()
+    }
@@ -1,4 +1,18 @@
-from api.lib.validators import VALIDATORS, ValidationError
+import heapq
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import compress, islice
+
+from django.conf import settings
+
+from api.lib.garbage_collection import gc_paused
+from api.lib.import_schemas import ROW_VALIDATION_ERRORS, get_import_schema, get_row_errors
+from api.lib.validation_errors import ValidationErrorList
+from api.lib.validators import validate_column
+
+VALIDATION_MODE_ROWS = 'rows'
+VALIDATION_MODE_COLUMNS = 'columns'
 
 
 class FileValidationService():
@@ -8,48 +22,225 @@ class FileValidationService():
     It will also co-erce and prepare any data for import to the database.
     NOTE! The cleaning up could be done in a separate service but it's use is so intertwined with
           validating the data that it makes more sense to combine both functions in this service.
+
+    The data can either be validated row-by-row or column-by-column (the default, see
+    FILE_VALIDATION_MODE). Both produce exactly the same results but validating a whole column at a
+    time is much faster for large files, where the same values are repeated many times. Files whose
+    schema has a pre_validate hook are always validated row-by-row.
+
+    Files with at least PARALLEL_VALIDATION_THRESHOLD rows are split into shards of consecutive
+    rows which are validated at the same time by PARALLEL_VALIDATION_WORKERS processes.
+
+    The errors are added to the given validation errors (see api.lib.validation_errors), which
+    either keep every error or summarise them. Once they have max_errors errors, no more errors are
+    added and validation stops, so a hopelessly bad file fails fast. Validating column-by-column
+    stops at the column where the errors found so far reach max_errors and the rows up to the last
+    of them are validated again row-by-row, so the errors are still exactly those that would be
+    found validating the file row-by-row.
     """
 
-    def __init__(self, transaction_data):
+    def __init__(
+            self, transaction_data, mode=None, row_offset=0, parallel=True,
+            validation_errors=None):
+        """
+        row_offset: the row number of the first transaction, when validating part of a larger file
+        parallel: False if the file should never be validated by multiple processes
+        validation_errors: the validation errors to add the errors to, eg. the errors of the
+                           previous parts of a larger file (by default, a new ValidationErrorList)
+        """
         self.transaction_data = transaction_data
+        self.mode = mode or settings.FILE_VALIDATION_MODE
+        self.row_offset = row_offset
+        self.parallel = parallel
         self.valid_transactions = []
-        self.validation_errors = []
+        self.validation_errors = (
+            validation_errors if validation_errors is not None else ValidationErrorList())
 
-    def validate(self, field_structure):
+    def validate(self, schema):
         """
         Validate the given transaction data and return the success/failure and errors.
 
-        field_structure: a list of values describing the fields in the order that they occur in:
-                         - "date": a date value in the format: YYYY/MM/DD
-                         - "trx_type": a string value from a particular set
-                         - "country": a string value from a particular list of countries
-                         - "currency": a string value denoting a particular countries currency code
-                         - "money": a floating number used to denote a monetary value
+        schema: the ImportSchema describing the fields in the order that they occur in, eg.
+                - "date": a date value in the format: YYYY/MM/DD
+                - "trx_type": a string value from a particular set
+                - "country": a string value from a particular list of countries
+                - "currency": a string value denoting a particular countries currency code
+                - "money": a floating number used to denote a monetary value
 
-        The output shall be in the format:
-        (True (if all valid) or False (contains at least one invalid row), list of errors)
+        The valid transactions are the tuples of the schema's transaction columns, after its hooks.
+
+        The output shall be True if all of the rows are valid, or False if at least one of them
+        isn't (and their errors have been added to the validation errors).
         """
+        error_count = len(self.validation_errors)
+
+        # Column-by-column validation relies on every row having a value for every field
+        if self._use_parallel_validation():
+            self.valid_transactions = self._validate_in_parallel(schema)
+        elif (
+                self.mode == VALIDATION_MODE_COLUMNS and not schema.pre_validate
+                and self._has_all_fields(schema)):
+            self.valid_transactions = self._validate_columns(schema)
+        else:
+            self.valid_transactions = self._validate_rows(schema)
+
+        return len(self.validation_errors) == error_count
+
+    def _use_parallel_validation(self):
+        return (
+            self.parallel
+            and self._parallel_worker_count() > 1
+            and len(self.transaction_data) >= settings.PARALLEL_VALIDATION_THRESHOLD)
+
+    def _parallel_worker_count(self):
+        return settings.PARALLEL_VALIDATION_WORKERS or os.cpu_count() or 1
+
+    def _validate_in_parallel(self, schema):
+        worker_count = self._parallel_worker_count()
+        shard_size = -(-len(self.transaction_data) // worker_count)
+        shard_starts = range(0, len(self.transaction_data), shard_size)
+
+        errors = self.validation_errors
+        with ProcessPoolExecutor(worker_count, initializer=_initialise_worker) as executor:
+            shard_results = executor.map(_validate_shard, [
+                (self.transaction_data[start:start + shard_size], schema.name, self.mode,
+                 self.row_offset + start, errors.max_errors)
+                for start in shard_starts])
+
+            # The shards are in their original order, so the rows and errors will be too
+            valid_transactions = []
+            for shard_valid_transactions, shard_errors in shard_results:
+                valid_transactions.extend(shard_valid_transactions)
+                for error in shard_errors:
+                    if errors.is_full:
+                        break
+                    errors.add(*error)
+
+        return valid_transactions
+
+    def _validate_rows(self, schema, row_count=None):
+        # Each row is validated by the schema's compiled row validator and only the rows it rejects
+        # are validated again, value-by-value, to find out what is wrong with them
+        validate_row = schema.row_validator
         valid_transactions = []
-        errors = []
-
-        for row_number, transaction in enumerate(self.transaction_data):
-            row = []
-            row_errors = []
-
-            # Validate each transaction column-by-column
-            for column_number, field_value in enumerate(transaction):
-                field_type = field_structure[column_number]
-                try:
-                    clean_value = VALIDATORS[field_type](field_value)
-                    row.append(clean_value)
-                except ValidationError as e:
-                    row_errors.append([row_number, field_value, str(e)])
-
-            if row_errors:
-                errors.extend(row_errors)
-            else:
-                valid_transactions.append(row)
-
-        self.valid_transactions = valid_transactions
-        self.validation_errors = errors
-        return bool(errors == [])
+        errors = self.validation_errors
+        if errors.is_full:
+            return valid_transactions
+
+        transaction_data = islice(self.transaction_data, row_count)
+        for row_number, transaction in enumerate(transaction_data, self.row_offset):
+            try:
+                valid_transactions.append(validate_row(transaction))
+            except ROW_VALIDATION_ERRORS:
+                row_errors = get_row_errors(schema, transaction)
+                if not row_errors:
+                    raise
+                for column_number, field_value, message, code in row_errors:
+                    errors.add(row_number, column_number, field_value, message, code)
+                    if errors.is_full:
+                        return valid_transactions
+
+        return valid_transactions
+
+    def _validate_columns(self, schema):
+        # Many objects are created in quick succession here, so the garbage collector is paused
+        # until the validation has finished
+        with gc_paused():
+            return self._validate_column_values(schema)
+
+    def _validate_column_values(self, schema):
+        validation_errors = self.validation_errors
+        if validation_errors.is_full:
+            return []
+
+        error_limit = None
+        if validation_errors.max_errors is not None:
+            error_limit = validation_errors.max_errors - len(validation_errors)
+        error_count = 0
+
+        clean_columns = []
+        column_errors = []
+        invalid_row_numbers = set()
+
+        for column_number, column in enumerate(zip(*self.transaction_data)):
+            field_type = schema.field_structure[column_number]
+            if field_type is None:
+                clean_columns.append(column)
+                continue
+
+            clean_column, errors = validate_column(field_type, column)
+            clean_columns.append(clean_column)
+
+            if errors:
+                invalid_row_numbers.update(row_number for row_number, _, _ in errors)
+                column_errors.append(_get_column_errors(column_number, column, errors))
+
+                error_count += len(errors)
+                if error_limit is not None and error_count >= error_limit:
+                    return self._validate_first_errors(schema, column_errors, error_limit)
+
+        # Report the errors in the same order as they would be found when validating row-by-row,
+        # merging the errors of each column (which are in row order already) rather than sorting
+        # all of them
+        for row_number, column_number, field_value, message, code in heapq.merge(*column_errors):
+            validation_errors.add(
+                row_number + self.row_offset, column_number, field_value, message, code)
+
+        if invalid_row_numbers:
+            is_valid = [
+                row_number not in invalid_row_numbers
+                for row_number in range(len(self.transaction_data))]
+            clean_columns = [list(compress(column, is_valid)) for column in clean_columns]
+        return self._to_transactions(schema, clean_columns)
+
+    def _validate_first_errors(self, schema, column_errors, error_limit):
+        """
+        Stop validating column-by-column once the errors found so far would fill the validation
+        errors, and find the errors that fill them by validating row-by-row instead.
+
+        The errors in the columns that haven't been validated yet can only come before some of the
+        errors found so far, so the errors that fill the validation errors are all in the rows up
+        to the one with the last of the first error_limit errors (in row order) found so far - and
+        only those rows are validated again.
+        """
+        last_row_number = list(islice(heapq.merge(*column_errors), error_limit))[-1][0]
+        return self._validate_rows(schema, row_count=last_row_number + 1)
+
+    def _to_transactions(self, schema, columns):
+        """Return the valid transactions, given the clean values of the file's columns."""
+        transactions = zip(*[columns[column_number] for column_number in schema.column_order])
+        if schema.post_validate:
+            return list(map(schema.post_validate, transactions))
+        return list(transactions)
+
+    def _has_all_fields(self, schema):
+        return set(map(len, self.transaction_data)) <= {len(schema.columns)}
+
+
+def _initialise_worker():
+    # Worker processes that weren't forked from a process running Django still need to set it up
+    import django
+    django.setup()
+
+
+def _get_column_errors(column_number, column, errors):
+    """Return the (row number, column number, value, error, code) of each error of a column."""
+    return (
+        (row_number, column_number, column[row_number], message, code)
+        for row_number, message, code in errors)
+
+
+class _ShardValidationErrors(ValidationErrorList):
+    """The errors of a shard, kept as they were added so they can be added to the file's errors."""
+
+    def add(self, *error):
+        self.append(error)
+
+
+def _validate_shard(shard):
+    transaction_data, schema_name, mode, row_offset, max_errors = shard
+    file_validation = FileValidationService(
+        transaction_data, mode=mode, row_offset=row_offset, parallel=False,
+        validation_errors=_ShardValidationErrors(max_errors))
+    file_validation.validate(get_import_schema(schema_name))
+    return file_validation.valid_transactions, file_validation.validation_errors
@@ -0,0 +1,35 @@
+import gc
+import threading
+
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_pause_count = 0
+_was_enabled = False
+
+
+@contextmanager
+def gc_paused():
+    """
+    Pause Python's garbage collector while creating many objects in quick succession (eg. decoding
+    or validating a large import), which would otherwise make it repeatedly scan all of the
+    objects created so far.
+
+    The garbage collector is a setting of the whole process, so it is paused by the first thread to
+    enter and only resumed once every thread has left - and only if it was enabled to begin with.
+    """
+    global _pause_count, _was_enabled
+
+    with _lock:
+        if _pause_count == 0:
+            _was_enabled = gc.isenabled()
+            gc.disable()
+        _pause_count += 1
+
+    try:
+        yield
+    finally:
+        with _lock:
+            _pause_count -= 1
+            if _pause_count == 0 and _was_enabled:
+                gc.enable()
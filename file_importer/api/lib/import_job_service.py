@@ -0,0 +1,179 @@
+import contextlib
+import logging
+import os
+
+from django.conf import settings
+from django.db import OperationalError
+from django.db.transaction import atomic
+from django.utils import timezone
+from itertools import islice
+
+from api.lib.codecs import JSON
+from api.lib.file_import_service import FileImportService, get_import_result
+from api.lib.import_schemas import get_import_schema
+from api.lib.streaming_import_service import StreamingImportService, read_ndjson_rows
+from api.lib.validation_errors import ERROR_REPORT_INLINE, ValidationErrorList, \
+    create_validation_errors
+from api.models import ImportJob
+
+logger = logging.getLogger(__name__)
+
+
+class ImportJobReclaimed(Exception):
+    """Raised when the job being run has been claimed again by another worker."""
+
+    pass
+
+
+class ImportJobService():
+    """
+    This will handle importing transaction data in the background, as an import job.
+
+    The transaction data is saved to a file in IMPORT_JOB_DIR and the job added to a queue (the
+    ImportJob table) to be run by one of the workers started with the process_import_jobs command.
+
+    A job is run in two passes over its file, so that it never holds a database transaction (and,
+    on SQLite, the database's write lock) for longer than it takes to save one window of rows:
+    - every row is validated without saving anything, so a file that can't be imported is
+      rejected without having saved any of it
+    - the valid transactions are then saved a window of IMPORT_STREAM_WINDOW_SIZE rows at a time,
+      each window in its own database transaction, along with the job's progress
+
+    The job's progress (and its heartbeat) is saved after every window, so a job whose worker was
+    stopped is claimed again by another worker (see ImportJobManager.claim_next_job), which resumes
+    it from the last window that was saved.
+    """
+
+    @classmethod
+    def create_job(
+            cls, api_partner_id, transaction_data, ignore_errors, ignore_first_row, schema=None,
+            error_report=None, max_errors=None):
+        """Save the transaction data and add an import job for it to the queue."""
+        job = ImportJob(
+            api_partner_id=api_partner_id, ignore_errors=ignore_errors,
+            ignore_first_row=ignore_first_row, import_schema=(schema or get_import_schema()).name,
+            error_report=error_report or ERROR_REPORT_INLINE, max_errors=max_errors)
+
+        os.makedirs(settings.IMPORT_JOB_DIR, exist_ok=True)
+        job.payload_path = os.path.join(settings.IMPORT_JOB_DIR, f'{job.job_id}.ndjson')
+        with open(job.payload_path, 'wb') as payload_file:
+            for transaction in transaction_data:
+                payload_file.write(JSON.encode(transaction))
+                payload_file.write(b'\n')
+
+        job.save()
+        return job
+
+    @classmethod
+    def run_job(cls, job):
+        """
+        Import the transaction data of a job that has been claimed from the queue.
+
+        Operational database errors, eg. SQLite's "database is locked", are raised rather than
+        failing the job, as they are usually temporary - the job is claimed again (and resumed)
+        once its heartbeat is stale.
+        """
+        try:
+            with open(job.payload_path, 'rb') as payload_file:
+                result = cls._import_payload(job, payload_file)
+        except ImportJobReclaimed:
+            logger.warning(f'Import job {job.job_id} was claimed again by another worker')
+            return
+        except OperationalError:
+            raise
+        except Exception:
+            logger.exception(f'Import job {job.job_id} failed')
+            result = {
+                'status': ImportJob.STATUS_FAILED, 'success': False,
+                'message': 'The import failed unexpectedly'}
+
+        if not ImportJob.objects.update_claimed_job(job, finished_at=timezone.now(), **result):
+            logger.warning(f'Import job {job.job_id} was claimed again by another worker')
+            return
+
+        # The payload is missing if that's why the job failed
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(job.payload_path)
+
+    @classmethod
+    def get_job_status(cls, job):
+        """Return the status of the job, including its progress so far if it is still running."""
+        status = {
+            'job_id': str(job.job_id),
+            'status': job.status,
+            'rows_validated': job.rows_validated,
+            'rows_inserted': job.rows_inserted,
+            'error_count': job.error_count
+        }
+
+        if job.status in (ImportJob.STATUS_COMPLETED, ImportJob.STATUS_FAILED):
+            status.update({'success': job.success, 'message': job.message})
+            if job.error_summary is not None:
+                status['error_summary'] = job.error_summary
+            else:
+                status['errors'] = job.errors
+
+        return status
+
+    @classmethod
+    def _import_payload(cls, job, payload_file):
+        """Validate and then save the transaction data of a job, returning its result."""
+        schema = get_import_schema(job.import_schema)
+        streaming_import_service = StreamingImportService(
+            read_ndjson_rows(payload_file), job.ignore_first_row,
+            on_progress=lambda service: cls._save_progress(
+                job, rows_validated=service.transaction_count,
+                error_count=len(service.validation_errors)),
+            schema=schema,
+            validation_errors=create_validation_errors(
+                job.api_partner_id, job.error_report, job.max_errors))
+        imported = streaming_import_service.validate_transactions(job.ignore_errors)
+        if imported:
+            payload_file.seek(0)
+            cls._save_transactions(job, read_ndjson_rows(payload_file), schema)
+
+        validation_errors = streaming_import_service.validation_errors
+        result = get_import_result(
+            imported, job.rows_inserted, streaming_import_service.transaction_count,
+            validation_errors)
+        return {
+            'status': ImportJob.STATUS_COMPLETED,
+            'rows_validated': streaming_import_service.transaction_count,
+            'error_count': len(validation_errors),
+            'success': result['success'],
+            'message': result['message'],
+            'errors': result.get('errors', []),
+            'error_summary': result.get('error_summary')
+        }
+
+    @classmethod
+    def _save_transactions(cls, job, rows, schema):
+        """Save the valid transactions of a job, a window of rows at a time."""
+        if job.ignore_first_row:
+            next(rows, None)
+
+        # A job that was interrupted is resumed after the last window of rows it saved
+        rows = islice(rows, job.rows_saved, None)
+        row_offset = job.rows_saved
+        while True:
+            window = list(islice(rows, settings.IMPORT_STREAM_WINDOW_SIZE))
+            if not window:
+                return
+
+            # The errors of any invalid rows (which are ignored) were found by the first pass
+            file_import_service = FileImportService(
+                window, ignore_first_row=False, row_offset=row_offset, schema=schema,
+                validation_errors=ValidationErrorList())
+            file_import_service.validate_transaction_data()
+            row_offset += len(window)
+
+            with atomic():
+                imported_count = file_import_service.save_transactions(
+                    ignore_invalid_transactions=True)
+                cls._save_progress(
+                    job, rows_saved=row_offset, rows_inserted=job.rows_inserted + imported_count)
+
+    @classmethod
+    def _save_progress(cls, job, **progress):
+        if not ImportJob.objects.update_claimed_job(job, **progress):
+            raise ImportJobReclaimed()
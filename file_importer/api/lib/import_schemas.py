@@ -0,0 +1,186 @@
+from decimal import Decimal
+
+from django.conf import settings
+
+from api.lib.file_import_fields import FIELD_COUNTRY, FIELD_CURRENCY, FIELD_DATE, FIELD_MONEY, \
+    FIELD_TRX_TYPE, TRX_TYPE_PURCHASE
+from api.lib.validators import VALIDATORS, ValidationError, parse_date
+
+# The values of a transaction, in the order they are saved in (see FileImportService)
+TRANSACTION_COLUMNS = ('created_at', 'transaction_type', 'country', 'currency', 'net', 'vat')
+
+# Quicker versions of the validators, used by compiled row validators, which return the same clean
+# value for a valid value but raise a ValueError or ArithmeticError, without describing the
+# problem, for an invalid value. Rows with an invalid value are validated again with VALIDATORS
+FAST_VALIDATORS = {
+    FIELD_DATE: parse_date,
+    FIELD_MONEY: Decimal
+}
+
+# The exceptions that mean that a row is invalid, when raised by a compiled row validator
+ROW_VALIDATION_ERRORS = (ValidationError, ValueError, ArithmeticError)
+
+IMPORT_SCHEMAS = {}
+
+
+class ImportSchema():
+    """
+    The layout of an import file - what is in each column - and how its rows become transactions.
+
+    Each column of the file is described by a (transaction column, field type) pair, where the
+    transaction column is one of TRANSACTION_COLUMNS, or None if the column isn't imported (but is
+    still validated as the field type, if it has one). The columns can be in any order but every
+    transaction column must be in exactly one of them.
+
+    The schema is compiled into a row validator (see compile_row_validator) the first time it is
+    used, so new file layouts can be imported as quickly as any other.
+    """
+
+    def __init__(self, name, columns, pre_validate=None, post_validate=None):
+        """
+        pre_validate: an optional function given each row, as it is in the file, which returns the
+                      row to validate instead (eg. to split a combined column)
+        post_validate: an optional function given each valid transaction, as a tuple of
+                       TRANSACTION_COLUMNS, which returns the transaction to save instead (eg.
+                       making the amounts of purchases negative)
+        """
+        imported_columns = [column for column, _ in columns if column is not None]
+        if sorted(imported_columns) != sorted(TRANSACTION_COLUMNS):
+            raise ValueError(
+                f'Import schema "{name}" must have exactly one column for each of: '
+                f'{", ".join(TRANSACTION_COLUMNS)}')
+        if any(field_type is None for column, field_type in columns if column is not None):
+            raise ValueError(
+                f'Import schema "{name}" must have a field type for every column it imports')
+
+        self.name = name
+        self.columns = columns
+        self.pre_validate = pre_validate
+        self.post_validate = post_validate
+        self._row_validator = None
+
+    @property
+    def field_structure(self):
+        """The field type of each column of the file, in order."""
+        return [field_type for _, field_type in self.columns]
+
+    @property
+    def column_order(self):
+        """The number of the file's column for each of TRANSACTION_COLUMNS, in order."""
+        column_numbers = {column: number for number, (column, _) in enumerate(self.columns)}
+        return [column_numbers[column] for column in TRANSACTION_COLUMNS]
+
+    @property
+    def row_validator(self):
+        if self._row_validator is None:
+            self._row_validator = compile_row_validator(self)
+        return self._row_validator
+
+
+def compile_row_validator(schema):
+    """
+    Return a function which validates a row of the schema's file, returning its transaction.
+
+    The function is generated for the schema, so that every column's validator, the order of the
+    transaction's values and the hooks are written into it rather than looked up for every value,
+    eg. for the VAT schema it is equivalent to:
+
+        def validate_row(row):
+            value_0, value_1, value_2, value_3, value_4, value_5 = row
+            return post_validate((
+                validate_0(value_0), validate_1(value_1), validate_2(value_2),
+                validate_3(value_3), validate_4(value_4), validate_5(value_5)))
+
+    An invalid row (including one with the wrong number of values) raises one of
+    ROW_VALIDATION_ERRORS, which doesn't necessarily describe the problem - see get_row_errors.
+    """
+    namespace = {'pre_validate': schema.pre_validate, 'post_validate': schema.post_validate}
+    values = []
+    clean_values = {}
+    for column_number, (column, field_type) in enumerate(schema.columns):
+        value = f'value_{column_number}'
+        values.append(value)
+        if field_type is None:
+            continue
+
+        namespace[f'validate_{column_number}'] = (
+            FAST_VALIDATORS.get(field_type) or VALIDATORS[field_type])
+        clean_value = f'validate_{column_number}({value})'
+        if column is None:
+            # Columns that aren't imported are still validated
+            clean_value = f'_{column_number} = {clean_value}'
+        clean_values[column if column is not None else column_number] = clean_value
+
+    transaction = ', '.join(clean_values[column] for column in TRANSACTION_COLUMNS)
+    if schema.post_validate:
+        transaction = f'post_validate(({transaction},))'
+    else:
+        transaction = f'({transaction},)'
+
+    lines = ['def validate_row(row):']
+    if schema.pre_validate:
+        lines.append('    row = pre_validate(row)')
+    lines.append(f'    {", ".join(values)}, = row')
+    lines.extend(
+        f'    {clean_value}' for key, clean_value in clean_values.items() if isinstance(key, int))
+    lines.append(f'    return {transaction}')
+
+    exec(compile('\n'.join(lines), f'<import schema {schema.name}>', 'exec'), namespace)
+    return namespace['validate_row']
+
+
+def get_row_errors(schema, row):
+    """
+    Return the (column number, value, error, code) of each problem with a row, for a row that a row
+    validator rejected. Problems with the row as a whole have no column number.
+
+    Each value is validated separately so that every invalid value in the row is described.
+    """
+    if schema.pre_validate:
+        row = schema.pre_validate(row)
+
+    errors = []
+    for column_number, (field_type, value) in enumerate(zip(schema.field_structure, row)):
+        if field_type is None:
+            continue
+        try:
+            VALIDATORS[field_type](value)
+        except ValidationError as e:
+            errors.append((column_number, value, str(e), e.code))
+
+    if len(row) != len(schema.columns):
+        errors.append((
+            None, row,
+            f'transaction ({len(row)} values) does not have the expected number of values - must '
+            f'have {len(schema.columns)} values', 'wrong_value_count'))
+
+    return errors
+
+
+def register_import_schema(schema):
+    """Make the schema available to imports, by name."""
+    IMPORT_SCHEMAS[schema.name] = schema
+    return schema
+
+
+def get_import_schema(name=None):
+    """Return the registered schema with the given name (or DEFAULT_IMPORT_SCHEMA), or None."""
+    return IMPORT_SCHEMAS.get(name or settings.DEFAULT_IMPORT_SCHEMA)
+
+
+def negate_purchase_amounts(transaction):
+    """Make the amounts of a purchase negative, so that they are deducted from the sales."""
+    if transaction[1] != TRX_TYPE_PURCHASE:
+        return transaction
+
+    created_at, transaction_type, country, currency, net, vat = transaction
+    return created_at, transaction_type, country, currency, net.copy_negate(), vat.copy_negate()
+
+
+# The original VAT import file: date, transaction type, country, currency, net and VAT amounts
+register_import_schema(ImportSchema(
+    'vat', [
+        ('created_at', FIELD_DATE), ('transaction_type', FIELD_TRX_TYPE),
+        ('country', FIELD_COUNTRY), ('currency', FIELD_CURRENCY), ('net', FIELD_MONEY),
+        ('vat', FIELD_MONEY)],
+    post_validate=negate_purchase_amounts))
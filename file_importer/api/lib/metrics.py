@@ -0,0 +1,201 @@
+import bisect
+import contextvars
+import threading
+import time
+
+from contextlib import contextmanager
+
+METRIC_PREFIX = 'file_importer'
+
+# The upper bounds (in seconds) of the buckets that request and stage durations are counted in
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRIC_DESCRIPTIONS = {
+    'requests_total': ('counter', 'The number of requests handled'),
+    'request_seconds': ('histogram', 'The time taken to handle a request'),
+    'request_queries_total': ('counter', 'The number of database queries made by requests'),
+    'request_bytes_total': ('counter', 'The number of bytes received in request bodies'),
+    'response_bytes_total': ('counter', 'The number of bytes sent in response bodies'),
+    'stage_seconds': ('histogram', 'The time taken by each stage of a request'),
+    'stage_queries_total': ('counter', 'The number of database queries made by each stage'),
+    'rows_total': ('counter', 'The number of transaction rows handled by each stage'),
+}
+
+_current_request = contextvars.ContextVar('request_metrics', default=None)
+
+
+class MetricsRegistry():
+    """
+    The counters and histograms of this process, which can be exported in Prometheus' text format.
+
+    Every process has its own metrics, so each process (eg. each web server worker) must be scraped
+    separately.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def increment(self, name, labels, value=1):
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        # A histogram is the count of observations in each bucket, the count above the last bucket,
+        # then the sum of the observations
+        key = (name, tuple(labels.items()))
+        bucket = bisect.bisect_left(DURATION_BUCKETS, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(DURATION_BUCKETS) + 2)
+            histogram[bucket] += 1
+            histogram[-1] += value
+
+    def export(self):
+        """Return all of the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(histogram) for key, histogram in self._histograms.items()}
+
+        lines = []
+        for name, (metric_type, description) in METRIC_DESCRIPTIONS.items():
+            metric_name = f'{METRIC_PREFIX}_{name}'
+            lines.append(f'# HELP {metric_name} {description}')
+            lines.append(f'# TYPE {metric_name} {metric_type}')
+
+            for (counter_name, labels), value in sorted(counters.items()):
+                if counter_name == name:
+                    lines.append(f'{metric_name}{_format_labels(labels)} {value}')
+
+            for (histogram_name, labels), histogram in sorted(histograms.items()):
+                if histogram_name != name:
+                    continue
+
+                cumulative_count = 0
+                for upper_bound, count in zip(DURATION_BUCKETS + ('+Inf',), histogram):
+                    cumulative_count += count
+                    bucket_labels = labels + (('le', str(upper_bound)),)
+                    lines.append(
+                        f'{metric_name}_bucket{_format_labels(bucket_labels)} {cumulative_count}')
+                lines.append(f'{metric_name}_sum{_format_labels(labels)} {histogram[-1]:.6f}')
+                lines.append(f'{metric_name}_count{_format_labels(labels)} {cumulative_count}')
+
+        return '\n'.join(lines) + '\n'
+
+
+class RequestMetrics():
+    """
+    The measurements of a single request, which are added to the registry once it has finished.
+
+    Stages that happen more than once in a request (eg. validating each window of a streamed
+    import) are added together.
+    """
+
+    def __init__(self):
+        self.view = None
+        self.query_count = 0
+        self.stages = {}
+        self.rows = {}
+
+    def add_stage(self, stage, seconds, query_count):
+        stage_seconds, stage_query_count = self.stages.get(stage, (0, 0))
+        self.stages[stage] = (stage_seconds + seconds, stage_query_count + query_count)
+
+    def get_server_timing(self, seconds):
+        """Return the stages of the request as the value of a Server-Timing header."""
+        timings = [
+            f'{stage};dur={stage_seconds * 1000:.1f};desc="{query_count} queries"'
+            for stage, (stage_seconds, query_count) in self.stages.items()]
+        timings.append(f'total;dur={seconds * 1000:.1f};desc="{self.query_count} queries"')
+        return ', '.join(timings)
+
+    def record(self, registry, status_code, seconds, request_bytes):
+        view_labels = {'view': self.view}
+        registry.increment('requests_total', {**view_labels, 'status': str(status_code)})
+        registry.observe('request_seconds', view_labels, seconds)
+        registry.increment('request_queries_total', view_labels, self.query_count)
+        registry.increment('request_bytes_total', view_labels, request_bytes)
+
+        for stage, (stage_seconds, query_count) in self.stages.items():
+            stage_labels = {**view_labels, 'stage': stage}
+            registry.observe('stage_seconds', stage_labels, stage_seconds)
+            registry.increment('stage_queries_total', stage_labels, query_count)
+
+        for stage, row_count in self.rows.items():
+            registry.increment('rows_total', {**view_labels, 'stage': stage}, row_count)
+
+
+@contextmanager
+def timed(stage):
+    """
+    Time a stage of the current request, along with the database queries it makes.
+
+    Stages can be nested, eg. a query's "read" stage is part of its "cache" stage when the response
+    isn't already cached. Outside of a request (eg. in an import job worker) this does nothing.
+    """
+    request_metrics = _current_request.get()
+    if request_metrics is None:
+        yield
+        return
+
+    query_count = request_metrics.query_count
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        request_metrics.add_stage(
+            stage, time.perf_counter() - start_time, request_metrics.query_count - query_count)
+
+
+def count_query(execute, sql, params, many, context):
+    """Count a database query made by the current request (see install_query_counter)."""
+    request_metrics = _current_request.get()
+    if request_metrics is not None:
+        request_metrics.query_count += 1
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(sender, connection, **kwargs):
+    """
+    Count the queries made on every new database connection (a connection_created receiver).
+
+    The queries are counted by the connection, rather than by the request, because the queries of
+    async views are made by whichever thread of the thread pool runs them.
+    """
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def count_rows(stage, row_count):
+    """Count the transaction rows handled by a stage of the current request."""
+    request_metrics = _current_request.get()
+    if request_metrics is not None:
+        request_metrics.rows[stage] = request_metrics.rows.get(stage, 0) + row_count
+
+
+def start_request():
+    """Start measuring a request, returning its metrics and the token to finish it with."""
+    request_metrics = RequestMetrics()
+    return request_metrics, _current_request.set(request_metrics)
+
+
+def finish_request(token):
+    _current_request.reset(token)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    formatted_labels = ','.join(
+        f'{name}="{_escape_label_value(value)}"' for name, value in labels)
+    return f'{{{formatted_labels}}}'
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+METRICS = MetricsRegistry()
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import threading
+import uuid
+
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+
+QUERY_CACHE_LOCAL = 'local'
+QUERY_CACHE_DJANGO = 'django'
+
+
+class LocalQueryCache():
+    """
+    Cache encoded query responses in this process's memory.
+
+    The least recently used responses are evicted once the responses take up more than max_bytes.
+    This is the fastest cache but each process has its own, so it's only suitable when transactions
+    are imported by the same (single) process that queries them - otherwise imports by other
+    processes, eg. import job workers, won't invalidate it.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._responses = OrderedDict()
+        self._keys_by_day = {}
+        self._generations = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get_or_set(self, country_code, query_date, parameters, get_response):
+        day = _get_day(country_code, query_date)
+        key = (day, _get_parameters_key(parameters))
+        with self._lock:
+            response = self._responses.get(key)
+            if response is not None:
+                self._responses.move_to_end(key)
+                return response
+            generation = self._generations.get(day, 0)
+
+        response = get_response()
+
+        # The response is only cached if the day wasn't invalidated while it was being built, as it
+        # may have been built from the transactions as they were before the import
+        with self._lock:
+            if self._generations.get(day, 0) == generation and len(response) <= self.max_bytes:
+                self._set(key, response)
+
+        return response
+
+    def invalidate(self, days):
+        with self._lock:
+            for country_code, query_date in days:
+                day = _get_day(country_code, query_date)
+                self._generations[day] = self._generations.get(day, 0) + 1
+                for key in self._keys_by_day.pop(day, ()):
+                    self._size -= len(self._responses.pop(key))
+
+    def _set(self, key, response):
+        if key in self._responses:
+            self._size -= len(self._responses[key])
+        self._responses[key] = response
+        self._keys_by_day.setdefault(key[0], set()).add(key)
+        self._size += len(response)
+
+        while self._size > self.max_bytes:
+            evicted_key, evicted_response = self._responses.popitem(last=False)
+            self._keys_by_day[evicted_key[0]].discard(evicted_key)
+            if not self._keys_by_day[evicted_key[0]]:
+                del self._keys_by_day[evicted_key[0]]
+            self._size -= len(evicted_response)
+
+
+class DjangoQueryCache():
+    """
+    Cache encoded query responses in one of the Django caches (see CACHES).
+
+    Size limits and eviction are left to the cache backend. Every (country code, date) has a
+    version, which is part of the key of its responses, and is invalidated by giving it a new
+    version, so that its responses can no longer be found - rather than having to find and delete
+    every one of them.
+    """
+
+    def __init__(self, cache_alias, timeout):
+        self.cache = caches[cache_alias]
+        self.timeout = timeout
+
+    def get_or_set(self, country_code, query_date, parameters, get_response):
+        day = _get_day(country_code, query_date)
+
+        # The version is read before the response is built so that, if the day is invalidated while
+        # it is being built, it's cached under the old version where it will never be found
+        version = self.cache.get_or_set(self._version_key(day), uuid.uuid4().hex, timeout=None)
+        key = f'query_cache:{day[0]}:{day[1]}:{version}:{_get_parameters_key(parameters)}'
+
+        response = self.cache.get(key)
+        if response is None:
+            response = get_response()
+            self.cache.set(key, response, timeout=self.timeout)
+
+        return response
+
+    def invalidate(self, days):
+        self.cache.set_many(
+            {self._version_key(_get_day(*day)): uuid.uuid4().hex for day in set(days)},
+            timeout=None)
+
+    def _version_key(self, day):
+        return f'query_cache_version:{day[0]}:{day[1]}'
+
+
+class NoQueryCache():
+    """Don't cache query responses."""
+
+    def get_or_set(self, country_code, query_date, parameters, get_response):
+        return get_response()
+
+    def invalidate(self, days):
+        pass
+
+
+def get_query_cache():
+    """Return the query cache configured by QUERY_CACHE_BACKEND."""
+    if settings.QUERY_CACHE_BACKEND == QUERY_CACHE_LOCAL:
+        return LocalQueryCache(settings.QUERY_CACHE_MAX_BYTES)
+
+    if settings.QUERY_CACHE_BACKEND == QUERY_CACHE_DJANGO:
+        return DjangoQueryCache(settings.QUERY_CACHE_ALIAS, settings.QUERY_CACHE_TIMEOUT)
+
+    return NoQueryCache()
+
+
+def _get_day(country_code, query_date):
+    # Queries are made with datetimes and imports deal in dates, so they are keyed by the ISO date
+    if hasattr(query_date, 'date'):
+        query_date = query_date.date()
+    return country_code.upper(), query_date.isoformat()
+
+
+def _get_parameters_key(parameters):
+    return hashlib.sha1(json.dumps(parameters, sort_keys=True).encode()).hexdigest()
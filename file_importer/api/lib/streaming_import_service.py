@@ -0,0 +1,146 @@
+import csv
+
+from django.conf import settings
+from django.db.transaction import atomic
+from itertools import islice
+
+from api.lib.codecs import JSON
+from api.lib.file_import_service import FileImportService
+from api.lib.validation_errors import ValidationErrorList
+
+
+def read_csv_rows(lines):
+    """Return the rows of CSV data, given as lines of UTF-8 encoded bytes."""
+    return csv.reader(line.decode('utf-8-sig') for line in lines)
+
+
+def read_ndjson_rows(lines):
+    """Return the rows of newline-delimited JSON data (one list of values per line)."""
+    for line in lines:
+        if line.strip():
+            yield JSON.decode(line)
+
+
+# The readers for each supported content type of streamed transaction data
+ROW_READERS = {
+    'text/csv': read_csv_rows,
+    'application/x-ndjson': read_ndjson_rows
+}
+
+
+class RollbackImport(Exception):
+    """Raised to undo everything saved by a streamed import."""
+
+    pass
+
+
+class StreamingImportService():
+    """
+    This will handle the importing of transaction data that is read from a stream of rows.
+
+    The rows are read, validated and saved a window of IMPORT_STREAM_WINDOW_SIZE rows at a time, so
+    only one window is ever held in memory, no matter how large the file is. The import is still
+    all or nothing: every window is saved within one database transaction which is rolled back if
+    any row is invalid (unless invalid rows are ignored).
+
+    Once the validation errors are full (see api.lib.validation_errors), nothing is saved and the
+    rest of the rows are read without being validated.
+
+    The rows can also be validated without saving any of them (see validate_transactions), eg. to
+    find out whether a file can be imported before taking a database lock for it.
+    """
+
+    def __init__(
+            self, rows, ignore_first_row, window_size=None, on_progress=None, schema=None,
+            validation_errors=None):
+        """
+        on_progress: an optional function called with this service after each window of rows has
+                     been imported (or validated), eg. to report the progress of the import
+        schema: the import schema of the rows (see FileImportService)
+        validation_errors: the validation errors of the rows (by default, a new
+                           ValidationErrorList)
+        """
+        self.rows = rows
+        self.ignore_first_row = ignore_first_row
+        self.window_size = window_size or settings.IMPORT_STREAM_WINDOW_SIZE
+        self.on_progress = on_progress
+        self.schema = schema
+        self.transaction_count = 0
+        self.imported_count = 0
+        self.validation_errors = (
+            validation_errors if validation_errors is not None else ValidationErrorList())
+
+    def import_transactions(self, ignore_invalid_transactions=False):
+        """
+        Validate and save all of the transactions, returning True if they were saved.
+
+        ignore_invalid_transactions: True if the importer should import all valid transactions
+                                     even in the presense of some bad transactions or whether
+                                     it should not save anything at all.
+        """
+        try:
+            with atomic():
+                for window in self._read_windows():
+                    self._import_window(window, ignore_invalid_transactions)
+                    if self.on_progress:
+                        self.on_progress(self)
+
+                if not self._can_import(ignore_invalid_transactions):
+                    raise RollbackImport()
+        except RollbackImport:
+            self.imported_count = 0
+            return False
+
+        return True
+
+    def validate_transactions(self, ignore_invalid_transactions=False):
+        """
+        Validate all of the transactions without saving any of them, returning True if they can be
+        imported - ie. if they are all valid or if invalid transactions are ignored (and the
+        validation errors aren't full).
+        """
+        for window in self._read_windows():
+            self._validate_window(window)
+            if self.on_progress:
+                self.on_progress(self)
+
+        return self._can_import(ignore_invalid_transactions)
+
+    def _read_windows(self):
+        rows = iter(self.rows)
+        if self.ignore_first_row:
+            next(rows, None)
+
+        while True:
+            window = list(islice(rows, self.window_size))
+            if not window:
+                return
+            if self.validation_errors.is_full:
+                # The rest of the rows are still counted, for the result of the import
+                self.transaction_count += len(window)
+                continue
+            yield window
+
+    def _validate_window(self, window):
+        file_import_service = FileImportService(
+            window, ignore_first_row=False, row_offset=self.transaction_count, schema=self.schema,
+            validation_errors=self.validation_errors)
+        file_import_service.validate_transaction_data()
+
+        self.transaction_count += len(window)
+        return file_import_service
+
+    def _import_window(self, window, ignore_invalid_transactions):
+        file_import_service = self._validate_window(window)
+
+        # Once there is an invalid row, nothing will be saved but the rest of the rows are still
+        # validated so that all of the errors can be reported (up to the limit of errors)
+        if not self._can_import(ignore_invalid_transactions):
+            return
+
+        self.imported_count += file_import_service.save_transactions(ignore_invalid_transactions)
+
+    def _can_import(self, ignore_invalid_transactions):
+        return not (
+            self.validation_errors.is_full
+            or (self.validation_errors and not ignore_invalid_transactions))
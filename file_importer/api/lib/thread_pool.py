@@ -0,0 +1,97 @@
+import asyncio
+import threading
+
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# The number of items of a streamed iterable that are produced before any have been taken
+STREAM_BUFFER_SIZE = 16
+
+
+def run_sync(func):
+    """
+    Return an async version of func, which runs it in a thread of this process's thread pool.
+
+    Async views use this for anything that blocks, eg. database queries or hashing a large request,
+    so that the event loop is free to handle other requests in the meantime. The pool has
+    ASYNC_THREAD_POOL_SIZE threads (each with its own database connection), so that is the most
+    blocking calls that are run at once - the rest wait for a thread without holding one up.
+    """
+    async def run_in_thread_pool(*args, **kwargs):
+        return await sync_to_async(
+            _call_with_connections, thread_sensitive=False, executor=_get_executor())(
+                func, *args, **kwargs)
+
+    return run_in_thread_pool
+
+
+async def iterate_in_thread_pool(iterable):
+    """
+    Iterate over a blocking iterable (eg. the content of a streamed response, which reads from the
+    database) in a thread of the thread pool, yielding its items as they are produced.
+
+    The whole iteration is run by one thread, as a database cursor belongs to the connection of the
+    thread that opened it, which waits while STREAM_BUFFER_SIZE items haven't been taken yet. The
+    iterable is closed (if it can be) by the same thread, once it is exhausted or the iteration is
+    stopped early.
+    """
+    loop = asyncio.get_running_loop()
+    items = asyncio.Queue()
+    free_slots = threading.Semaphore(STREAM_BUFFER_SIZE)
+    stopped = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                free_slots.acquire()
+                if stopped.is_set():
+                    break
+                loop.call_soon_threadsafe(items.put_nowait, (False, item))
+        finally:
+            try:
+                if hasattr(iterable, 'close'):
+                    iterable.close()
+            finally:
+                loop.call_soon_threadsafe(items.put_nowait, (True, None))
+
+    producer = asyncio.ensure_future(run_sync(produce)())
+    try:
+        while True:
+            finished, item = await items.get()
+            if finished:
+                break
+            free_slots.release()
+            yield item
+    finally:
+        stopped.set()
+        free_slots.release()
+
+    # Raise anything raised while iterating
+    await producer
+
+
+def _call_with_connections(func, *args, **kwargs):
+    # Django only closes the database connections of the thread that handles a request, so the
+    # pool's threads close their own (once they are older than CONN_MAX_AGE, or unusable)
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def _get_executor():
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.ASYNC_THREAD_POOL_SIZE, thread_name_prefix='async-views')
+
+    return _executor
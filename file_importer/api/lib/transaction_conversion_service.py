@@ -1,14 +1,22 @@
-from decimal import Decimal
+import datetime
+import logging
 
+from django.db.models import DecimalField, F, Func, Max, Min, Value
+from django.db.transaction import atomic, on_commit
+from django.utils import timezone
+
+from api.lib.transaction_summary_service import TransactionSummaryService
 from api.models import Transaction
 
+logger = logging.getLogger(__name__)
+
 
 class TransactionConversionService():
     """
     Convert transaction amounts to Euros.
 
     NOTE! The structure of the exchange rate lookup allows the API call to ECB to be done only once
-          (per application startup). This could possibly be included directly in the
+          (per day - see ExchangeRateStore). This could possibly be included directly in the
           FileImportService but having it as a separate module allows it to be run more cleanly
           apart from the file import. In this case, the initial import will attempt to convert all
           transactions that it can, possibly leaving some rows NOT updated with Euro amounts. The
@@ -21,18 +29,112 @@ class TransactionConversionService():
     """
 
     @classmethod
-    def convert_to_EUR(cls):
-        from api.lib import EXCHANGE_RATES
+    def convert_to_EUR(cls, transaction_ids=None):
+        """
+        Convert the amounts of the unconverted transactions to Euros.
+
+        transaction_ids: only convert these transactions (eg. the ones that were just imported)
+                         instead of every unconverted transaction in the database
+
+        Each transaction is converted at the exchange rate of the day it was made. The conversion
+        is done by the database with a single UPDATE statement per currency and exchange rate
+        (i.e. per currency, per business day covered by the transactions). The exchange rates of
+        transactions made before the history that is kept (see EXCHANGE_RATE_HISTORY_DAYS) are
+        fetched when they are converted. Transactions without a known exchange rate are left
+        unconverted, and a warning is logged.
+
+        The Euro amounts are also added to the daily transaction summaries.
+        """
+        from api.lib import QUERY_CACHE
 
         transactions = Transaction.objects.get_unconverted_transactions()
+        if transaction_ids is None:
+            batches = [transactions]
+        elif not transaction_ids:
+            return
+        else:
+            batches = [
+                transactions & batch
+                for batch in Transaction.objects.get_batches_by_ids(transaction_ids)]
+
+        converted_days = set()
+        for batch in batches:
+            converted_days |= cls._convert_transactions(batch)
+
+        # Cached queries of the converted days no longer match the transactions
+        on_commit(lambda: QUERY_CACHE.invalidate(converted_days))
+
+    @classmethod
+    def _convert_transactions(cls, transactions):
+        from api.lib import EXCHANGE_RATES
+
+        currency_date_ranges = list(transactions.order_by().values('currency').annotate(
+            first_created_at=Min('created_at'), last_created_at=Max('created_at')))
+        if not currency_date_ranges:
+            return set()
+        exchange_rate_history = EXCHANGE_RATES.get_history(min(
+            currency_date_range['first_created_at'].date()
+            for currency_date_range in currency_date_ranges))
+
+        converted_days = set()
+        for currency_date_range in currency_date_ranges:
+            # The daily summaries are updated along with each conversion (see
+            # TransactionSummaryService)
+            with atomic():
+                converted_days |= cls._convert_currency(
+                    transactions.filter(currency=currency_date_range['currency']),
+                    exchange_rate_history, **currency_date_range)
+
+        return converted_days
+
+    @classmethod
+    def _convert_currency(
+            cls, currency_transactions, exchange_rate_history, currency, first_created_at,
+            last_created_at):
+        if currency == 'EUR':
+            converted_days = TransactionSummaryService.add_conversions(
+                currency_transactions, F('net'), F('vat'))
+            currency_transactions.update(net_euro=F('net'), vat_euro=F('vat'))
+            return converted_days
+
+        # Each exchange rate applies from the day it was published until the day the next exchange
+        # rate was published
+        rate_periods = exchange_rate_history.get_rate_periods(
+            currency, first_created_at.date(), last_created_at.date())
+        if exchange_rate_history.get_rate(currency, first_created_at.date()) is None:
+            logger.warning(
+                f'The {currency} transactions made before its earliest known exchange rate (from '
+                f'{first_created_at.date()}) are left unconverted')
+
+        converted_days = set()
+        for start_date, end_date, exchange_rate in rate_periods:
+            period_transactions = currency_transactions.filter(
+                created_at__gte=_start_of_day(start_date))
+            if end_date:
+                period_transactions = period_transactions.filter(
+                    created_at__lt=_start_of_day(end_date))
+
+            exchange_rate = Value(exchange_rate)
+            net_euro = ConvertAmount('net', exchange_rate)
+            vat_euro = ConvertAmount('vat', exchange_rate)
+            converted_days |= TransactionSummaryService.add_conversions(
+                period_transactions, net_euro, vat_euro)
+            period_transactions.update(net_euro=net_euro, vat_euro=vat_euro)
+
+        return converted_days
+
+
+class ConvertAmount(Func):
+    """
+    Divide an amount by an exchange rate, rounded to cents, ie. ROUND(amount / rate, 2).
+
+    The amount is multiplied by 1.0 first because SQLite stores whole amounts as integers and would
+    otherwise do an integer division.
+    """
+    template = 'ROUND(1.0 * %(expressions)s, 2)'
+    arg_joiner = ' / '
+    output_field = DecimalField(max_digits=5, decimal_places=2)
 
-        for transaction in transactions:
-            if transaction.currency == 'EUR':
-                transaction.net_euro = transaction.net
-                transaction.vat_euro = transaction.vat
-            else:
-                exchange_rate = Decimal(EXCHANGE_RATES[transaction.currency]['value'])
-                transaction.net_euro = transaction.net / exchange_rate
-                transaction.vat_euro = transaction.vat / exchange_rate
 
-            transaction.save()
+def _start_of_day(date):
+    return datetime.datetime.combine(date, datetime.time.min, tzinfo=timezone.utc)
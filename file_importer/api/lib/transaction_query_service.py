@@ -0,0 +1,298 @@
+import base64
+import csv
+import datetime
+import io
+import itertools
+
+from django.conf import settings
+from django.db.models import Q
+
+from api.lib.codecs import JSON
+from api.models import Transaction
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+RESPONSE_FORMAT_JSON = 'json'
+RESPONSE_FORMAT_NDJSON = 'ndjson'
+RESPONSE_FORMAT_CSV = 'csv'
+RESPONSE_FORMAT_PARQUET = 'parquet'
+RESPONSE_FORMAT_ARROW = 'arrow'
+RESPONSE_FORMATS = [
+    RESPONSE_FORMAT_JSON, RESPONSE_FORMAT_NDJSON, RESPONSE_FORMAT_CSV, RESPONSE_FORMAT_PARQUET,
+    RESPONSE_FORMAT_ARROW]
+
+# Formats that are written by pyarrow, so are only available when it is installed
+COLUMNAR_FORMATS = [RESPONSE_FORMAT_PARQUET, RESPONSE_FORMAT_ARROW]
+
+CONTENT_TYPES = {
+    RESPONSE_FORMAT_JSON: 'application/json',
+    RESPONSE_FORMAT_NDJSON: 'application/x-ndjson',
+    RESPONSE_FORMAT_CSV: 'text/csv',
+    RESPONSE_FORMAT_PARQUET: 'application/vnd.apache.parquet',
+    RESPONSE_FORMAT_ARROW: 'application/vnd.apache.arrow.stream'
+}
+
+# Formats that are downloaded as a file, rather than read by the caller as a response
+FILE_EXTENSIONS = {
+    RESPONSE_FORMAT_CSV: 'csv',
+    RESPONSE_FORMAT_PARQUET: 'parquet',
+    RESPONSE_FORMAT_ARROW: 'arrows'
+}
+
+# The transaction fields returned by a query, in order, and their headings in exported files
+QUERY_FIELDS = [
+    'created_at', 'country', 'currency', 'transaction_type', 'net', 'vat', 'net_euro', 'vat_euro']
+QUERY_HEADINGS = [
+    'date', 'country', 'currency', 'transaction_type', 'net', 'vat', 'net_euro', 'vat_euro']
+
+
+class InvalidCursor(Exception):
+    """Raised when a pagination cursor can't be decoded."""
+
+    pass
+
+
+class TransactionQueryService():
+    """
+    This will handle querying transactions by country code and date.
+
+    The transactions are returned as lists of values (see QUERY_FIELDS, although only the date of
+    created_at is returned) in the order they were made. They can be returned all at once, a page
+    at a time or streamed, in which case they are read from the database in chunks of
+    QUERY_STREAM_CHUNK_SIZE rows and written out, in any of the RESPONSE_FORMATS, as they are read.
+    The Parquet and Arrow formats are only available when pyarrow is installed.
+
+    Pages are found using the position of the last transaction on the previous page (the cursor),
+    rather than an offset, so that every page is found with the same index seek no matter how deep
+    into the results it is.
+    """
+
+    def __init__(self, country_code, query_date, cursor=None):
+        """
+        cursor: the next_cursor of the previous page, to only return the transactions after it
+        """
+        self.transactions = Transaction.objects.get_by_country_code_and_date(
+            country_code, query_date).order_by('created_at', 'id')
+
+        if cursor:
+            created_at, transaction_id = decode_cursor(cursor)
+            self.transactions = self.transactions.filter(
+                Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=transaction_id))
+
+    def get_transactions(self):
+        """Return all of the transactions."""
+        return [
+            _to_query_row(row) for row in self.transactions.values_list(*QUERY_FIELDS).iterator(
+                chunk_size=settings.QUERY_STREAM_CHUNK_SIZE)]
+
+    def get_page(self, page_size):
+        """Return the first page of transactions and the cursor for the next page (if any)."""
+        rows = list(self.transactions.values_list('id', *QUERY_FIELDS)[:page_size + 1])
+
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            transaction_id, created_at = rows[-1][:2]
+            next_cursor = encode_cursor(created_at, transaction_id)
+
+        return [_to_query_row(row[1:]) for row in rows], next_cursor
+
+    def stream(self, response_format):
+        """
+        Yield the transactions, encoded in the given format, a chunk of transactions at a time.
+        """
+        rows = self.transactions.values_list(*QUERY_FIELDS).iterator(
+            chunk_size=settings.QUERY_STREAM_CHUNK_SIZE)
+        return STREAM_WRITERS[response_format](_chunks(rows))
+
+
+class BatchTransactionQueryService():
+    """
+    This will handle querying the transactions of many countries over a range of days at once.
+
+    The transactions are read with a single query, in the order of the index on country code and
+    date, so they can be grouped by country and day and written out (as JSON) as they are read, in
+    chunks of QUERY_STREAM_CHUNK_SIZE rows, rather than all being held in memory.
+    """
+
+    def __init__(self, country_codes, start_date, end_date):
+        self.country_codes = sorted({country_code.upper() for country_code in country_codes})
+        self.transactions = Transaction.objects.get_by_country_codes_and_dates(
+            self.country_codes, start_date, end_date).order_by('country_code', 'created_at', 'id')
+
+    def stream(self):
+        """
+        Yield the transactions as JSON, grouped by country code and then by day, ie.
+        {"countries": {"US": {"2021-12-06": [transactions], ...}, ...}}
+
+        Every country code is included, even if it has no transactions, but days without
+        transactions aren't.
+        """
+        rows = self.transactions.values_list('country_code', *QUERY_FIELDS).iterator(
+            chunk_size=settings.QUERY_STREAM_CHUNK_SIZE)
+        countries = itertools.groupby(rows, key=lambda row: row[0])
+        next_country = next(countries, None)
+
+        yield '{"countries": {'
+        for index, country_code in enumerate(self.country_codes):
+            yield f'{", " if index else ""}{_encode_json(country_code)}: {{'
+            if next_country and next_country[0] == country_code:
+                yield from _write_days(row[1:] for row in next_country[1])
+                next_country = next(countries, None)
+            yield '}'
+        yield '}}'
+
+
+def is_format_available(response_format):
+    return response_format not in COLUMNAR_FORMATS or pyarrow is not None
+
+
+def get_export_filename(country_code, query_date, response_format):
+    """Return the name of the file the transactions are downloaded as (None if not a file)."""
+    if response_format not in FILE_EXTENSIONS:
+        return None
+
+    return (
+        f'transactions_{country_code.upper()}_{query_date:%Y-%m-%d}.'
+        f'{FILE_EXTENSIONS[response_format]}')
+
+
+def encode_cursor(created_at, transaction_id):
+    return base64.urlsafe_b64encode(f'{created_at.isoformat()}|{transaction_id}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, transaction_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.datetime.fromisoformat(created_at), int(transaction_id)
+    except (AttributeError, ValueError):
+        raise InvalidCursor(f'Cursor "{cursor}" is not valid')
+
+
+def _to_query_row(row):
+    return [row[0].date(), *row[1:]]
+
+
+def _encode_json(value):
+    return JSON.encode(value).decode()
+
+
+def _chunks(rows):
+    """Yield the rows as query rows, QUERY_STREAM_CHUNK_SIZE rows at a time."""
+    chunk = []
+    for row in rows:
+        chunk.append(_to_query_row(row))
+        if len(chunk) == settings.QUERY_STREAM_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def _write_json(chunks):
+    yield '{"transactions": ['
+    yield from _write_json_rows(chunks)
+    yield ']}'
+
+
+def _write_days(rows):
+    """Yield the rows of one country as the JSON object of its transactions by day."""
+    separator = ''
+    for day, day_rows in itertools.groupby(rows, key=lambda row: row[0].date()):
+        yield f'{separator}"{day.isoformat()}": ['
+        yield from _write_json_rows(_chunks(day_rows))
+        yield ']'
+        separator = ', '
+
+
+def _write_json_rows(chunks):
+    separator = ''
+    for chunk in chunks:
+        yield separator + ', '.join(_encode_json(row) for row in chunk)
+        separator = ', '
+
+
+def _write_ndjson(chunks):
+    for chunk in chunks:
+        yield ''.join(f'{_encode_json(row)}\n' for row in chunk)
+
+
+def _write_csv(chunks):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(QUERY_HEADINGS)
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield _drain(output)
+
+    yield _drain(output)
+
+
+def _write_parquet(chunks):
+    # Each chunk is written as a row group, so the file is written as it is read
+    schema = _get_arrow_schema()
+    output = io.BytesIO()
+    with pyarrow.parquet.ParquetWriter(output, schema) as writer:
+        for chunk in chunks:
+            writer.write_batch(_to_record_batch(chunk, schema))
+            yield _drain(output)
+
+    yield _drain(output)
+
+
+def _write_arrow(chunks):
+    schema = _get_arrow_schema()
+    output = io.BytesIO()
+    with pyarrow.ipc.new_stream(output, schema) as writer:
+        for chunk in chunks:
+            writer.write_batch(_to_record_batch(chunk, schema))
+            yield _drain(output)
+
+    yield _drain(output)
+
+
+def _drain(output):
+    """Return what has been written to the output so far and empty it."""
+    value = output.getvalue()
+    output.seek(0)
+    output.truncate()
+    return value
+
+
+def _get_arrow_schema():
+    amount_type = pyarrow.decimal128(
+        Transaction._meta.get_field('net').max_digits,
+        Transaction._meta.get_field('net').decimal_places)
+
+    return pyarrow.schema([
+        ('date', pyarrow.date32()),
+        ('country', pyarrow.string()),
+        ('currency', pyarrow.string()),
+        ('transaction_type', pyarrow.string()),
+        ('net', amount_type),
+        ('vat', amount_type),
+        ('net_euro', amount_type),
+        ('vat_euro', amount_type)
+    ])
+
+
+def _to_record_batch(chunk, schema):
+    columns = zip(*chunk)
+    return pyarrow.record_batch(
+        [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)],
+        schema=schema)
+
+
+STREAM_WRITERS = {
+    RESPONSE_FORMAT_JSON: _write_json,
+    RESPONSE_FORMAT_NDJSON: _write_ndjson,
+    RESPONSE_FORMAT_CSV: _write_csv,
+    RESPONSE_FORMAT_PARQUET: _write_parquet,
+    RESPONSE_FORMAT_ARROW: _write_arrow
+}
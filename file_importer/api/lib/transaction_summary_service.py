@@ -0,0 +1,92 @@
+from django.db import connection
+from django.db.models import Count, DecimalField, Sum
+from django.db.models.functions import TruncDate
+
+from api.models import DailyTransactionSummary
+
+# The fields that identify a daily summary and the totals that are added to
+SUMMARY_KEY_FIELDS = ['country_code', 'date', 'currency', 'transaction_type']
+SUMMARY_TOTAL_FIELDS = [
+    'transaction_count', 'converted_count', 'net', 'vat', 'net_euro', 'vat_euro']
+
+
+class TransactionSummaryService():
+    """
+    Keep the daily transaction summaries (see DailyTransactionSummary) up to date.
+
+    Transactions are added to the summaries as they are imported and again, for their Euro amounts,
+    as they are converted. Either way, the transactions are totalled per summary by the database
+    and then added to the summaries with a single "upsert" statement (INSERT ... ON CONFLICT DO
+    UPDATE, which both SQLite and PostgreSQL support), which creates any summaries that don't exist
+    yet and adds to the rest - even if another import creates them in the meantime.
+
+    Both should be done in the same database transaction as the import/conversion itself, so that
+    the summaries always match the transactions.
+    """
+
+    @classmethod
+    def add_transactions(cls, transactions):
+        """
+        Add newly imported transactions to the summaries.
+
+        Returns the (country code, date) of every summary that changed.
+        """
+        return cls._add_totals(
+            transactions, transaction_count=Count('id'), net=_sum('net'), vat=_sum('vat'))
+
+    @classmethod
+    def add_conversions(cls, transactions, net_euro, vat_euro):
+        """
+        Add the Euro amounts of transactions to the summaries.
+
+        This must be done BEFORE the transactions are converted, using the same expressions as the
+        conversion (net_euro and vat_euro), as the transactions won't match the query afterwards.
+
+        Returns the (country code, date) of every summary that changed.
+        """
+        return cls._add_totals(
+            transactions, converted_count=Count('id'), net_euro=_sum(net_euro),
+            vat_euro=_sum(vat_euro))
+
+    @classmethod
+    def _add_totals(cls, transactions, **totals):
+        summary_totals = list(transactions.order_by().annotate(
+            date=TruncDate('created_at')).values_list(*SUMMARY_KEY_FIELDS).annotate(
+                **{f'total_{field}': total for field, total in totals.items()}))
+        if not summary_totals:
+            return set()
+
+        # Every total is added to (the totals that aren't given are added as 0)
+        fields = [
+            DailyTransactionSummary._meta.get_field(field)
+            for field in SUMMARY_KEY_FIELDS + SUMMARY_TOTAL_FIELDS]
+        totals = list(totals)
+        summary_rows = []
+        for summary_total in summary_totals:
+            values = dict(zip(SUMMARY_KEY_FIELDS + totals, summary_total))
+            summary_rows.append([
+                field.get_db_prep_save(values.get(field.name, 0), connection) for field in fields])
+
+        with connection.cursor() as cursor:
+            cursor.executemany(_get_upsert_sql(), summary_rows)
+
+        return {(summary_total[0], summary_total[1]) for summary_total in summary_totals}
+
+
+def _sum(amount):
+    return Sum(amount, output_field=DecimalField(max_digits=20, decimal_places=2))
+
+
+def _get_upsert_sql():
+    quote_name = connection.ops.quote_name
+    table = quote_name(DailyTransactionSummary._meta.db_table)
+    key_columns = ', '.join(quote_name(field) for field in SUMMARY_KEY_FIELDS)
+    columns = ', '.join(quote_name(field) for field in SUMMARY_KEY_FIELDS + SUMMARY_TOTAL_FIELDS)
+    placeholders = ', '.join(['%s'] * (len(SUMMARY_KEY_FIELDS) + len(SUMMARY_TOTAL_FIELDS)))
+    increments = ', '.join(
+        f'{quote_name(field)} = {table}.{quote_name(field)} + excluded.{quote_name(field)}'
+        for field in SUMMARY_TOTAL_FIELDS)
+
+    return (
+        f'INSERT INTO {table} ({columns}) VALUES ({placeholders}) '
+        f'ON CONFLICT ({key_columns}) DO UPDATE SET {increments}')
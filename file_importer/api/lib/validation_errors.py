@@ -0,0 +1,153 @@
+import gzip
+import hashlib
+import io
+import os
+import uuid
+
+from django.conf import settings
+
+from api.lib.codecs import JSON
+
+ERROR_REPORT_INLINE = 'inline'
+ERROR_REPORT_SUMMARY = 'summary'
+ERROR_REPORTS = [ERROR_REPORT_INLINE, ERROR_REPORT_SUMMARY]
+
+
+class ValidationErrorList(list):
+    """
+    The validation errors of an import, returned in full as a list of [row number, value, error].
+
+    max_errors: the number of errors after which validation stops (see is_full), or None to find
+                every error
+    """
+
+    def __init__(self, max_errors=None):
+        super().__init__()
+        self.max_errors = max_errors
+
+    @property
+    def is_full(self):
+        return self.max_errors is not None and len(self) >= self.max_errors
+
+    def add(self, row_number, column_number, value, message, code):
+        self.append([row_number, value, message])
+
+    def get_result(self):
+        """Return the errors as they are given in the result of the import."""
+        return {'errors': self}
+
+    def discard(self):
+        pass
+
+
+class ValidationErrorSummary():
+    """
+    The validation errors of an import, summarised instead of returned in full.
+
+    The errors are grouped by column and kind of error (the code of the ValidationError) and each
+    group is returned with its number of errors and the first IMPORT_ERROR_SAMPLE_SIZE of them, so
+    the result of an import stays small no matter how many of its rows are invalid. Every error is
+    written, as it is found, to a gzipped newline-delimited JSON file - the error report, with a
+    [row number, column number, value, code, error] list per line - which can be downloaded by its
+    report_id (see get_error_report_path).
+    """
+
+    def __init__(self, api_partner_id, max_errors=None, sample_size=None):
+        self.report_id = uuid.uuid4()
+        self.report_path = get_error_report_path(api_partner_id, self.report_id)
+        self.max_errors = max_errors
+        self.sample_size = sample_size or settings.IMPORT_ERROR_SAMPLE_SIZE
+        self.error_count = 0
+        self.groups = {}
+        self._report_file = None
+
+    def __len__(self):
+        return self.error_count
+
+    @property
+    def is_full(self):
+        return self.max_errors is not None and self.error_count >= self.max_errors
+
+    def add(self, row_number, column_number, value, message, code):
+        if self._report_file is None:
+            self._open_report()
+        self._report_file.write(JSON.encode((row_number, column_number, value, code, message)))
+        self._report_file.write(b'\n')
+        self.error_count += 1
+
+        group = self.groups.get((column_number, code))
+        if group is None:
+            group = self.groups[column_number, code] = {
+                'column': column_number, 'code': code, 'count': 0, 'samples': []}
+        group['count'] += 1
+        if len(group['samples']) < self.sample_size:
+            group['samples'].append([row_number, value, message])
+
+    def get_result(self):
+        """Return the summary of the errors as it is given in the result of the import."""
+        self._close_report()
+        return {
+            'error_summary': {
+                'error_count': self.error_count,
+                'groups': list(self.groups.values()),
+                'report_id': str(self.report_id) if self.error_count else None
+            }
+        }
+
+    def discard(self):
+        """Delete the error report, eg. when the import turns out not to be authentic."""
+        self._close_report()
+        if os.path.exists(self.report_path):
+            os.remove(self.report_path)
+
+    def _open_report(self):
+        os.makedirs(os.path.dirname(self.report_path), exist_ok=True)
+        # Each error is a short line, so they are compressed a buffer of lines at a time
+        self._report_file = io.BufferedWriter(
+            gzip.open(self.report_path, 'wb', compresslevel=6), buffer_size=1024 * 1024)
+
+    def _close_report(self):
+        if self._report_file is not None:
+            self._report_file.close()
+            self._report_file = None
+
+
+def create_validation_errors(api_partner_id, error_report=None, max_errors=None):
+    """
+    Return the validation errors of a new import, reported in full or summarised.
+
+    Validation stops after max_errors errors (or IMPORT_MAX_ERRORS, if it isn't given).
+    """
+    max_errors = max_errors or settings.IMPORT_MAX_ERRORS
+    if error_report == ERROR_REPORT_SUMMARY:
+        return ValidationErrorSummary(api_partner_id, max_errors=max_errors)
+
+    return ValidationErrorList(max_errors=max_errors)
+
+
+def get_error_report_path(api_partner_id, report_id):
+    """
+    Return the path of an error report.
+
+    The reports of each API partner are kept in their own directory of IMPORT_ERROR_REPORT_DIR,
+    named after a hash of their ID, so a report can only be downloaded by the partner it belongs
+    to.
+    """
+    partner_directory = hashlib.sha256(api_partner_id.encode()).hexdigest()
+    return os.path.join(
+        settings.IMPORT_ERROR_REPORT_DIR, partner_directory, f'{report_id}.ndjson.gz')
+
+
+def validate_error_report_parameters(error_report, max_errors):
+    """Return the problems with the error_report and max_errors parameters of an import."""
+    errors = []
+    if error_report is not None and error_report not in ERROR_REPORTS:
+        errors.append(
+            f'error_report ("{error_report}") is not an acceptable value - must be one of: '
+            f'{", ".join(ERROR_REPORTS)}')
+    if max_errors is not None and (type(max_errors) is not int or max_errors < 1):
+        errors.append(
+            f'max_errors ("{max_errors}") is not an acceptable value - must be a positive whole '
+            f'number')
+
+    return errors
@@ -1,26 +1,57 @@
 # This is a list of functions used to validate specific field types. Each validator will either
 # return the acceptable form of the field value or raise an error with a description of the error.
 import datetime
+import re
 
 from decimal import Decimal, InvalidOperation
 
+from functools import lru_cache
+
 from api.lib.file_import_fields import FIELD_COUNTRY, FIELD_CURRENCY, FIELD_DATE, FIELD_MONEY, \
     FIELD_TRX_TYPE, TRX_TYPE_PURCHASE, TRX_TYPE_SALE
 
+# This matches exactly the same values as datetime.datetime.strptime(value, "%Y/%m/%d") does
+DATE_PATTERN = re.compile(
+    r'(\d\d\d\d)/(1[0-2]|0[1-9]|[1-9])/(3[01]|[12]\d|0[1-9]|[1-9]| [1-9])\Z', re.IGNORECASE)
+
 
 class ValidationError(Exception):
-    """Specific error class for handling validation errors."""
+    """
+    Specific error class for handling validation errors.
+
+    The code identifies the kind of error (eg. "invalid_date"), so that errors can be grouped by it
+    without comparing their messages, which include the invalid value.
+    """
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+@lru_cache(maxsize=1024)
+def parse_date(date_value):
+    """
+    Return the date (as a datetime) from a value in the format YYYY/MM/DD.
+
+    This is equivalent to datetime.datetime.strptime(date_value, "%Y/%m/%d") but much quicker and,
+    because import files repeat the same dates over and over, the most recent dates parsed are
+    remembered. A ValueError is raised if the value is not a valid date.
+    """
+    match = DATE_PATTERN.match(date_value)
+    if not match:
+        raise ValueError(f'"{date_value}" does not match the format YYYY/MM/DD')
 
-    pass
+    year, month, day = match.groups()
+    return datetime.datetime(int(year), int(month), int(day))
 
 
 def validate_date(date_value):
     try:
-        clean_date = datetime.datetime.strptime(date_value, "%Y/%m/%d")
+        clean_date = parse_date(date_value)
     except ValueError:
         raise ValidationError(
             f'date value ("{date_value}") is not an acceptable date - must be in the '
-            f'format: YYYY/MM/DD')
+            f'format: YYYY/MM/DD', 'invalid_date')
 
     return clean_date
 
@@ -39,7 +70,7 @@ def validate_trx_type(trx_type):
     if not valid:
         raise ValidationError(
             f'transaction type ("{trx_type}") is not an acceptable value - must be either '
-            f'"Sale" or "Purchase"')
+            f'"Sale" or "Purchase"', 'invalid_transaction_type')
 
     return clean_trx_type
 
@@ -67,7 +98,7 @@ def validate_currency(currency):
 
     raise ValidationError(
         f'currency ("{currency}") is not an acceptable value - must be recognised by the '
-        f'European Central Bank')
+        f'European Central Bank', 'invalid_currency')
 
 
 def validate_money(money):
@@ -76,7 +107,7 @@ def validate_money(money):
     except InvalidOperation:
         raise ValidationError(
             f'transaction amount ("{money}") is not an acceptable value - must be valid numeric '
-            f'value')
+            f'value', 'invalid_amount')
 
     return clean_money
 
@@ -88,3 +119,57 @@ VALIDATORS = {
     FIELD_CURRENCY: validate_currency,
     FIELD_MONEY: validate_money
 }
+
+
+def validate_column(field_type, values):
+    """
+    Validate a whole column of values of the same field type.
+
+    The output shall be in the format:
+    (list of clean values (None for invalid values), list of (index of invalid value, error, code))
+    """
+    if field_type in COLUMN_VALIDATORS:
+        return COLUMN_VALIDATORS[field_type](values)
+
+    return _validate_distinct_values(VALIDATORS[field_type], values)
+
+
+def validate_money_column(money_values):
+    # Monetary values are rarely repeated, so it's quickest to convert them all in one go and
+    # only look for the invalid values when there are some
+    try:
+        return list(map(Decimal, money_values)), []
+    except InvalidOperation:
+        return _validate_distinct_values(validate_money, money_values)
+
+
+def _validate_distinct_values(validator, values):
+    """
+    Validate each distinct value in the column only once.
+
+    Import files repeat the same dates, transaction types, countries and currencies many times
+    over, so the result of validating a value (including its error message) is shared by every row
+    with that value.
+    """
+    clean_values = {}
+    invalid_values = {}
+
+    for value in set(values):
+        try:
+            clean_values[value] = validator(value)
+        except ValidationError as e:
+            clean_values[value] = None
+            invalid_values[value] = (str(e), e.code)
+
+    errors = []
+    if invalid_values:
+        errors = [
+            (index, *invalid_values[value]) for index, value in enumerate(values)
+            if value in invalid_values]
+
+    return list(map(clean_values.__getitem__, values)), errors
+
+
+COLUMN_VALIDATORS = {
+    FIELD_MONEY: validate_money_column
+}
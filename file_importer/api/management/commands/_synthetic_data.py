@@ -0,0 +1,77 @@
+"""Synthetic transaction data for the benchmarks."""
+import datetime
+import random
+
+from decimal import Decimal
+from django.db import connection
+from django.db.transaction import atomic
+
+from api.models import Transaction
+
+# (country, currency) pairs, all of which are in api/fixtures/ecb_exchange_rates.json (except EUR)
+COUNTRIES = [
+    ('Australia', 'AUD'), ('Brazil', 'BRL'), ('Canada', 'CAD'), ('Switzerland', 'CHF'),
+    ('China', 'CNY'), ('Czech Republic', 'CZK'), ('Denmark', 'DKK'), ('Germany', 'EUR'),
+    ('United Kingdom', 'GBP'), ('Hungary', 'HUF'), ('India', 'INR'), ('Japan', 'JPY'),
+    ('Mexico', 'MXN'), ('Norway', 'NOK'), ('New Zealand', 'NZD'), ('Poland', 'PLN'),
+    ('Sweden', 'SEK'), ('Singapore', 'SGD'), ('United States', 'USD'), ('South Africa', 'ZAR'),
+]
+TRANSACTION_TYPES = ['Sale', 'Purchase']
+
+# The largest net amount (in cents) - the amounts, and their conversions to Euros, must fit in the
+# 5 digits of the transaction amount fields
+MAX_NET_CENTS = 50000
+
+# The dates covered by the exchange rates in api/fixtures/ecb_exchange_rates.json
+FIXTURE_START_DATE = datetime.date(2021, 11, 29)
+FIXTURE_DAYS = 12
+
+
+def generate_transaction_data(row_count, seed=0, start_date=FIXTURE_START_DATE, days=FIXTURE_DAYS):
+    """Yield rows of transaction data, in the form they are sent to the import API."""
+    rng = random.Random(seed)
+    dates = [
+        (start_date + datetime.timedelta(days=day)).strftime('%Y/%m/%d') for day in range(days)]
+
+    for _ in range(row_count):
+        country, currency = rng.choice(COUNTRIES)
+        net = rng.randint(100, MAX_NET_CENTS)
+        yield [
+            rng.choice(dates), rng.choice(TRANSACTION_TYPES), country, currency,
+            f'{net / 100:.2f}', f'{net * 15 // 100 / 100:.2f}']
+
+
+def insert_transactions(row_count, seed=0, start_date=FIXTURE_START_DATE, days=FIXTURE_DAYS):
+    """
+    Save transactions to the database, as they would be after being imported (but unconverted).
+
+    The rows are inserted with plain INSERT statements, which is much quicker than creating
+    millions of model instances, to be able to fill the database with enough data to benchmark.
+    """
+    rng = random.Random(seed)
+    start_of_day = datetime.datetime.combine(
+        start_date, datetime.time.min, tzinfo=datetime.timezone.utc)
+    dates = [
+        connection.ops.adapt_datetimefield_value(start_of_day + datetime.timedelta(days=day))
+        for day in range(days)]
+    countries = [
+        (country, currency, Transaction.get_country_code(currency))
+        for country, currency in COUNTRIES]
+
+    def generate_rows(row_count):
+        for _ in range(row_count):
+            country, currency, country_code = rng.choice(countries)
+            net = rng.randint(100, MAX_NET_CENTS) * rng.choice((1, -1))
+            yield (
+                rng.choice(dates), rng.choice(TRANSACTION_TYPES).lower(), country, currency,
+                country_code, str(Decimal(net) / 100), str(Decimal(net * 15 // 100) / 100))
+
+    insert_sql = (
+        f'INSERT INTO {Transaction._meta.db_table} '
+        '(created_at, transaction_type, country, currency, country_code, net, vat) '
+        'VALUES (%s, %s, %s, %s, %s, %s, %s)')
+
+    with atomic(), connection.cursor() as cursor:
+        for batch_start in range(0, row_count, 10000):
+            cursor.executemany(
+                insert_sql, list(generate_rows(min(10000, row_count - batch_start))))
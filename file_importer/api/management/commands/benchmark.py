@@ -0,0 +1,255 @@
+import datetime
+import functools
+import hashlib
+import hmac
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from decimal import Decimal
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+
+from api.lib.codecs import JSON, MSGPACK, JSONCodec
+from api.lib.query_cache import NoQueryCache
+from api.management.commands._synthetic_data import (
+    COUNTRIES, FIXTURE_DAYS, FIXTURE_START_DATE, generate_transaction_data, insert_transactions)
+from api.models import Transaction
+
+STAGES = ['validate', 'save', 'convert', 'query', 'encode', 'decode']
+# Stages that are run once for each codec (see --codecs), measuring encoding a query response and
+# decoding an import request
+CODEC_STAGES = ['encode', 'decode']
+BENCHMARK_CODECS = {
+    'json': JSON,
+    'stdlib-json': JSONCodec(use_orjson=False),
+    'msgpack': MSGPACK
+}
+DEFAULT_ROW_COUNTS = [1000, 100000, 1000000]
+DEFAULT_FIXTURE = settings.BASE_DIR / 'api' / 'fixtures' / 'ecb_exchange_rates.json'
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the speed (rows per second) and peak memory use of validating, saving, '
+        'converting and querying transactions, and of encoding and decoding them, and write the '
+        'results as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROW_COUNTS)
+        parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+        parser.add_argument(
+            '--codecs', nargs='+', choices=list(BENCHMARK_CODECS),
+            default=[name for name, codec in BENCHMARK_CODECS.items() if codec.is_available()],
+            help='The codecs used by the encode and decode stages (by default, all installed)')
+        parser.add_argument(
+            '--output', help='The file to write the results to (as JSON), eg. to compare runs')
+        parser.add_argument('--seed', type=int, default=0)
+        # Used to run a single stage in a separate process - see _run_in_subprocess
+        parser.add_argument('--run-stage', choices=STAGES, help='(internal)')
+        parser.add_argument('--run-codec', choices=list(BENCHMARK_CODECS), help='(internal)')
+
+    def handle(self, *args, **options):
+        if options['run_stage']:
+            result = run_stage(
+                options['run_stage'], options['rows'][0], options['seed'], options['run_codec'])
+            self.stdout.write(json.dumps(result))
+            return
+
+        for codec_name in options['codecs']:
+            if not BENCHMARK_CODECS[codec_name].is_available():
+                raise CommandError(f'The {codec_name} codec is not installed')
+
+        results = []
+        for row_count in options['rows']:
+            for stage in options['stages']:
+                for codec_name in options['codecs'] if stage in CODEC_STAGES else [None]:
+                    result = self._run_in_subprocess(stage, row_count, options['seed'], codec_name)
+                    results.append(result)
+                    label = f'{stage} ({codec_name})' if codec_name else stage
+                    self.stdout.write(
+                        f'{label:>20} {row_count:>9} rows: {result["seconds"]:8.3f}s '
+                        f'{result["rows_per_second"]:>10.0f} rows/s '
+                        f'peak RSS {result["peak_rss_mb"]:7.1f}MB '
+                        f'(+{result["stage_rss_mb"]:.1f}MB during the stage)')
+
+        report = {
+            'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'json_library': JSON.library,
+            'seed': options['seed'],
+            'results': results
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                json.dump(report, output_file, indent=4)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    def _run_in_subprocess(self, stage, row_count, seed, codec_name=None):
+        # Each stage is run in a new process so that its peak memory use is its own
+        arguments = [
+            sys.executable, str(settings.BASE_DIR / 'manage.py'), 'benchmark', '--run-stage',
+            stage, '--rows', str(row_count), '--seed', str(seed)]
+        if codec_name:
+            arguments += ['--run-codec', codec_name]
+        process = subprocess.run(arguments, capture_output=True, text=True)
+        if process.returncode:
+            raise CommandError(
+                f'The {stage} stage failed with {row_count} rows:\n{process.stderr}')
+
+        return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def run_stage(stage, row_count, seed, codec_name=None):
+    """
+    Run a single stage of the benchmark, with row_count transactions, and return its results.
+
+    Each stage prepares its data and returns a function that does the work being measured, along
+    with the number of rows that it processes. The encode and decode stages are also given the
+    codec (see BENCHMARK_CODECS) to measure.
+
+    The stage is run against a new (file-based) test database, with the exchange rates read from
+    a fixture (EXCHANGE_RATE_FIXTURE, or api/fixtures/ecb_exchange_rates.json) and with no query
+    cache, so that the results only depend on the code being measured.
+    """
+    from api import lib
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        settings.EXCHANGE_RATE_FIXTURE = settings.EXCHANGE_RATE_FIXTURE or str(DEFAULT_FIXTURE)
+        settings.EXCHANGE_RATE_SNAPSHOT_PATH = os.path.join(temp_dir, 'exchange_rates.json')
+        lib.QUERY_CACHE = NoQueryCache()
+        connection.settings_dict['TEST']['NAME'] = os.path.join(temp_dir, 'benchmark.db')
+
+        database_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            # Load the exchange rates up front so they aren't part of any stage
+            lib.EXCHANGE_RATES.rates
+            prepare = STAGE_RUNNERS[stage]
+            if codec_name:
+                prepare = functools.partial(prepare, codec=BENCHMARK_CODECS[codec_name])
+            measure, processed_rows = prepare(row_count, seed)
+            start_rss = _get_peak_rss_mb()
+            start_time = time.perf_counter()
+            measure()
+            duration = time.perf_counter() - start_time
+            peak_rss = _get_peak_rss_mb()
+        finally:
+            connection.creation.destroy_test_db(database_name, verbosity=0)
+
+    return {
+        'stage': stage,
+        'codec': codec_name,
+        'rows': row_count,
+        'seconds': round(duration, 4),
+        'rows_per_second': round(processed_rows / duration, 1),
+        'peak_rss_mb': round(peak_rss, 1),
+        'stage_rss_mb': round(peak_rss - start_rss, 1)
+    }
+
+
+def _prepare_validate(row_count, seed):
+    from api.lib import FileImportService
+
+    file_import_service = FileImportService(
+        list(generate_transaction_data(row_count, seed)), False)
+    return file_import_service.validate_transaction_data, row_count
+
+
+def _prepare_save(row_count, seed):
+    from api.lib import FileImportService
+
+    file_import_service = FileImportService(
+        list(generate_transaction_data(row_count, seed)), False)
+    file_import_service.validate_transaction_data()
+    return file_import_service.save_transactions, row_count
+
+
+def _prepare_convert(row_count, seed):
+    from api.lib.transaction_conversion_service import TransactionConversionService
+
+    insert_transactions(row_count, seed)
+    return TransactionConversionService.convert_to_EUR, row_count
+
+
+def _prepare_query(row_count, seed):
+    """
+    Query every country on every day, which together return all of the transactions (except those
+    in Euros, as "EU" is not a country code that can be queried).
+    """
+    from api.lib.transaction_conversion_service import TransactionConversionService
+
+    insert_transactions(row_count, seed)
+    TransactionConversionService.convert_to_EUR()
+    queried_rows = Transaction.objects.exclude(currency='EUR').count()
+
+    os.environ.setdefault('API_SECRET_KEY', settings.API_SECRET_KEY)
+    client = Client(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+    requests = []
+    for day in range(FIXTURE_DAYS):
+        query_date = FIXTURE_START_DATE + datetime.timedelta(days=day)
+        for country_code in {
+                Transaction.get_country_code(currency) for _, currency in COUNTRIES
+                if currency != 'EUR'}:
+            body = json.dumps({
+                'api_partner_id': 'benchmark', 'country_code': country_code,
+                'query_date': query_date.strftime('%Y/%m/%d')}).encode()
+            security_hash = hmac.new(
+                os.environ['API_SECRET_KEY'].encode(), body, hashlib.sha256).hexdigest()
+            requests.append((body, security_hash))
+
+    def query():
+        for body, security_hash in requests:
+            response = client.generic(
+                'GET', '/api/v1/transactions/query', body, content_type='application/json',
+                HTTP_X_SECURITY_HASH=security_hash)
+            if response.status_code != 200:
+                raise CommandError(f'A query failed with a {response.status_code} status')
+
+    return query, queried_rows
+
+
+def _prepare_encode(row_count, seed, codec):
+    """Encode a query response of row_count transactions, as the query view does."""
+    response_data = {'transactions': [
+        [datetime.date(*map(int, created_at.split('/'))), country, currency,
+         transaction_type.lower(), Decimal(net), Decimal(vat), Decimal(net), Decimal(vat)]
+        for created_at, transaction_type, country, currency, net, vat
+        in generate_transaction_data(row_count, seed)]}
+
+    return functools.partial(codec.encode, response_data), row_count
+
+
+def _prepare_decode(row_count, seed, codec):
+    """Decode an import request of row_count transactions, as the import view does."""
+    request_body = codec.encode({
+        'api_partner_id': 'benchmark', 'ignore_errors': False, 'ignore_first_row': False,
+        'transaction_data': list(generate_transaction_data(row_count, seed))})
+
+    return functools.partial(codec.decode, request_body), row_count
+
+
+def _get_peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux (but bytes on macOS)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / 1024 / 1024 if sys.platform == 'darwin' else peak_rss / 1024
+
+
+STAGE_RUNNERS = {
+    'validate': _prepare_validate,
+    'save': _prepare_save,
+    'convert': _prepare_convert,
+    'query': _prepare_query,
+    'encode': _prepare_encode,
+    'decode': _prepare_decode
+}
@@ -0,0 +1,264 @@
+import asyncio
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+
+from api.lib.query_cache import NoQueryCache
+from api.management.commands._synthetic_data import (
+    COUNTRIES, FIXTURE_DAYS, FIXTURE_START_DATE, generate_transaction_data, insert_transactions)
+from api.models import Transaction
+
+MODE_WSGI = 'wsgi'
+MODE_ASGI = 'asgi'
+REQUEST_KINDS = ['query', 'import']
+DEFAULT_FIXTURE = settings.BASE_DIR / 'api' / 'fixtures' / 'ecb_exchange_rates.json'
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the sync views under WSGI with the async views under ASGI, as more and more '
+        'requests are in flight at once, and optionally write the results as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, nargs='+', default=[1, 8, 32, 128],
+            help='The numbers of requests to keep in flight at once')
+        parser.add_argument(
+            '--requests', type=int, default=100, help='The number of requests made at each level')
+        parser.add_argument('--kinds', nargs='+', choices=REQUEST_KINDS, default=REQUEST_KINDS)
+        parser.add_argument(
+            '--import-rows', type=int, default=100, help='The number of rows in each import')
+        parser.add_argument(
+            '--rows', type=int, default=20000,
+            help='The number of transactions in the database before the requests are made')
+        parser.add_argument(
+            '--wsgi-threads', type=int,
+            help=(
+                'The number of threads handling WSGI requests (by default, one per request in '
+                'flight, as a threaded WSGI server needs a thread per request)'))
+        parser.add_argument(
+            '--output', help='The file to write the results to (as JSON), eg. to compare runs')
+        parser.add_argument('--seed', type=int, default=0)
+        # Used to run a mode in a separate process - see _run_in_subprocess
+        parser.add_argument('--run-mode', choices=[MODE_WSGI, MODE_ASGI], help='(internal)')
+        parser.add_argument('--database-name', help='(internal)')
+
+    def handle(self, *args, **options):
+        if options['run_mode']:
+            connection.settings_dict['NAME'] = options['database_name']
+            _configure_benchmark()
+            results = run_mode(options['run_mode'], options)
+            self.stdout.write(json.dumps(results))
+            return
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            settings.EXCHANGE_RATE_SNAPSHOT_PATH = os.path.join(temp_dir, 'exchange_rates.json')
+            _configure_benchmark()
+            if connection.vendor == 'sqlite':
+                connection.settings_dict['TEST']['NAME'] = os.path.join(temp_dir, 'benchmark.db')
+
+            database_name = connection.creation.create_test_db(verbosity=0)
+            try:
+                from api.lib.transaction_conversion_service import TransactionConversionService
+
+                insert_transactions(options['rows'], options['seed'])
+                TransactionConversionService.convert_to_EUR()
+                connections.close_all()
+
+                results = []
+                for mode in (MODE_WSGI, MODE_ASGI):
+                    mode_results = self._run_in_subprocess(mode, database_name, temp_dir, options)
+                    results.extend(mode_results)
+                    for result in mode_results:
+                        self.stdout.write(
+                            f'{result["mode"]} {result["kind"]:>6} x{result["concurrency"]:<4}: '
+                            f'{result["requests_per_second"]:8.1f} requests/s, median '
+                            f'{result["median_seconds"]:.4f}s, p95 {result["p95_seconds"]:.4f}s, '
+                            f'{result["peak_threads"]} threads, {result["errors"]} errors')
+            finally:
+                connection.creation.destroy_test_db(database_name, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                json.dump({
+                    'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    'database': connection.vendor,
+                    'async_thread_pool_size': settings.ASYNC_THREAD_POOL_SIZE,
+                    'results': results
+                }, output_file, indent=4)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    def _run_in_subprocess(self, mode, database_name, temp_dir, options):
+        arguments = [
+            sys.executable, str(settings.BASE_DIR / 'manage.py'), 'benchmark_async',
+            '--run-mode', mode, '--database-name', database_name,
+            '--requests', str(options['requests']), '--import-rows', str(options['import_rows']),
+            '--seed', str(options['seed']), '--concurrency',
+            *[str(concurrency) for concurrency in options['concurrency']],
+            '--kinds', *options['kinds']]
+        if options['wsgi_threads']:
+            arguments += ['--wsgi-threads', str(options['wsgi_threads'])]
+
+        environment = {
+            **os.environ,
+            'ASYNC_VIEWS': 'true' if mode == MODE_ASGI else 'false',
+            'EXCHANGE_RATE_FIXTURE': settings.EXCHANGE_RATE_FIXTURE}
+        process = subprocess.run(arguments, capture_output=True, text=True, env=environment)
+        if process.returncode:
+            raise CommandError(f'The {mode} benchmark failed:\n{process.stderr}')
+
+        return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def run_mode(mode, options):
+    """
+    Make the requests of every kind at every level of concurrency, with the sync or async views.
+    """
+    results = []
+    for kind in options['kinds']:
+        for concurrency in options['concurrency']:
+            requests = _get_requests(kind, options)
+            if mode == MODE_WSGI:
+                latencies, errors, duration, peak_threads = _run_wsgi(
+                    requests, concurrency, options['wsgi_threads'] or concurrency)
+            else:
+                latencies, errors, duration, peak_threads = asyncio.run(
+                    _run_asgi(requests, concurrency))
+
+            latencies.sort()
+            results.append({
+                'mode': mode,
+                'kind': kind,
+                'concurrency': concurrency,
+                'requests_per_second': round(len(latencies) / duration, 1),
+                'median_seconds': round(statistics.median(latencies), 4),
+                'p95_seconds': round(latencies[int(len(latencies) * 0.95)], 4),
+                'peak_threads': peak_threads,
+                'errors': errors
+            })
+
+    return results
+
+
+def _run_wsgi(requests, concurrency, thread_count):
+    # Each request is handled by a thread (each with its own client and database connection), with
+    # up to concurrency requests waiting for or being handled by the threads at once
+    local = threading.local()
+    in_flight = threading.Semaphore(concurrency)
+    latencies = []
+    errors = []
+    peak_threads = [threading.active_count()]
+
+    def make_request(request, submitted_at):
+        try:
+            if not hasattr(local, 'client'):
+                local.client = Client()
+            method, url, body, security_hash = request
+            response = local.client.generic(
+                method, url, body, content_type='application/json',
+                HTTP_X_SECURITY_HASH=security_hash)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+        except Exception:
+            errors.append('exception')
+        finally:
+            latencies.append(time.perf_counter() - submitted_at)
+            peak_threads[0] = max(peak_threads[0], threading.active_count())
+            in_flight.release()
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=thread_count) as executor:
+        for request in requests:
+            in_flight.acquire()
+            executor.submit(make_request, request, time.perf_counter())
+    duration = time.perf_counter() - start_time
+    connections.close_all()
+
+    return latencies, len(errors), duration, peak_threads[0]
+
+
+async def _run_asgi(requests, concurrency):
+    # All of the requests are handled by this thread's event loop (and the async views' thread
+    # pool)
+    client = AsyncClient()
+    in_flight = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = []
+    peak_threads = [threading.active_count()]
+
+    async def make_request(request):
+        async with in_flight:
+            start_time = time.perf_counter()
+            try:
+                # The async test client takes headers as they are sent, not as WSGI environ keys
+                method, url, body, security_hash = request
+                response = await client.generic(
+                    method, url, body, content_type='application/json',
+                    x_security_hash=security_hash)
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+            except Exception:
+                errors.append('exception')
+            latencies.append(time.perf_counter() - start_time)
+            peak_threads[0] = max(peak_threads[0], threading.active_count())
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*[make_request(request) for request in requests])
+    duration = time.perf_counter() - start_time
+
+    return latencies, len(errors), duration, peak_threads[0]
+
+
+def _get_requests(kind, options):
+    """Return the arguments of the requests to make, signed with the security hash header."""
+    rng = random.Random(options['seed'])
+    country_codes = sorted({
+        Transaction.get_country_code(currency) for _, currency in COUNTRIES if currency != 'EUR'})
+
+    requests = []
+    for request_number in range(options['requests']):
+        if kind == 'import':
+            url, method = '/api/v1/transactions/import', 'POST'
+            body = {
+                'api_partner_id': 'benchmark', 'ignore_errors': False, 'ignore_first_row': False,
+                'transaction_data': list(generate_transaction_data(
+                    options['import_rows'], seed=f'{request_number}:{time.time()}'))}
+        else:
+            url, method = '/api/v1/transactions/query', 'GET'
+            query_date = FIXTURE_START_DATE + datetime.timedelta(days=rng.randrange(FIXTURE_DAYS))
+            body = {
+                'api_partner_id': 'benchmark', 'country_code': rng.choice(country_codes),
+                'query_date': query_date.strftime('%Y/%m/%d')}
+
+        body = json.dumps(body).encode()
+        security_hash = hmac.new(
+            os.environ['API_SECRET_KEY'].encode(), body, hashlib.sha256).hexdigest()
+        requests.append((method, url, body, security_hash))
+
+    return requests
+
+
+def _configure_benchmark():
+    from api import lib
+
+    # The exchange rates are read from the fixture, not the ECB, no queries are cached and the
+    # requests are made by Django's test clients
+    settings.EXCHANGE_RATE_FIXTURE = settings.EXCHANGE_RATE_FIXTURE or str(DEFAULT_FIXTURE)
+    os.environ.setdefault('API_SECRET_KEY', settings.API_SECRET_KEY)
+    lib.QUERY_CACHE = NoQueryCache()
+    settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
@@ -0,0 +1,218 @@
+import datetime
+import json
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+from collections import Counter
+from django import db
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+WORKER_IMPORT = 'import'
+WORKER_QUERY = 'query'
+DEFAULT_FIXTURE = settings.BASE_DIR / 'api' / 'fixtures' / 'ecb_exchange_rates.json'
+
+
+def run_worker(kind, worker_id, database_name, options, start_at, results):
+    """
+    Make import or query requests, one after another, from start_at for options['duration'] seconds
+    and put the results on the results queue.
+    """
+    import django
+    django.setup()
+
+    import hashlib
+    import hmac
+    import random
+
+    from django.db import connection
+    from django.test import Client
+
+    from api import lib
+    from api.lib.query_cache import NoQueryCache
+    from api.management.commands._synthetic_data import (
+        COUNTRIES, FIXTURE_DAYS, FIXTURE_START_DATE, generate_transaction_data)
+    from api.models import Transaction
+
+    _configure_benchmark(options)
+    connection.settings_dict['NAME'] = database_name
+    lib.QUERY_CACHE = NoQueryCache()
+
+    rng = random.Random(f'{options["seed"]}:{kind}:{worker_id}')
+    country_codes = sorted({
+        Transaction.get_country_code(currency) for _, currency in COUNTRIES if currency != 'EUR'})
+    client = Client(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+
+    def get_request(request_number):
+        if kind == WORKER_IMPORT:
+            body = {
+                'api_partner_id': 'benchmark', 'ignore_errors': False, 'ignore_first_row': False,
+                'transaction_data': list(generate_transaction_data(
+                    options['import_rows'], seed=f'{worker_id}:{request_number}:{start_at}'))}
+            return '/api/v1/transactions/import', 'POST', body, options['import_rows']
+
+        query_date = FIXTURE_START_DATE + datetime.timedelta(days=rng.randrange(FIXTURE_DAYS))
+        body = {
+            'api_partner_id': 'benchmark', 'country_code': rng.choice(country_codes),
+            'query_date': query_date.strftime('%Y/%m/%d')}
+        return '/api/v1/transactions/query', 'GET', body, 0
+
+    latencies = []
+    errors = Counter()
+    row_count = 0
+    request_number = 0
+    time.sleep(max(0, start_at - time.time()))
+    while time.time() < start_at + options['duration']:
+        url, method, body, request_rows = get_request(request_number)
+        body = json.dumps(body).encode()
+        security_hash = hmac.new(
+            os.environ['API_SECRET_KEY'].encode(), body, hashlib.sha256).hexdigest()
+        request_number += 1
+
+        start_time = time.perf_counter()
+        try:
+            response = client.generic(
+                method, url, body, content_type='application/json',
+                HTTP_X_SECURITY_HASH=security_hash)
+            error = None if response.status_code == 200 else f'{response.status_code} status'
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+        latencies.append(time.perf_counter() - start_time)
+
+        if error:
+            errors[error] += 1
+        else:
+            row_count += request_rows
+
+    results.put({
+        'kind': kind,
+        'finished_at': time.time(),
+        'latencies': latencies,
+        'rows': row_count,
+        'errors': dict(errors)
+    })
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the throughput of concurrent imports and queries as the number of worker '
+        'processes grows, and optionally write the results as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, nargs='+', default=[1, 2, 4, 8],
+            help='The numbers of import workers (and as many query workers) to run at once')
+        parser.add_argument(
+            '--duration', type=float, default=10.0,
+            help='The number of seconds each set of workers is run for')
+        parser.add_argument(
+            '--import-rows', type=int, default=1000, help='The number of rows in each import')
+        parser.add_argument(
+            '--rows', type=int, default=100000,
+            help='The number of transactions in the database before the workers start')
+        parser.add_argument(
+            '--output', help='The file to write the results to (as JSON), eg. to compare runs')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        """
+        Run the workers against a new test database (a file, when using SQLite, so that it can be
+        shared between the workers' processes) filled with options['rows'] converted transactions.
+        """
+        from api import lib
+        from api.lib.query_cache import NoQueryCache
+        from api.lib.transaction_conversion_service import TransactionConversionService
+        from api.management.commands._synthetic_data import insert_transactions
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            options['snapshot_path'] = os.path.join(temp_dir, 'exchange_rates.json')
+            _configure_benchmark(options)
+            lib.QUERY_CACHE = NoQueryCache()
+            if db.connection.vendor == 'sqlite':
+                db.connection.settings_dict['TEST']['NAME'] = os.path.join(
+                    temp_dir, 'benchmark.db')
+
+            database_name = db.connection.creation.create_test_db(verbosity=0)
+            try:
+                insert_transactions(options['rows'], options['seed'])
+                TransactionConversionService.convert_to_EUR()
+
+                results = []
+                for worker_count in options['workers']:
+                    result = self._run_workers(worker_count, database_name, options)
+                    results.append(result)
+                    self._write_result(result)
+            finally:
+                db.connections.close_all()
+                db.connection.creation.destroy_test_db(database_name, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                json.dump({
+                    'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    'database': db.connection.vendor,
+                    'duration': options['duration'],
+                    'import_rows': options['import_rows'],
+                    'rows': options['rows'],
+                    'results': results
+                }, output_file, indent=4)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    def _run_workers(self, worker_count, database_name, options):
+        # The worker processes must each open their own database connections, and are given time to
+        # start up before they all start making requests at once
+        db.connections.close_all()
+        start_at = time.time() + 2
+        results_queue = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(
+                target=run_worker,
+                args=(kind, worker_id, database_name, options, start_at, results_queue))
+            for kind in (WORKER_IMPORT, WORKER_QUERY) for worker_id in range(worker_count)]
+        for worker in workers:
+            worker.start()
+        worker_results = [results_queue.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+
+        duration = max(r['finished_at'] for r in worker_results) - start_at
+        result = {'workers': worker_count, 'seconds': round(duration, 3)}
+        for kind in (WORKER_IMPORT, WORKER_QUERY):
+            kind_results = [r for r in worker_results if r['kind'] == kind]
+            latencies = sorted(latency for r in kind_results for latency in r['latencies'])
+            errors = Counter()
+            for r in kind_results:
+                errors.update(r['errors'])
+            error_count = sum(errors.values())
+
+            result[kind] = {
+                'requests_per_second': round((len(latencies) - error_count) / duration, 2),
+                'rows_per_second': round(sum(r['rows'] for r in kind_results) / duration, 1),
+                'median_seconds': round(statistics.median(latencies), 4) if latencies else None,
+                'p95_seconds': (
+                    round(latencies[int(len(latencies) * 0.95)], 4) if latencies else None),
+                'errors': dict(errors)
+            }
+
+        return result
+
+    def _write_result(self, result):
+        imports = result[WORKER_IMPORT]
+        queries = result[WORKER_QUERY]
+        self.stdout.write(
+            f'{result["workers"]:>3} worker(s): '
+            f'{imports["requests_per_second"]:8.2f} imports/s '
+            f'({imports["rows_per_second"]:.0f} rows/s, p95 {imports["p95_seconds"]}s) '
+            f'{queries["requests_per_second"]:8.2f} queries/s (p95 {queries["p95_seconds"]}s)')
+        for kind in (WORKER_IMPORT, WORKER_QUERY):
+            for error, count in result[kind]['errors'].items():
+                self.stdout.write(f'    {count} {kind} error(s): {error}')
+
+
+def _configure_benchmark(options):
+    # The exchange rates are read from the fixture, not the ECB
+    settings.EXCHANGE_RATE_FIXTURE = settings.EXCHANGE_RATE_FIXTURE or str(DEFAULT_FIXTURE)
+    settings.EXCHANGE_RATE_SNAPSHOT_PATH = options['snapshot_path']
@@ -0,0 +1,61 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.management.commands._synthetic_data import COUNTRIES, insert_transactions
+from api.models import Transaction
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the speed of finding transactions by country code and date by the first two '
+        'characters of their currency (before) and by their indexed country code (after)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000000)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--queries', type=int, default=50)
+
+    def handle(self, *args, **options):
+        # Use a separate test database so that no real data is touched
+        database_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            self._populate(options['rows'], options['days'])
+            self._compare_queries(options['days'], options['queries'])
+        finally:
+            connection.creation.destroy_test_db(database_name, verbosity=0)
+
+    def _populate(self, row_count, days):
+        start_time = time.perf_counter()
+        insert_transactions(row_count, days=days)
+        self.stdout.write(
+            f'Inserted {row_count} transactions in {time.perf_counter() - start_time:.1f}s')
+
+    def _compare_queries(self, days, query_count):
+        start_date = datetime.datetime(2021, 11, 29, tzinfo=datetime.timezone.utc)
+        queries = [
+            (Transaction.get_country_code(currency),
+             start_date + datetime.timedelta(days=index * 7 % days))
+            for index, (country, currency) in enumerate(COUNTRIES * query_count)][:query_count]
+
+        def query_before(country_code, query_date):
+            return Transaction.objects.filter(
+                currency__istartswith=country_code, created_at__gte=query_date,
+                created_at__lt=query_date + datetime.timedelta(days=1))
+
+        def query_after(country_code, query_date):
+            return Transaction.objects.get_by_country_code_and_date(country_code, query_date)
+
+        for label, query in [('before', query_before), ('after', query_after)]:
+            row_count = 0
+            start_time = time.perf_counter()
+            for country_code, query_date in queries:
+                row_count += len(list(query(country_code, query_date)))
+            duration = time.perf_counter() - start_time
+
+            self.stdout.write(
+                f'{label}: {query_count} queries returning {row_count} transactions in '
+                f'{duration:.3f}s ({duration / query_count * 1000:.1f}ms per query)')
+            self.stdout.write(f'    {query(*queries[0]).explain()}')
@@ -0,0 +1,78 @@
+import logging
+import multiprocessing
+import time
+
+from django import db
+from django.core.management.base import BaseCommand
+
+logger = logging.getLogger(__name__)
+
+# The shortest and longest times (in seconds) that a worker waits before trying the database again
+MIN_RETRY_INTERVAL = 1
+MAX_RETRY_INTERVAL = 60
+
+
+def run_worker(poll_interval, run_once):
+    """
+    Run the import jobs in the queue, one at a time, waiting for new jobs when it is empty.
+
+    When the database can't be used, eg. SQLite is still locked by another worker after waiting
+    SQLITE_TIMEOUT seconds, the worker waits (for twice as long each time it happens again) and
+    tries again. A job that was interrupted is resumed once its heartbeat is stale (see
+    ImportJobService).
+    """
+    import django
+    django.setup()
+
+    from api.lib.import_job_service import ImportJobService
+    from api.models import ImportJob
+
+    retry_interval = MIN_RETRY_INTERVAL
+    while True:
+        try:
+            job = ImportJob.objects.claim_next_job()
+            if job:
+                ImportJobService.run_job(job)
+        except db.OperationalError:
+            logger.warning(
+                f'Unable to use the database, trying again in {retry_interval:g}s', exc_info=True)
+            time.sleep(retry_interval)
+            retry_interval = min(retry_interval * 2, MAX_RETRY_INTERVAL)
+            continue
+
+        retry_interval = MIN_RETRY_INTERVAL
+        if job:
+            continue
+        if run_once:
+            return
+        time.sleep(poll_interval)
+
+
+class Command(BaseCommand):
+    help = 'Run the queued import jobs, using a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=1, help='The number of worker processes to run')
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='The number of seconds to wait before checking an empty queue for new jobs')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Stop once the queue is empty instead of waiting for new jobs')
+
+    def handle(self, *args, **options):
+        worker_arguments = (options['poll_interval'], options['once'])
+        if options['workers'] == 1:
+            run_worker(*worker_arguments)
+            return
+
+        # The worker processes must each open their own database connections
+        db.connections.close_all()
+        workers = [
+            multiprocessing.Process(target=run_worker, args=worker_arguments)
+            for _ in range(options['workers'])]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
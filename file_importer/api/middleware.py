@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from api.lib.metrics import METRICS, finish_request, start_request
+
+
+class MetricsMiddleware():
+    """
+    Measure every request - its duration, database queries, bytes and the stages timed by the view
+    (see api.lib.metrics.timed) - for the /metrics endpoint and, optionally, the Server-Timing
+    header.
+
+    Streamed responses are measured until they start streaming, other than the bytes they send.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+
+        self.get_response = get_response
+
+        # Under ASGI, the middleware is called asynchronously (like Django's own middleware) so
+        # that requests aren't passed through a thread
+        if asyncio.iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self._call_async(request)
+
+        request_metrics, token = start_request()
+        start_time = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            finish_request(token)
+
+        return self._record(request, response, request_metrics, time.perf_counter() - start_time)
+
+    async def _call_async(self, request):
+        request_metrics, token = start_request()
+        start_time = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            finish_request(token)
+
+        return self._record(request, response, request_metrics, time.perf_counter() - start_time)
+
+    def _record(self, request, response, request_metrics, seconds):
+        request_metrics.view = getattr(request.resolver_match, 'url_name', None) or 'unknown'
+        request_metrics.record(
+            METRICS, response.status_code, seconds, int(request.META.get('CONTENT_LENGTH') or 0))
+
+        view_labels = {'view': request_metrics.view}
+        if response.streaming:
+            response.streaming_content = _count_bytes(response.streaming_content, view_labels)
+        else:
+            METRICS.increment('response_bytes_total', view_labels, len(response.content))
+
+        if settings.METRICS_SERVER_TIMING:
+            response['Server-Timing'] = request_metrics.get_server_timing(seconds)
+
+        return response
+
+
+def _count_bytes(streaming_content, labels):
+    response_bytes = 0
+    try:
+        for chunk in streaming_content:
+            response_bytes += len(chunk)
+            yield chunk
+    finally:
+        METRICS.increment('response_bytes_total', labels, response_bytes)
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.9 on 2026-10-18 08:48
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_id', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('api_partner_id', models.CharField(max_length=100)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('payload_path', models.CharField(max_length=255)),
+                ('ignore_errors', models.BooleanField(default=False)),
+                ('ignore_first_row', models.BooleanField(default=False)),
+                ('rows_validated', models.IntegerField(default=0)),
+                ('rows_inserted', models.IntegerField(default=0)),
+                ('error_count', models.IntegerField(default=0)),
+                ('success', models.BooleanField(null=True)),
+                ('message', models.TextField(blank=True)),
+                ('errors', models.JSONField(default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='date created')),
+                ('started_at', models.DateTimeField(null=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='importjob',
+            index=models.Index(fields=['status', 'id'], name='api_importj_status_37e650_idx'),
+        ),
+    ]
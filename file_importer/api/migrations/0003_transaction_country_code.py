@@ -0,0 +1,32 @@
+from django.db import migrations, models
+from django.db.models.functions import Substr, Upper
+
+
+def set_country_codes(apps, schema_editor):
+    Transaction = apps.get_model('api', 'Transaction')
+    Transaction.objects.update(country_code=Upper(Substr('currency', 1, 2)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='country_code',
+            field=models.CharField(default='', max_length=2),
+            preserve_default=False,
+        ),
+        migrations.RunPython(set_country_codes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['country_code', 'created_at'], name='api_transac_country_95b62a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['currency', 'created_at'], name='api_transac_currenc_ec4986_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 3.2.9 on 2026-10-18 09:05
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+
+
+def summarise_transactions(apps, schema_editor):
+    Transaction = apps.get_model('api', 'Transaction')
+    DailyTransactionSummary = apps.get_model('api', 'DailyTransactionSummary')
+
+    def total(amount):
+        return Coalesce(
+            Sum(amount), Value(0), output_field=DecimalField(max_digits=20, decimal_places=2))
+
+    summary_totals = Transaction.objects.order_by().annotate(
+        date=TruncDate('created_at')).values(
+            'country_code', 'date', 'currency', 'transaction_type').annotate(
+                total_transaction_count=Count('id'),
+                total_converted_count=Count('id', filter=Q(net_euro__isnull=False)),
+                total_net=total('net'), total_vat=total('vat'), total_net_euro=total('net_euro'),
+                total_vat_euro=total('vat_euro'))
+
+    DailyTransactionSummary.objects.bulk_create(
+        (DailyTransactionSummary(
+            country_code=summary_total['country_code'], date=summary_total['date'],
+            currency=summary_total['currency'], transaction_type=summary_total['transaction_type'],
+            transaction_count=summary_total['total_transaction_count'],
+            converted_count=summary_total['total_converted_count'],
+            net=summary_total['total_net'], vat=summary_total['total_vat'],
+            net_euro=summary_total['total_net_euro'], vat_euro=summary_total['total_vat_euro'])
+         for summary_total in summary_totals.iterator()),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_transaction_country_code'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyTransactionSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('country_code', models.CharField(max_length=2)),
+                ('date', models.DateField()),
+                ('currency', models.CharField(max_length=3)),
+                ('transaction_type', models.CharField(max_length=50)),
+                ('transaction_count', models.IntegerField(default=0)),
+                ('converted_count', models.IntegerField(default=0)),
+                ('net', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('vat', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('net_euro', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('vat_euro', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailytransactionsummary',
+            constraint=models.UniqueConstraint(fields=('country_code', 'date', 'currency', 'transaction_type'), name='unique_daily_transaction_summary'),
+        ),
+        migrations.RunPython(summarise_transactions, migrations.RunPython.noop),
+    ]
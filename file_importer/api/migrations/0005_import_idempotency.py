@@ -0,0 +1,33 @@
+# Generated by Django 3.2.9 on 2026-10-18 09:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_dailytransactionsummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportRequest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('api_partner_id', models.CharField(max_length=100)),
+                ('request_key', models.CharField(max_length=64)),
+                ('status_code', models.IntegerField(null=True)),
+                ('response', models.JSONField(null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='date created')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='fingerprint',
+            field=models.CharField(max_length=64, null=True, unique=True),
+        ),
+        migrations.AddConstraint(
+            model_name='importrequest',
+            constraint=models.UniqueConstraint(fields=('api_partner_id', 'request_key'), name='unique_import_request'),
+        ),
+    ]
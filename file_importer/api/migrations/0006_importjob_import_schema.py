@@ -0,0 +1,18 @@
+# Generated by Django 3.2.9 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_import_idempotency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='import_schema',
+            field=models.CharField(default='vat', max_length=50),
+        ),
+    ]
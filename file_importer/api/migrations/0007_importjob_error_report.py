@@ -0,0 +1,28 @@
+# Generated by Django 3.2.9 on 2026-10-18 09:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_importjob_import_schema'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='error_report',
+            field=models.CharField(default='inline', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='error_summary',
+            field=models.JSONField(null=True),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='max_errors',
+            field=models.IntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.9 on 2026-10-18 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_importjob_error_report'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='rows_saved',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.9 on 2026-10-18 10:50
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_importjob_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importrequest',
+            name='heartbeat_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
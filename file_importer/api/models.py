@@ -1,6 +1,17 @@
 import datetime
+import hashlib
+import uuid
 
-from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, models
+from django.db.models import Q
+from django.db.transaction import atomic
+from django.utils import timezone
+
+# The most ranges of IDs matched by one query (see TransactionManager.get_batches_by_ids), which
+# keeps it within the limits that databases like SQLite put on the number of parameters in a query
+# (999) and the depth of its expressions (1000)
+MAX_ID_RANGES = 250
 
 
 class TransactionManager(models.Manager):
@@ -8,6 +19,41 @@ class TransactionManager(models.Manager):
     def get_unconverted_transactions(self):
         return super().get_queryset().filter(net_euro__isnull=True)
 
+    def get_batches_by_ids(self, transaction_ids):
+        """
+        Return the transactions with the given IDs, as a list of querysets (batches) that together
+        match every one of them.
+
+        IDs of imported transactions are mostly consecutive, so they are matched as ranges of IDs
+        rather than one (potentially enormous) list of IDs - a single batch, unless the IDs are in
+        more than MAX_ID_RANGES ranges (eg. when duplicate rows are skipped), in which case each
+        batch matches up to MAX_ID_RANGES of them. IDs that aren't part of a range are matched
+        with a list of IDs instead.
+        """
+        if isinstance(transaction_ids, range):
+            return [super().get_queryset().filter(
+                id__gte=transaction_ids.start, id__lt=transaction_ids.stop)]
+
+        id_ranges = []
+        sorted_ids = sorted(transaction_ids)
+        range_start = previous_id = sorted_ids[0]
+        for transaction_id in sorted_ids[1:] + [None]:
+            if transaction_id != previous_id + 1:
+                id_ranges.append((range_start, previous_id))
+                range_start = transaction_id
+            previous_id = transaction_id
+
+        batches = []
+        for index in range(0, len(id_ranges), MAX_ID_RANGES):
+            batch_ranges = id_ranges[index:index + MAX_ID_RANGES]
+            id_filter = models.Q(id__in=[start for start, end in batch_ranges if start == end])
+            for start, end in batch_ranges:
+                if start != end:
+                    id_filter |= models.Q(id__gte=start, id__lte=end)
+            batches.append(super().get_queryset().filter(id_filter))
+
+        return batches
+
     def get_by_country_code_and_date(self, country_code, query_date):
         """
         Return all transactions matching the given country code and date.
@@ -16,15 +62,31 @@ class TransactionManager(models.Manager):
         consistent, this query will filter based on the first two characters in the currency,
         i.e. a query for United States will pass through country-code = 'US' which will match on
         'USD'. This is crude and assumes that no currency has the SAME first two characters.
+
+        Those two characters are saved as the country code of each transaction when it is imported
+        so that the transactions can be found using an index (on country code and date).
         """
         start_date = query_date
         end_date = query_date + datetime.timedelta(days=1)
 
         return super().get_queryset().filter(
-            currency__istartswith=country_code,
+            country_code=country_code.upper(),
             created_at__gte=start_date,
             created_at__lt=end_date)
 
+    def get_by_country_codes_and_dates(self, country_codes, start_date, end_date):
+        """
+        Return all transactions matching any of the given country codes, from start_date to
+        end_date (inclusive) - see get_by_country_code_and_date.
+
+        This is a single query that uses the same index, seeking to the range of dates of each
+        country code in turn.
+        """
+        return super().get_queryset().filter(
+            country_code__in=[country_code.upper() for country_code in country_codes],
+            created_at__gte=start_date,
+            created_at__lt=end_date + datetime.timedelta(days=1))
+
 
 class Transaction(models.Model):
     created_at = models.DateTimeField('date created')
@@ -35,5 +97,235 @@ class Transaction(models.Model):
     vat = models.DecimalField(max_digits=5, decimal_places=2)
     net_euro = models.DecimalField(max_digits=5, decimal_places=2, null=True)
     vat_euro = models.DecimalField(max_digits=5, decimal_places=2, null=True)
+    country_code = models.CharField(max_length=2)
+    # Only set when duplicate transactions are skipped on import - see IMPORT_SKIP_DUPLICATE_ROWS
+    fingerprint = models.CharField(max_length=64, null=True, unique=True)
 
     objects = TransactionManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['country_code', 'created_at']),
+            models.Index(fields=['currency', 'created_at']),
+        ]
+
+    @staticmethod
+    def get_country_code(currency):
+        """Return the country code of a currency (see get_by_country_code_and_date)."""
+        return currency[:2].upper()
+
+    @staticmethod
+    def get_fingerprint(created_at, transaction_type, country, currency, net, vat):
+        """
+        Return a hash of a transaction's details, which is the same for identical transactions.
+        """
+        details = '|'.join([
+            created_at.isoformat(), transaction_type, country, currency, f'{net:.2f}',
+            f'{vat:.2f}'])
+        return hashlib.sha256(details.encode()).hexdigest()
+
+
+class DailyTransactionSummaryManager(models.Manager):
+
+    def get_by_country_code_and_date(self, country_code, query_date):
+        return super().get_queryset().filter(
+            country_code=country_code.upper(), date=query_date).order_by(
+                'currency', 'transaction_type')
+
+
+class DailyTransactionSummary(models.Model):
+    """
+    The number and totals of the transactions of each currency and type, per country and day.
+
+    These are kept up to date as transactions are imported and converted to Euros (see
+    TransactionSummaryService), so that a day's totals can be read without reading every
+    transaction. Only converted_count of the transactions are included in the Euro totals.
+    """
+    country_code = models.CharField(max_length=2)
+    date = models.DateField()
+    currency = models.CharField(max_length=3)
+    transaction_type = models.CharField(max_length=50)
+    transaction_count = models.IntegerField(default=0)
+    converted_count = models.IntegerField(default=0)
+    net = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    vat = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    net_euro = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    vat_euro = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    objects = DailyTransactionSummaryManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['country_code', 'date', 'currency', 'transaction_type'],
+                name='unique_daily_transaction_summary'),
+        ]
+
+
+class ImportJobManager(models.Manager):
+
+    def claim_next_job(self):
+        """
+        Claim the oldest pending job, so that no other worker will run it, and return it.
+
+        A job is only claimed by the worker whose update changes it from pending to running, so any
+        number of workers can safely take jobs from the queue at the same time.
+
+        The worker running a job updates its heartbeat after every window of rows (see
+        update_claimed_job). A running job whose heartbeat is more than IMPORT_JOB_TIMEOUT seconds
+        old is assumed to belong to a worker that was stopped before finishing it and is claimed
+        again - it is resumed from the last window of rows that was saved.
+        """
+        stale_at = timezone.now() - datetime.timedelta(seconds=settings.IMPORT_JOB_TIMEOUT)
+        pending_jobs = super().get_queryset().filter(
+            Q(status=ImportJob.STATUS_PENDING)
+            | Q(status=ImportJob.STATUS_RUNNING, heartbeat_at__lt=stale_at))
+        while True:
+            job = pending_jobs.order_by('id').first()
+            if job is None:
+                return None
+
+            started_at = timezone.now()
+            # A stale job is only claimed if it hasn't been claimed again in the meantime
+            claimed = pending_jobs.filter(id=job.id, heartbeat_at=job.heartbeat_at).update(
+                status=ImportJob.STATUS_RUNNING, started_at=started_at, heartbeat_at=started_at)
+            if claimed:
+                job.status = ImportJob.STATUS_RUNNING
+                job.started_at = job.heartbeat_at = started_at
+                return job
+
+    def update_claimed_job(self, job, **fields):
+        """
+        Update the job claimed by this worker, along with its heartbeat, returning False (and
+        updating nothing) if it has since been claimed by another worker.
+        """
+        job.heartbeat_at = timezone.now()
+        updated = super().get_queryset().filter(
+            id=job.id, status=ImportJob.STATUS_RUNNING, started_at=job.started_at).update(
+                heartbeat_at=job.heartbeat_at, **fields)
+        for name, value in fields.items():
+            setattr(job, name, value)
+
+        return bool(updated)
+
+
+class ImportJob(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    job_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    api_partner_id = models.CharField(max_length=100)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    payload_path = models.CharField(max_length=255)
+    ignore_errors = models.BooleanField(default=False)
+    ignore_first_row = models.BooleanField(default=False)
+    import_schema = models.CharField(max_length=50, default='vat')
+    error_report = models.CharField(max_length=20, default='inline')
+    max_errors = models.IntegerField(null=True)
+    rows_validated = models.IntegerField(default=0)
+    rows_inserted = models.IntegerField(default=0)
+    # The number of rows whose transactions have been saved, which an interrupted job resumes from
+    rows_saved = models.IntegerField(default=0)
+    error_count = models.IntegerField(default=0)
+    success = models.BooleanField(null=True)
+    message = models.TextField(blank=True)
+    errors = models.JSONField(default=list)
+    error_summary = models.JSONField(null=True)
+    created_at = models.DateTimeField('date created', auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    heartbeat_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+
+    objects = ImportJobManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id']),
+        ]
+
+
+class ImportRequestManager(models.Manager):
+
+    def claim(self, api_partner_id, request_key):
+        """
+        Claim an import request, so that it's only imported once, returning it and whether it was
+        claimed.
+
+        If the request has already been claimed (within the last IMPORT_IDEMPOTENCY_TTL seconds),
+        the existing import request is returned instead, along with False. A claim that hasn't
+        finished, and whose heartbeat (see keep_claim) is older than IMPORT_CLAIM_TIMEOUT seconds,
+        is assumed to have been abandoned (eg. its process was killed, rolling the import back) and
+        can be claimed again.
+        """
+        now = timezone.now()
+        expired_at = now - datetime.timedelta(seconds=settings.IMPORT_IDEMPOTENCY_TTL)
+        abandoned_at = now - datetime.timedelta(seconds=settings.IMPORT_CLAIM_TIMEOUT)
+        super().get_queryset().filter(
+            Q(created_at__lt=expired_at) | Q(
+                status_code__isnull=True, heartbeat_at__lt=abandoned_at),
+            api_partner_id=api_partner_id, request_key=request_key).delete()
+
+        try:
+            with atomic():
+                return self.create(api_partner_id=api_partner_id, request_key=request_key), True
+        except IntegrityError:
+            return self.get(api_partner_id=api_partner_id, request_key=request_key), False
+
+    def keep_claim(self, import_request):
+        """
+        Renew the heartbeat of a claimed import request that is still being imported, returning
+        False if it has since been abandoned and claimed again.
+
+        This is done at the start of the database transaction that saves the import, which then
+        holds on to the claim until it is committed (PostgreSQL locks the import request's row and
+        SQLite the whole database), so that it can't be claimed again while it is being saved.
+        """
+        now = timezone.now()
+        import_request.heartbeat_at = now
+        return bool(super().get_queryset().filter(
+            pk=import_request.pk, status_code__isnull=True).update(heartbeat_at=now))
+
+
+class ImportRequestReclaimed(Exception):
+    """The claim of an import request was abandoned, and claimed again, before it was saved."""
+
+
+class ImportRequest(models.Model):
+    """
+    An import request, by its idempotency key (or the hash of its contents), and its response.
+
+    Partners retry imports that time out, so a repeated request returns the response of the first
+    one instead of importing the transactions again.
+    """
+    api_partner_id = models.CharField(max_length=100)
+    request_key = models.CharField(max_length=64)
+    status_code = models.IntegerField(null=True)
+    response = models.JSONField(null=True)
+    created_at = models.DateTimeField('date created', auto_now_add=True)
+    heartbeat_at = models.DateTimeField(default=timezone.now)
+
+    objects = ImportRequestManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['api_partner_id', 'request_key'], name='unique_import_request'),
+        ]
+
+    @property
+    def is_complete(self):
+        return self.status_code is not None
+
+    def complete(self, status_code, response):
+        """Save the response of the import, which is returned to any retries of the request."""
+        self.status_code = status_code
+        self.response = response
+        self.save(update_fields=['status_code', 'response'])
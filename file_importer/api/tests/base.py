@@ -0,0 +1,126 @@
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import tempfile
+
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from api.lib.file_validation_service import FileValidationService
+from api.lib.import_schemas import get_import_schema
+from api.lib.query_cache import get_query_cache
+
+API_SECRET_KEY = 'test-secret'
+EXCHANGE_RATE_FIXTURE = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), 'fixtures', 'ecb_exchange_rates.json')
+
+VALID_ROWS = [
+    ['2021/12/06', 'Sale', 'United States', 'USD', '100.00', '15.00'],
+    ['2021/12/06', 'Purchase', 'United States', 'USD', '40.00', '6.00'],
+    ['2021/12/06', 'Sale', 'South Africa', 'ZAR', '250.00', '37.50'],
+    ['2021/12/07', ' sale ', 'United Kingdom', 'GBP', '10.50', '2.10'],
+]
+INVALID_ROWS = [
+    ['2021/12/06', 'Sale', 'United States', 'USD', '100.00', '15.00'],
+    ['2021/13/06', 'Sale', 'United States', 'USD', '100.00', '15.00'],
+    ['2021/12/06', 'Sael', 'United States', 'XXX', '100.00', '15.00'],
+    ['2021/12/06', 'Sale', 'United States', 'USD', 'abc', '15.00'],
+    ['2021/12/07', 'Purchase', 'United Kingdom', 'GBP', '10.50', '2.10'],
+    ['bad', 'Sale', 'United States', 'USD', '1.00', 'bad'],
+]
+
+
+def validate(rows, mode, **kwargs):
+    """Validate the rows with the VAT schema, returning (is valid, transactions, errors)."""
+    file_validation = FileValidationService(rows, mode=mode, parallel=False, **kwargs)
+    is_valid = file_validation.validate(get_import_schema('vat'))
+    return is_valid, file_validation.valid_transactions, file_validation.validation_errors
+
+
+def sign(body):
+    """Return the X-Security-Hash of a raw request body."""
+    return hmac.new(API_SECRET_KEY.encode(), body, hashlib.sha256).hexdigest()
+
+
+def sign_legacy(data):
+    """Return the data with its security_hash, as older clients send it."""
+    security_hash = hmac.new(
+        API_SECRET_KEY.encode(), json.dumps(data, sort_keys=True).encode(),
+        hashlib.sha256).hexdigest()
+    return {**data, 'security_hash': security_hash}
+
+
+class ApiTestMixin():
+    """
+    Base class of the tests of the API, which reads the exchange rates from the ECB fixture and
+    keeps everything that would be written to disk (snapshots, job payloads, error reports and
+    caches) in a temporary directory.
+    """
+
+    def setUp(self):
+        from api.lib import EXCHANGE_RATES
+
+        self.temporary_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temporary_dir, ignore_errors=True)
+
+        settings_override = override_settings(
+            EXCHANGE_RATE_FIXTURE=EXCHANGE_RATE_FIXTURE,
+            EXCHANGE_RATE_SNAPSHOT_PATH=os.path.join(self.temporary_dir, 'exchange_rates.json'),
+            IMPORT_JOB_DIR=os.path.join(self.temporary_dir, 'import_jobs'),
+            IMPORT_ERROR_REPORT_DIR=os.path.join(self.temporary_dir, 'error_reports'),
+            CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'query_results': {
+                    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                    'LOCATION': 'query_results'}
+            })
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        environment = mock.patch.dict(os.environ, {'API_SECRET_KEY': API_SECRET_KEY})
+        environment.start()
+        self.addCleanup(environment.stop)
+
+        # The query cache holds on to the cache it was created with
+        query_cache = mock.patch('api.lib.QUERY_CACHE', get_query_cache())
+        query_cache.start()
+        self.addCleanup(query_cache.stop)
+
+        # Every test reads the same (fixture) exchange rates
+        EXCHANGE_RATES._rates = None
+        EXCHANGE_RATES._history = None
+
+    def post_json(self, url, data, **extra):
+        body = json.dumps(data).encode()
+        return self.client.post(
+            url, body, content_type='application/json', HTTP_X_SECURITY_HASH=sign(body), **extra)
+
+    def get_json(self, url, data, **extra):
+        body = json.dumps(data).encode()
+        return self.client.generic(
+            'GET', url, body, content_type='application/json', HTTP_X_SECURITY_HASH=sign(body),
+            **extra)
+
+    def import_rows(self, rows, **parameters):
+        data = {
+            'api_partner_id': 'partner', 'ignore_errors': False, 'ignore_first_row': False,
+            'transaction_data': rows, **parameters}
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.post_json('/api/v1/transactions/import', data)
+
+    def stream_rows(self, body, query_string, content_type='text/csv', security_hash=None):
+        if security_hash is None:
+            security_hash = hmac.new(
+                API_SECRET_KEY.encode(), query_string.encode() + b'\n' + body,
+                hashlib.sha256).hexdigest()
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                f'/api/v1/transactions/import/stream?{query_string}', body,
+                content_type=content_type, HTTP_X_SECURITY_HASH=security_hash)
+
+
+class ApiTestCase(ApiTestMixin, TestCase):
+    pass
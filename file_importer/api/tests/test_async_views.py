@@ -0,0 +1,124 @@
+import itertools
+import json
+import threading
+import types
+
+from django.test import TransactionTestCase, override_settings
+from django.urls import path
+
+from api import async_views
+from api.asgi import StreamingASGIHandler
+from api.lib.thread_pool import iterate_in_thread_pool, run_sync
+from api.tests.base import VALID_ROWS, ApiTestMixin, sign
+
+
+class AsyncViewTests(ApiTestMixin, TransactionTestCase):
+    """
+    The async views, as used when running under ASGI (see ASYNC_VIEWS). Their database queries are
+    run by other threads, which can't see the changes of a test that is run in a transaction.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.post_json('/api/v1/transactions/import', {
+            'api_partner_id': 'partner', 'ignore_errors': False, 'ignore_first_row': False,
+            'transaction_data': VALID_ROWS})
+
+        urlconf = types.ModuleType('async_urls')
+        urlconf.urlpatterns = [
+            path('api/v1/transactions/import', async_views.import_transactions_view),
+            path('api/v1/transactions/import/stream', async_views.import_transactions_stream_view),
+            path('api/v1/transactions/query', async_views.query_transactions_view),
+            path('api/v1/transactions/query/batch', async_views.batch_query_transactions_view),
+            path('api/v1/transactions/summary', async_views.summarise_transactions_view),
+        ]
+        settings_override = override_settings(ROOT_URLCONF=urlconf)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    async def request_async(self, method, path, body, query_string='',
+                            content_type='application/json', security_hash=None):
+        """Send a request to the app's ASGI handler, returning its status, body and messages."""
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'root_path': '',
+            'query_string': query_string.encode(), 'client': ('127.0.0.1', 1234),
+            'server': ('testserver', 80), 'headers': [
+                (b'content-type', content_type.encode()),
+                (b'x-security-hash', (security_hash or sign(body)).encode())]}
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        await StreamingASGIHandler()(scope, receive, send)
+        return (
+            messages[0]['status'], b''.join(message.get('body', b'') for message in messages[1:]),
+            messages)
+
+    async def get_async(self, url, data):
+        return await self.request_async('GET', url, json.dumps(data).encode())
+
+    async def test_batch_query_is_streamed(self):
+        status, body, messages = await self.get_async('/api/v1/transactions/query/batch', {
+            'api_partner_id': 'partner', 'country_codes': ['US', 'ZA'],
+            'start_date': '2021/12/06', 'end_date': '2021/12/07'})
+
+        self.assertEqual(status, 200)
+        self.assertGreater(len(messages), 3)
+        countries = json.loads(body)['countries']
+        self.assertEqual(
+            {day: len(transactions) for day, transactions in countries['US'].items()},
+            {'2021-12-06': 2})
+
+    async def test_streamed_query(self):
+        status, body, _ = await self.get_async('/api/v1/transactions/query', {
+            'api_partner_id': 'partner', 'country_code': 'US', 'query_date': '2021/12/06',
+            'response_format': 'ndjson'})
+
+        self.assertEqual(status, 200)
+        self.assertEqual(len(body.splitlines()), 2)
+
+    async def test_summary(self):
+        status, body, _ = await self.get_async('/api/v1/transactions/summary', {
+            'api_partner_id': 'partner', 'country_code': 'US', 'query_date': '2021/12/06'})
+
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['total']['transaction_count'], 2)
+
+    async def test_streamed_import(self):
+        query_string = 'api_partner_id=partner'
+        rows = ''.join(','.join(row) + '\n' for row in VALID_ROWS).encode()
+        status, body, _ = await self.request_async(
+            'POST', '/api/v1/transactions/import/stream', rows, query_string, 'text/csv',
+            sign(query_string.encode() + b'\n' + rows))
+
+        self.assertEqual(status, 200)
+        self.assertTrue(json.loads(body)['success'])
+
+    async def test_streamed_import_requires_a_valid_hash(self):
+        status, _, _ = await self.request_async(
+            'POST', '/api/v1/transactions/import/stream', b'a\n', 'api_partner_id=partner',
+            'text/csv', sign(b'a\n'))
+
+        self.assertEqual(status, 403)
+
+    async def test_stopped_stream_is_closed(self):
+        closed = threading.Event()
+
+        def numbers():
+            try:
+                yield from itertools.count()
+            finally:
+                closed.set()
+
+        items = iterate_in_thread_pool(numbers())
+        async for number in items:
+            if number == 3:
+                break
+        await items.aclose()
+
+        self.assertTrue(await run_sync(closed.wait)(5))
@@ -0,0 +1,65 @@
+import json
+
+from api.models import Transaction
+from api.tests.base import VALID_ROWS, ApiTestCase, sign, sign_legacy
+
+
+class AuthenticationTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data = {
+            'api_partner_id': 'partner', 'ignore_errors': False, 'ignore_first_row': False,
+            'transaction_data': VALID_ROWS}
+
+    def test_header_hash_of_the_body(self):
+        self.assertEqual(self.import_rows(VALID_ROWS).status_code, 200)
+
+        body = json.dumps(self.data).encode()
+        response = self.client.post(
+            '/api/v1/transactions/import', body, content_type='application/json',
+            HTTP_X_SECURITY_HASH=sign(body + b' '))
+        self.assertEqual(response.status_code, 403)
+
+    def test_legacy_hash_in_the_body(self):
+        response = self.client.post(
+            '/api/v1/transactions/import', json.dumps(sign_legacy(self.data)),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        tampered = {**sign_legacy(self.data), 'ignore_errors': True}
+        response = self.client.post(
+            '/api/v1/transactions/import', json.dumps(tampered), content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(Transaction.objects.count(), 4)
+
+    def test_malformed_hashes_are_rejected(self):
+        for security_hash in [12345, None, ['a'], 'é' * 64, '\udc80']:
+            with self.subTest(security_hash=security_hash):
+                response = self.client.post(
+                    '/api/v1/transactions/import',
+                    json.dumps({**self.data, 'security_hash': security_hash}),
+                    content_type='application/json')
+                self.assertEqual(response.status_code, 403)
+
+        body = json.dumps(self.data).encode()
+        response = self.client.post(
+            '/api/v1/transactions/import', body, content_type='application/json',
+            HTTP_X_SECURITY_HASH='é' * 64)
+        self.assertEqual(response.status_code, 403)
+
+        response = self.client.post(
+            '/api/v1/transactions/import', json.dumps(self.data), content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+        response = self.stream_rows(b'a\n', 'api_partner_id=partner', security_hash='é' * 64)
+        self.assertEqual(response.status_code, 403)
+
+    def test_other_endpoints_require_a_valid_hash(self):
+        query = {'api_partner_id': 'partner', 'country_code': 'US', 'query_date': '2021/12/06'}
+        body = json.dumps(query).encode()
+        for url in ['/api/v1/transactions/query', '/api/v1/transactions/summary']:
+            response = self.client.generic(
+                'GET', url, body, content_type='application/json',
+                HTTP_X_SECURITY_HASH=sign(b'other'))
+            self.assertEqual(response.status_code, 403)
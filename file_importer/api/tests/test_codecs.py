@@ -0,0 +1,81 @@
+import datetime
+import gc
+import json
+import math
+import uuid
+
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from django.http import JsonResponse
+
+from api.lib import codecs
+from api.lib.codecs import JSON, MSGPACK, JSONCodec
+from api.lib.garbage_collection import gc_paused
+from api.tests.base import VALID_ROWS, ApiTestCase, sign
+
+
+class CodecTests(ApiTestCase):
+
+    def test_json_encoding_matches_django(self):
+        data = {
+            'amount': Decimal('1.10'), 'date': datetime.date(2021, 12, 6), 'list': [1, 'a', None],
+            'created_at': datetime.datetime(
+                2021, 12, 6, 10, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+            'time': datetime.time(10, 30, 15, 123456)}
+        expected = json.loads(JsonResponse(data).content)
+        self.assertEqual(expected['created_at'], '2021-12-06T10:30:15.123Z')
+        self.assertEqual(json.loads(JSON.encode(data)), expected)
+        self.assertEqual(json.loads(JSONCodec(use_orjson=False).encode(data)), expected)
+
+    def test_json_decoding_falls_back_to_the_standard_library(self):
+        # orjson rejects NaN, which the standard library reads
+        self.assertTrue(math.isnan(JSON.decode(b'[NaN]')[0]))
+
+    def test_decoding_leaves_the_garbage_collector_paused_by_another_thread(self):
+        with gc_paused():
+            JSON.decode(b'[1]')
+            self.assertFalse(gc.isenabled())
+        self.assertTrue(gc.isenabled())
+
+    @skipUnless(MSGPACK.is_available(), 'msgpack is not installed')
+    def test_msgpack_requests_and_responses(self):
+        import msgpack
+
+        body = msgpack.packb({
+            'api_partner_id': 'partner', 'ignore_errors': False, 'ignore_first_row': False,
+            'transaction_data': VALID_ROWS})
+        response = self.client.post(
+            '/api/v1/transactions/import', body, content_type='application/msgpack',
+            HTTP_X_SECURITY_HASH=sign(body), HTTP_ACCEPT='application/msgpack')
+
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertTrue(msgpack.unpackb(response.content)['success'])
+        self.assertEqual(MSGPACK.decode(MSGPACK.encode({'amount': Decimal('1.10')})), {
+            'amount': '1.10'})
+
+    @skipUnless(MSGPACK.is_available(), 'msgpack is not installed')
+    def test_errors_are_encoded_as_accepted(self):
+        import msgpack
+
+        response = self.client.post(
+            '/api/v1/transactions/import/stream?api_partner_id=partner', b'a\n',
+            content_type='text/csv', HTTP_X_SECURITY_HASH='0' * 64,
+            HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(msgpack.unpackb(response.content), {'error': 'Invalid security hash'})
+
+        body = json.dumps({'api_partner_id': 'partner'}).encode()
+        response = self.client.generic(
+            'GET', f'/api/v1/transactions/import/{uuid.uuid4()}', body,
+            content_type='application/json', HTTP_X_SECURITY_HASH=sign(body),
+            HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+
+    def test_unavailable_codec(self):
+        with mock.patch.object(codecs, 'msgpack', None):
+            response = self.client.post(
+                '/api/v1/transactions/import', b'\x80', content_type='application/msgpack',
+                HTTP_X_SECURITY_HASH=sign(b'\x80'))
+        self.assertEqual(response.status_code, 415)
@@ -0,0 +1,28 @@
+import datetime
+
+from decimal import Decimal
+
+from api.lib.file_import_fields import TRX_TYPE_SALE
+from api.lib.transaction_conversion_service import TransactionConversionService
+from api.models import Transaction
+from api.tests.base import VALID_ROWS, ApiTestCase
+
+
+class ConversionTests(ApiTestCase):
+
+    def test_only_the_imported_transactions_are_converted(self):
+        unconverted = Transaction.objects.create(
+            created_at=datetime.datetime(2021, 12, 6, tzinfo=datetime.timezone.utc),
+            transaction_type=TRX_TYPE_SALE, country='United States', country_code='US',
+            currency='USD', net=Decimal('10.00'), vat=Decimal('1.50'))
+        self.import_rows(VALID_ROWS)
+
+        self.assertEqual(
+            list(Transaction.objects.get_unconverted_transactions()), [unconverted])
+
+        from api.lib import EXCHANGE_RATES
+        TransactionConversionService.convert_to_EUR()
+        unconverted.refresh_from_db()
+        rate = EXCHANGE_RATES.history.get_rate('USD', datetime.date(2021, 12, 6))
+        self.assertEqual(unconverted.net_euro, round(Decimal('10.00') / rate, 2))
+        self.assertEqual(unconverted.vat_euro, round(Decimal('1.50') / rate, 2))
@@ -0,0 +1,39 @@
+import gzip
+
+from api.models import Transaction
+from api.tests.base import INVALID_ROWS, VALID_ROWS, ApiTestCase
+
+
+class ErrorReportTests(ApiTestCase):
+
+    def test_summarised_errors_and_report_download(self):
+        response = self.import_rows(INVALID_ROWS, error_report='summary')
+        summary = response.json()['error_summary']
+
+        self.assertNotIn('errors', response.json())
+        self.assertEqual(summary['error_count'], 6)
+        self.assertEqual(
+            {(group['column'], group['code'], group['count']) for group in summary['groups']}, {
+                (0, 'invalid_date', 2), (1, 'invalid_transaction_type', 1),
+                (3, 'invalid_currency', 1), (4, 'invalid_amount', 1), (5, 'invalid_amount', 1)})
+
+        url = f'/api/v1/transactions/import/errors/{summary["report_id"]}'
+        response = self.get_json(url, {'api_partner_id': 'partner'})
+        self.assertEqual(response.status_code, 200)
+        report = gzip.decompress(b''.join(response.streaming_content)).splitlines()
+        self.assertEqual(len(report), 6)
+
+        response = self.get_json(url, {'api_partner_id': 'another_partner'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_max_errors_fails_the_import(self):
+        response = self.import_rows(INVALID_ROWS, ignore_errors=True, max_errors=2)
+
+        self.assertFalse(response.json()['success'])
+        self.assertEqual(len(response.json()['errors']), 2)
+        self.assertEqual(Transaction.objects.count(), 0)
+
+    def test_invalid_error_report_parameters(self):
+        response = self.import_rows(VALID_ROWS, error_report='all', max_errors=0)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.json()['errors']), 2)
@@ -0,0 +1,84 @@
+import datetime
+import os
+
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
+
+from api.lib.exchange_rate_client import ExchangeRateClient
+from api.lib.exchange_rate_history import ExchangeRateHistory
+from api.lib.exchange_rate_store import ExchangeRateStore
+from api.models import Transaction
+from api.tests.base import ApiTestCase
+
+
+class ExchangeRateStoreTests(ApiTestCase):
+
+    def test_rates_are_loaded_when_first_used_and_saved_as_a_snapshot(self):
+        client = mock.Mock(wraps=ExchangeRateClient)
+        exchange_rates = ExchangeRateStore(client)
+        client.get_exchange_rate_history.assert_not_called()
+
+        self.assertIn('USD', exchange_rates)
+        self.assertEqual(exchange_rates['USD']['name'], 'US dollar')
+        client.get_exchange_rate_history.assert_called_once()
+        self.assertTrue(os.path.exists(settings.EXCHANGE_RATE_SNAPSHOT_PATH))
+
+        # A newly started process reads the snapshot instead of fetching the rates again
+        new_client = mock.Mock(wraps=ExchangeRateClient)
+        self.assertEqual(ExchangeRateStore(new_client)['USD'], exchange_rates['USD'])
+        new_client.get_exchange_rate_history.assert_not_called()
+
+
+class ExchangeRateHistoryTests(ApiTestCase):
+
+    def test_rate_of_the_nearest_previous_business_day(self):
+        history = ExchangeRateHistory({'USD': {
+            'name': 'US dollar', 'dates': ['2021-12-03', '2021-12-06'], 'values': [1.13, 1.12]}})
+
+        self.assertIsNone(history.get_rate('USD', datetime.date(2021, 12, 2)))
+        self.assertEqual(history.get_rate('USD', datetime.date(2021, 12, 5)), Decimal('1.13'))
+        self.assertEqual(history.get_rate('USD', datetime.date(2021, 12, 7)), Decimal('1.12'))
+        self.assertEqual(
+            history.get_rate_periods(
+                'USD', datetime.date(2021, 12, 4), datetime.date(2021, 12, 8)),
+            [(datetime.date(2021, 12, 3), datetime.date(2021, 12, 6), Decimal('1.13')),
+             (datetime.date(2021, 12, 6), None, Decimal('1.12'))])
+
+    def test_transactions_are_converted_at_the_rate_of_their_day(self):
+        self.import_rows([
+            ['2021/12/04', 'Sale', 'United Kingdom', 'GBP', '10.00', '2.00'],
+            ['2021/12/07', 'Sale', 'United Kingdom', 'GBP', '10.00', '2.00']])
+
+        # The 4th is a Saturday, so the rate published on the Friday applies
+        from api.lib import EXCHANGE_RATES
+        for day, rate_day in [(4, 3), (7, 7)]:
+            rate = EXCHANGE_RATES.history.get_rate('GBP', datetime.date(2021, 12, rate_day))
+            transaction = Transaction.objects.get(created_at__day=day)
+            self.assertEqual(transaction.net_euro, round(Decimal('10.00') / rate, 2))
+
+    def test_exchange_rates_before_the_history_are_fetched(self):
+        # The rates are loaded (from the fixture) before the earlier ones are fetched
+        from api.lib import EXCHANGE_RATES
+        EXCHANGE_RATES.history
+
+        earlier_history = {'GBP': {
+            'name': 'UK pound sterling', 'dates': ['2021-01-04'], 'values': [0.9]}}
+        with mock.patch.object(
+                EXCHANGE_RATES.client, 'get_exchange_rate_history',
+                return_value=earlier_history) as get_exchange_rate_history:
+            self.import_rows([['2021/01/05', 'Sale', 'United Kingdom', 'GBP', '10.00', '2.00']])
+            self.import_rows([['2021/01/06', 'Sale', 'United Kingdom', 'GBP', '10.00', '2.00']])
+
+        # The earlier exchange rates are kept until the rates are next refreshed
+        get_exchange_rate_history.assert_called_once_with(datetime.date(2021, 1, 5))
+        self.assertEqual(
+            list(Transaction.objects.values_list('net_euro', flat=True)),
+            [Decimal('11.11'), Decimal('11.11')])
+
+    def test_transactions_without_an_exchange_rate_are_left_unconverted(self):
+        with self.assertLogs('api.lib.transaction_conversion_service', 'WARNING'):
+            self.import_rows([['2021/01/05', 'Sale', 'United Kingdom', 'GBP', '10.00', '2.00']])
+
+        self.assertIsNone(Transaction.objects.get().net_euro)
@@ -0,0 +1,142 @@
+import datetime
+import hashlib
+
+from unittest import mock
+
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api.lib.file_import_fields import TRX_TYPE_SALE
+from api.models import DailyTransactionSummary, ImportRequest, Transaction
+from api.tests.base import INVALID_ROWS, VALID_ROWS, ApiTestCase
+
+
+class IdempotencyTests(ApiTestCase):
+
+    def test_retried_import_returns_the_original_response(self):
+        data = {
+            'api_partner_id': 'partner', 'ignore_errors': False, 'ignore_first_row': False,
+            'transaction_data': VALID_ROWS}
+        first = self.post_json('/api/v1/transactions/import', data, HTTP_IDEMPOTENCY_KEY='abc')
+        retry = self.post_json('/api/v1/transactions/import', data, HTTP_IDEMPOTENCY_KEY='abc')
+
+        self.assertEqual(first.json(), retry.json())
+        self.assertEqual(Transaction.objects.count(), 4)
+
+        # Without a key, the same body is the same request
+        self.import_rows(VALID_ROWS[:1])
+        self.import_rows(VALID_ROWS[:1])
+        self.assertEqual(Transaction.objects.count(), 5)
+
+    def test_import_in_progress(self):
+        data = {
+            'api_partner_id': 'partner', 'ignore_errors': False, 'ignore_first_row': False,
+            'transaction_data': VALID_ROWS}
+        ImportRequest.objects.claim(
+            'partner', hashlib.sha256(b'key:abc').hexdigest())
+
+        response = self.post_json('/api/v1/transactions/import', data, HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Transaction.objects.count(), 0)
+
+    def test_unsuccessful_import_can_be_retried(self):
+        self.import_rows(INVALID_ROWS)
+        self.assertFalse(ImportRequest.objects.exists())
+
+        response = self.import_rows(INVALID_ROWS)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()['success'])
+
+    def test_claims_expire(self):
+        _, claimed = ImportRequest.objects.claim('partner', 'key')
+        self.assertTrue(claimed)
+        self.assertFalse(ImportRequest.objects.claim('partner', 'key')[1])
+        self.assertTrue(ImportRequest.objects.claim('another_partner', 'key')[1])
+
+        ImportRequest.objects.update(
+            created_at=datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc))
+        self.assertTrue(ImportRequest.objects.claim('partner', 'key')[1])
+
+    def test_abandoned_claims_can_be_claimed_again(self):
+        ImportRequest.objects.claim('partner', 'key')
+        ImportRequest.objects.update(heartbeat_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertTrue(ImportRequest.objects.claim('partner', 'key')[1])
+
+        # Finished imports are remembered for IMPORT_IDEMPOTENCY_TTL seconds
+        ImportRequest.objects.update(
+            status_code=200, created_at=timezone.now() - datetime.timedelta(hours=1),
+            heartbeat_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertFalse(ImportRequest.objects.claim('partner', 'key')[1])
+
+    def test_claims_with_a_heartbeat_are_kept(self):
+        import_request, _ = ImportRequest.objects.claim('partner', 'key')
+        ImportRequest.objects.update(created_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertTrue(ImportRequest.objects.keep_claim(import_request))
+
+        self.assertFalse(ImportRequest.objects.claim('partner', 'key')[1])
+
+    def test_reclaimed_import_saves_nothing(self):
+        key = hashlib.sha256(b'key:abc').hexdigest()
+
+        def reclaim():
+            # The import is abandoned and claimed again while it is being validated
+            ImportRequest.objects.update(
+                heartbeat_at=timezone.now() - datetime.timedelta(hours=1))
+            ImportRequest.objects.claim('partner', key)
+            return True
+
+        data = {
+            'api_partner_id': 'partner', 'ignore_errors': False, 'ignore_first_row': False,
+            'transaction_data': VALID_ROWS}
+        with mock.patch(
+                'api.views.FileImportService.validate_transaction_data', side_effect=reclaim):
+            response = self.post_json(
+                '/api/v1/transactions/import', data, HTTP_IDEMPOTENCY_KEY='abc')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Transaction.objects.count(), 0)
+        self.assertFalse(ImportRequest.objects.get().is_complete)
+
+class DuplicateRowTests(ApiTestCase):
+
+    def test_duplicate_rows_can_be_skipped(self):
+        with override_settings(IMPORT_SKIP_DUPLICATE_ROWS=True):
+            self.import_rows(VALID_ROWS)
+            response = self.import_rows(VALID_ROWS + VALID_ROWS[:1] + [
+                ['2021/12/08', 'Sale', 'United States', 'USD', '1.00', '0.10']])
+
+        self.assertEqual(
+            response.json()['message'], '1 / 6 row(s) were successfully imported')
+        self.assertEqual(Transaction.objects.count(), 5)
+        self.assertEqual(DailyTransactionSummary.objects.get(
+            country_code='US', date=datetime.date(2021, 12, 6),
+            transaction_type=TRX_TYPE_SALE).transaction_count, 1)
+
+    def test_duplicates_imported_at_the_same_time_are_not_counted(self):
+        with override_settings(IMPORT_SKIP_DUPLICATE_ROWS=True):
+            self.import_rows(VALID_ROWS)
+            # Another import inserts the same rows after they were looked for
+            with mock.patch('api.lib.file_import_service._get_by_fingerprints', return_value=[]):
+                response = self.import_rows(VALID_ROWS + [
+                    ['2021/12/08', 'Sale', 'United States', 'USD', '1.00', '0.10']])
+
+        self.assertEqual(
+            response.json()['message'], '1 / 5 row(s) were successfully imported')
+        self.assertEqual(DailyTransactionSummary.objects.get(
+            country_code='US', date=datetime.date(2021, 12, 8)).transaction_count, 1)
+        self.assertIsNotNone(
+            Transaction.objects.get(created_at__date=datetime.date(2021, 12, 8)).net_euro)
+
+    def test_duplicate_rows_are_inserted_in_batches_the_database_allows(self):
+        with override_settings(IMPORT_SKIP_DUPLICATE_ROWS=True), mock.patch.object(
+                connection.ops, 'bulk_batch_size', return_value=3), CaptureQueriesContext(
+                    connection) as queries:
+            response = self.import_rows(VALID_ROWS)
+
+        self.assertEqual(
+            response.json()['message'], '4 / 4 row(s) were successfully imported')
+        self.assertEqual(len([
+            query for query in queries
+            if query['sql'].startswith('INSERT INTO api_transaction')]), 2)
@@ -0,0 +1,112 @@
+import datetime
+import os
+
+from unittest import mock
+
+from django.db import OperationalError
+from django.test import override_settings
+from django.utils import timezone
+
+from api.lib.file_import_service import FileImportService
+from api.lib.import_job_service import ImportJobService
+from api.management.commands.process_import_jobs import run_worker
+from api.models import ImportJob, Transaction
+from api.tests.base import INVALID_ROWS, VALID_ROWS, ApiTestCase
+
+
+class ImportJobTests(ApiTestCase):
+
+    def test_import_job(self):
+        response = self.import_rows(VALID_ROWS, run_as_job=True)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], ImportJob.STATUS_PENDING)
+
+        job = ImportJob.objects.claim_next_job()
+        self.assertEqual(job.status, ImportJob.STATUS_RUNNING)
+        self.assertIsNone(ImportJob.objects.claim_next_job())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ImportJobService.run_job(job)
+
+        response = self.get_json(
+            f'/api/v1/transactions/import/{job.job_id}', {'api_partner_id': 'partner'})
+        self.assertEqual(response.json()['status'], ImportJob.STATUS_COMPLETED)
+        self.assertEqual(response.json()['rows_inserted'], 4)
+        self.assertTrue(response.json()['success'])
+        self.assertEqual(Transaction.objects.count(), 4)
+        self.assertFalse(os.path.exists(job.payload_path))
+
+        response = self.get_json(
+            f'/api/v1/transactions/import/{job.job_id}', {'api_partner_id': 'another_partner'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_job_saves_nothing(self):
+        self.import_rows(INVALID_ROWS, run_as_job=True)
+        job = ImportJob.objects.claim_next_job()
+
+        with mock.patch.object(FileImportService, 'save_transactions') as save_transactions:
+            ImportJobService.run_job(job)
+
+        save_transactions.assert_not_called()
+        job.refresh_from_db()
+        self.assertEqual(
+            (job.status, job.success, job.rows_validated, job.error_count),
+            (ImportJob.STATUS_COMPLETED, False, 6, 6))
+
+    def test_only_jobs_without_a_heartbeat_are_claimed_again(self):
+        self.import_rows(VALID_ROWS, run_as_job=True)
+        job = ImportJob.objects.claim_next_job()
+
+        # A long import is still running as long as its heartbeat is
+        ImportJob.objects.update(started_at=timezone.now() - datetime.timedelta(days=1))
+        self.assertIsNone(ImportJob.objects.claim_next_job())
+
+        ImportJob.objects.update(heartbeat_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(ImportJob.objects.claim_next_job().id, job.id)
+
+    def test_abandoned_jobs_are_resumed(self):
+        self.import_rows(VALID_ROWS, run_as_job=True)
+        job = ImportJob.objects.claim_next_job()
+
+        # The worker is killed after saving the first window of rows
+        save_transactions = FileImportService.save_transactions
+        saved_windows = []
+
+        def save_one_window(file_import_service, *args, **kwargs):
+            if saved_windows:
+                raise KeyboardInterrupt()
+            saved_windows.append(file_import_service)
+            return save_transactions(file_import_service, *args, **kwargs)
+
+        with override_settings(IMPORT_STREAM_WINDOW_SIZE=2), mock.patch.object(
+                FileImportService, 'save_transactions', save_one_window), \
+                self.assertRaises(KeyboardInterrupt):
+            ImportJobService.run_job(job)
+        self.assertEqual(Transaction.objects.count(), 2)
+
+        with override_settings(IMPORT_JOB_TIMEOUT=0):
+            reclaimed_job = ImportJob.objects.claim_next_job()
+        self.assertEqual((reclaimed_job.id, reclaimed_job.rows_saved), (job.id, 2))
+
+        # The original worker can no longer save anything of the job
+        with self.assertLogs('api.lib.import_job_service', 'WARNING'):
+            ImportJobService.run_job(job)
+
+        with override_settings(IMPORT_STREAM_WINDOW_SIZE=2), \
+                self.captureOnCommitCallbacks(execute=True):
+            ImportJobService.run_job(reclaimed_job)
+
+        reclaimed_job.refresh_from_db()
+        self.assertEqual(reclaimed_job.status, ImportJob.STATUS_COMPLETED)
+        self.assertEqual(reclaimed_job.message, '4 / 4 row(s) were successfully imported')
+        self.assertEqual(Transaction.objects.count(), 4)
+        self.assertEqual(Transaction.objects.filter(net_euro__isnull=True).count(), 0)
+
+    def test_worker_waits_for_a_locked_database(self):
+        with mock.patch('django.setup'), mock.patch('time.sleep') as sleep, mock.patch.object(
+                ImportJob.objects, 'claim_next_job',
+                side_effect=[OperationalError('database is locked')] * 2 + [None]), \
+                self.assertLogs('api.management.commands.process_import_jobs', 'WARNING'):
+            run_worker(poll_interval=0, run_once=True)
+
+        self.assertEqual(sleep.call_args_list, [mock.call(1), mock.call(2)])
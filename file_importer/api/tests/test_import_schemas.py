@@ -0,0 +1,79 @@
+from decimal import Decimal
+
+from api.lib.file_import_fields import FIELD_COUNTRY, FIELD_CURRENCY, FIELD_DATE, FIELD_MONEY, \
+    FIELD_TRX_TYPE, TRX_TYPE_PURCHASE, TRX_TYPE_SALE
+from api.lib.file_validation_service import FileValidationService
+from api.lib.import_schemas import ROW_VALIDATION_ERRORS, ImportSchema, get_import_schema, \
+    get_row_errors
+from api.lib.validators import VALIDATORS
+from api.tests.base import INVALID_ROWS, VALID_ROWS, ApiTestCase
+
+
+class ImportSchemaTests(ApiTestCase):
+
+    def test_compiled_row_validator_matches_the_validators(self):
+        schema = get_import_schema('vat')
+        for row in VALID_ROWS:
+            created_at, transaction_type, country, currency, net, vat = (
+                VALIDATORS[field_type](value)
+                for field_type, value in zip(schema.field_structure, row))
+            if transaction_type == TRX_TYPE_PURCHASE:
+                net, vat = -net, -vat
+            self.assertEqual(
+                schema.row_validator(row),
+                (created_at, transaction_type, country, currency, net, vat))
+
+    def test_compiled_row_validator_rejects_invalid_rows(self):
+        schema = get_import_schema('vat')
+        for row in INVALID_ROWS[1:4] + [INVALID_ROWS[0][:5]]:
+            with self.subTest(row=row), self.assertRaises(ROW_VALIDATION_ERRORS):
+                schema.row_validator(row)
+
+    def test_row_errors_describe_every_problem(self):
+        schema = get_import_schema('vat')
+        self.assertEqual(
+            [(column, code) for column, _, _, code in get_row_errors(schema, INVALID_ROWS[5])],
+            [(0, 'invalid_date'), (5, 'invalid_amount')])
+        self.assertEqual(
+            [(column, code) for column, _, _, code in get_row_errors(schema, VALID_ROWS[0][:5])],
+            [(None, 'wrong_value_count')])
+
+    def test_schema_must_import_every_transaction_column_once(self):
+        with self.assertRaises(ValueError):
+            ImportSchema('missing_vat', [
+                ('created_at', FIELD_DATE), ('transaction_type', FIELD_TRX_TYPE),
+                ('country', FIELD_COUNTRY), ('currency', FIELD_CURRENCY), ('net', FIELD_MONEY)])
+        with self.assertRaises(ValueError):
+            ImportSchema('untyped', [
+                ('created_at', FIELD_DATE), ('transaction_type', FIELD_TRX_TYPE),
+                ('country', FIELD_COUNTRY), ('currency', FIELD_CURRENCY), ('net', FIELD_MONEY),
+                ('vat', None)])
+
+    def test_schema_columns_can_be_reordered_and_skipped(self):
+        schema = ImportSchema('reordered', [
+            ('currency', FIELD_CURRENCY), (None, None), ('net', FIELD_MONEY),
+            ('vat', FIELD_MONEY), ('created_at', FIELD_DATE), (None, FIELD_DATE),
+            ('transaction_type', FIELD_TRX_TYPE), ('country', FIELD_COUNTRY)])
+        row = ['USD', 'anything', '1.00', '0.20', '2021/12/06', '2021/12/07', 'Sale', 'US']
+
+        self.assertEqual(
+            schema.row_validator(row)[1:],
+            (TRX_TYPE_SALE, 'US', 'USD', Decimal('1.00'), Decimal('0.20')))
+        with self.assertRaises(ROW_VALIDATION_ERRORS):
+            schema.row_validator(row[:5] + ['bad'] + row[6:])
+
+    def test_pre_validate_hook(self):
+        schema = ImportSchema('combined_amounts', [
+            ('created_at', FIELD_DATE), ('transaction_type', FIELD_TRX_TYPE),
+            ('country', FIELD_COUNTRY), ('currency', FIELD_CURRENCY), ('net', FIELD_MONEY),
+            ('vat', FIELD_MONEY)], pre_validate=lambda row: row[:4] + row[4].split('/'))
+
+        file_validation = FileValidationService([['2021/12/06', 'Sale', 'US', 'USD', '1.00/0.20']])
+        self.assertTrue(file_validation.validate(schema))
+        self.assertEqual(file_validation.valid_transactions[0][4:], (Decimal('1.00'),
+                                                                     Decimal('0.20')))
+
+    def test_unknown_import_schema(self):
+        response = self.import_rows(VALID_ROWS, import_schema='unknown')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'errors': ['Import schema "unknown" does not exist']})
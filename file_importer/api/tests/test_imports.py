@@ -0,0 +1,90 @@
+from decimal import Decimal
+from unittest import mock
+
+from django.db import NotSupportedError, connection
+from django.test import override_settings
+
+from api.lib import FileImportService
+from api.lib.file_import_fields import TRX_TYPE_PURCHASE
+from api.models import Transaction
+from api.tests.base import INVALID_ROWS, VALID_ROWS, ApiTestCase
+
+
+class ImportTests(ApiTestCase):
+
+    def test_import_saves_and_converts_the_transactions(self):
+        response = self.import_rows(VALID_ROWS)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'success': True, 'message': '4 / 4 row(s) were successfully imported', 'errors': []})
+
+        transaction = Transaction.objects.get(currency='ZAR')
+        self.assertEqual(transaction.country_code, 'ZA')
+        self.assertEqual(transaction.net, Decimal('250.00'))
+        self.assertIsNotNone(transaction.net_euro)
+        self.assertEqual(Transaction.objects.filter(net_euro__isnull=True).count(), 0)
+        self.assertEqual(
+            Transaction.objects.get(transaction_type=TRX_TYPE_PURCHASE).net, Decimal('-40.00'))
+
+    def test_invalid_rows_prevent_the_import(self):
+        response = self.import_rows(INVALID_ROWS)
+
+        self.assertFalse(response.json()['success'])
+        self.assertEqual(len(response.json()['errors']), 6)
+        self.assertEqual(Transaction.objects.count(), 0)
+
+    def test_invalid_rows_can_be_ignored(self):
+        response = self.import_rows(INVALID_ROWS, ignore_errors=True)
+
+        self.assertTrue(response.json()['success'])
+        self.assertEqual(Transaction.objects.count(), 2)
+
+    def test_first_row_can_be_ignored(self):
+        self.import_rows([['date', 'type', 'country', 'currency', 'net', 'vat']] + VALID_ROWS,
+                         ignore_first_row=True)
+        self.assertEqual(Transaction.objects.count(), 4)
+
+    def test_import_in_batches(self):
+        with override_settings(IMPORT_BATCH_SIZE=3):
+            response = self.import_rows(VALID_ROWS * 3)
+
+        self.assertEqual(
+            response.json()['message'], '12 / 12 row(s) were successfully imported')
+        self.assertEqual(Transaction.objects.count(), 12)
+        self.assertEqual(Transaction.objects.filter(net_euro__isnull=True).count(), 0)
+
+    def test_bodies_larger_than_the_upload_limit_are_rejected(self):
+        with override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=100):
+            response = self.import_rows(VALID_ROWS)
+
+        self.assertEqual(response.status_code, 413)
+        self.assertIn('/api/v1/transactions/import/stream', response.json()['error'])
+        self.assertEqual(Transaction.objects.count(), 0)
+
+    def test_databases_that_dont_return_inserted_ids_must_be_sqlite(self):
+        for skip_duplicate_rows in [False, True]:
+            file_import_service = FileImportService(VALID_ROWS, False)
+            file_import_service.validate_transaction_data()
+            with override_settings(IMPORT_SKIP_DUPLICATE_ROWS=skip_duplicate_rows), \
+                    mock.patch.object(connection, 'vendor', 'mysql'), \
+                    mock.patch.object(
+                        connection.features, 'can_return_rows_from_bulk_insert', False), \
+                    self.assertRaises(NotSupportedError):
+                file_import_service.save_transactions()
+
+        self.assertEqual(Transaction.objects.count(), 0)
+
+    def test_transactions_by_ids_in_batches_of_ranges(self):
+        self.import_rows([
+            ['2021/12/06', 'Sale', 'United States', 'USD', f'{amount}.00', '1.00']
+            for amount in range(1, 9)])
+        ids = sorted(Transaction.objects.values_list('id', flat=True))
+        some_ids = [ids[0], ids[2], ids[3], ids[4], ids[6]]
+
+        with mock.patch('api.models.MAX_ID_RANGES', 2):
+            batches = Transaction.objects.get_batches_by_ids(some_ids)
+
+        self.assertEqual(len(batches), 2)
+        self.assertEqual(
+            sorted(transaction.id for batch in batches for transaction in batch), some_ids)
@@ -0,0 +1,21 @@
+from django.test import override_settings
+
+from api.tests.base import VALID_ROWS, ApiTestCase
+
+
+class MetricsTests(ApiTestCase):
+
+    def test_metrics_of_each_view(self):
+        self.import_rows(VALID_ROWS)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(
+            response.content.decode(),
+            r'file_importer_requests_total\{view="import_transactions",status="200"\} \d+')
+
+    def test_server_timing(self):
+        with override_settings(METRICS_SERVER_TIMING=True):
+            response = self.import_rows(VALID_ROWS)
+
+        self.assertRegex(response['Server-Timing'], r'total;dur=[\d.]+;desc="\d+ queries"')
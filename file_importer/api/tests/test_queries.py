@@ -0,0 +1,116 @@
+import csv
+import datetime
+import io
+import json
+
+from unittest import skipUnless
+
+from api.lib.file_import_fields import TRX_TYPE_SALE
+from api.lib.transaction_query_service import QUERY_HEADINGS, decode_cursor, encode_cursor, \
+    is_format_available
+from api.tests.base import ApiTestCase
+
+
+class QueryTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        rows = [
+            ['2021/12/06', 'Sale', 'United States', 'USD', f'{amount}.00', '1.00']
+            for amount in range(1, 8)]
+        self.import_rows(rows + [['2021/12/07', 'Sale', 'United States', 'USD', '9.00', '1.00']])
+        self.query = {
+            'api_partner_id': 'partner', 'country_code': 'US', 'query_date': '2021/12/06'}
+
+    def test_query(self):
+        response = self.get_json('/api/v1/transactions/query', self.query)
+
+        transactions = response.json()['transactions']
+        self.assertEqual(len(transactions), 7)
+        self.assertEqual(transactions[0][:6], [
+            '2021-12-06', 'United States', 'USD', TRX_TYPE_SALE, '1.00', '1.00'])
+
+    def test_pages_cover_every_transaction_once(self):
+        pages = []
+        cursor = None
+        while True:
+            response = self.get_json(
+                '/api/v1/transactions/query', {**self.query, 'page_size': 3, 'cursor': cursor})
+            pages.append(response.json()['transactions'])
+            cursor = response.json()['next_cursor']
+            if cursor is None:
+                break
+
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(
+            [transaction for page in pages for transaction in page],
+            self.get_json('/api/v1/transactions/query', self.query).json()['transactions'])
+
+    def test_cursors(self):
+        created_at = datetime.datetime(2021, 12, 6, tzinfo=datetime.timezone.utc)
+        self.assertEqual(decode_cursor(encode_cursor(created_at, 12)), (created_at, 12))
+
+        response = self.get_json(
+            '/api/v1/transactions/query', {**self.query, 'page_size': 2, 'cursor': 'nonsense'})
+        self.assertEqual(response.status_code, 400)
+        response = self.get_json('/api/v1/transactions/query', {**self.query, 'page_size': 0})
+        self.assertEqual(response.status_code, 400)
+
+    def test_streamed_query(self):
+        response = self.get_json(
+            '/api/v1/transactions/query', {**self.query, 'response_format': 'ndjson'})
+
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(
+            [json.loads(line) for line in lines],
+            self.get_json('/api/v1/transactions/query', self.query).json()['transactions'])
+
+    def test_csv_export(self):
+        response = self.get_json(
+            '/api/v1/transactions/query', {**self.query, 'response_format': 'csv'})
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(
+            response['Content-Disposition'],
+            'attachment; filename="transactions_US_2021-12-06.csv"')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], QUERY_HEADINGS)
+        self.assertEqual(len(rows), 8)
+
+    @skipUnless(is_format_available('parquet'), 'pyarrow is not installed')
+    def test_parquet_export(self):
+        import pyarrow.parquet
+
+        response = self.get_json(
+            '/api/v1/transactions/query', {**self.query, 'response_format': 'parquet'})
+
+        table = pyarrow.parquet.read_table(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(table.column_names, QUERY_HEADINGS)
+        self.assertEqual(table.num_rows, 7)
+
+    def test_cached_query_is_invalidated_by_an_import(self):
+        self.assertEqual(
+            len(self.get_json('/api/v1/transactions/query', self.query).json()['transactions']), 7)
+        self.import_rows([['2021/12/06', 'Sale', 'United States', 'USD', '8.00', '1.00']])
+        self.assertEqual(
+            len(self.get_json('/api/v1/transactions/query', self.query).json()['transactions']), 8)
+
+    def test_invalid_query(self):
+        response = self.get_json(
+            '/api/v1/transactions/query', {**self.query, 'country_code': 'XX'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'errors': ['Country code "XX" is not supported']})
+
+    def test_batch_query(self):
+        self.import_rows([['2021/12/06', 'Sale', 'South Africa', 'ZAR', '1.00', '0.10']])
+        response = self.get_json('/api/v1/transactions/query/batch', {
+            'api_partner_id': 'partner', 'country_codes': ['us', 'ZA', 'GB'],
+            'start_date': '2021/12/06', 'end_date': '2021/12/07'})
+
+        countries = json.loads(b''.join(response.streaming_content))['countries']
+        self.assertEqual(list(countries), ['GB', 'US', 'ZA'])
+        self.assertEqual(countries['GB'], {})
+        self.assertEqual(
+            {day: len(transactions) for day, transactions in countries['US'].items()},
+            {'2021-12-06': 7, '2021-12-07': 1})
@@ -0,0 +1,74 @@
+import json
+
+from unittest import mock
+
+from django.test import override_settings
+
+from api.models import Transaction
+from api.tests.base import INVALID_ROWS, VALID_ROWS, ApiTestCase, sign, validate
+
+
+class StreamingImportTests(ApiTestCase):
+
+    def test_csv_stream(self):
+        body = ''.join(','.join(row) + '\n' for row in VALID_ROWS).encode()
+        response = self.stream_rows(body, 'api_partner_id=partner')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['success'])
+        self.assertEqual(Transaction.objects.count(), 4)
+
+    def test_stream_larger_than_the_spool_size(self):
+        body = ''.join(','.join(row) + '\n' for row in VALID_ROWS).encode()
+        with override_settings(IMPORT_STREAM_SPOOL_SIZE=10):
+            response = self.stream_rows(body, 'api_partner_id=partner')
+
+        self.assertTrue(response.json()['success'])
+        self.assertEqual(Transaction.objects.count(), 4)
+
+    def test_stream_larger_than_the_upload_limit(self):
+        body = ''.join(','.join(row) + '\n' for row in VALID_ROWS).encode()
+        with override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=10):
+            response = self.stream_rows(body, 'api_partner_id=partner')
+
+        self.assertTrue(response.json()['success'])
+        self.assertEqual(Transaction.objects.count(), 4)
+
+    def test_ndjson_stream_in_windows(self):
+        body = b''.join(json.dumps(row).encode() + b'\n' for row in INVALID_ROWS)
+        with override_settings(IMPORT_STREAM_WINDOW_SIZE=2):
+            response = self.stream_rows(
+                body, 'api_partner_id=partner', content_type='application/x-ndjson')
+
+        _, _, errors = validate(INVALID_ROWS, 'rows')
+        self.assertFalse(response.json()['success'])
+        self.assertEqual(response.json()['errors'], errors)
+        self.assertEqual(Transaction.objects.count(), 0)
+
+    def test_stream_requires_a_valid_hash(self):
+        body = ''.join(','.join(row) + '\n' for row in VALID_ROWS).encode()
+        response = self.client.post(
+            '/api/v1/transactions/import/stream?api_partner_id=partner', body,
+            content_type='text/csv')
+        self.assertEqual(response.status_code, 403)
+
+        # Nothing is read or validated until the whole body has been authenticated
+        with mock.patch('api.views.StreamingImportService') as streaming_import_service:
+            response = self.stream_rows(
+                body, 'api_partner_id=partner', security_hash=sign(body))
+        self.assertEqual(response.status_code, 403)
+        streaming_import_service.assert_not_called()
+        self.assertEqual(Transaction.objects.count(), 0)
+
+    def test_unreadable_stream_is_authenticated_first(self):
+        body = b'["2021/12/06", "Sale"]\nnot json\n["2021/12/07", "Sale"]\n'
+        response = self.stream_rows(
+            body, 'api_partner_id=partner', content_type='application/x-ndjson',
+            security_hash='0' * 64)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json(), {'error': 'Invalid security hash'})
+
+        response = self.stream_rows(
+            body, 'api_partner_id=partner', content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Unable to read the transaction data', response.json()['error'])
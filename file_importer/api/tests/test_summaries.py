@@ -0,0 +1,27 @@
+import datetime
+
+from decimal import Decimal
+
+from api.lib.file_import_fields import TRX_TYPE_SALE
+from api.models import DailyTransactionSummary, Transaction
+from api.tests.base import VALID_ROWS, ApiTestCase
+
+
+class DailySummaryTests(ApiTestCase):
+
+    def test_daily_summaries_match_the_transactions(self):
+        self.import_rows(VALID_ROWS)
+        self.import_rows(VALID_ROWS[:1])
+
+        summary = DailyTransactionSummary.objects.get(
+            country_code='US', date=datetime.date(2021, 12, 6), transaction_type=TRX_TYPE_SALE)
+        self.assertEqual(summary.transaction_count, 2)
+        self.assertEqual(summary.converted_count, 2)
+        self.assertEqual(summary.net, Decimal('200.00'))
+        self.assertEqual(summary.net_euro, sum(
+            transaction.net_euro for transaction in Transaction.objects.filter(
+                currency='USD', transaction_type=TRX_TYPE_SALE)))
+
+        response = self.get_json('/api/v1/transactions/summary', {
+            'api_partner_id': 'partner', 'country_code': 'us', 'query_date': '2021/12/06'})
+        self.assertEqual(response.json()['total']['transaction_count'], 3)
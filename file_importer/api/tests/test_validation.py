@@ -0,0 +1,168 @@
+import datetime
+import gc
+import gzip
+import json
+import tempfile
+
+from decimal import Decimal
+from unittest import mock
+
+from django.test import override_settings
+
+from api.lib.file_import_fields import FIELD_CURRENCY, FIELD_DATE, FIELD_MONEY, FIELD_TRX_TYPE
+from api.lib.file_validation_service import FileValidationService
+from api.lib.garbage_collection import gc_paused
+from api.lib.import_schemas import get_import_schema
+from api.lib.validation_errors import ValidationErrorList, ValidationErrorSummary
+from api.lib.validators import VALIDATORS, ValidationError, validate_column, validate_date
+from api.tests.base import INVALID_ROWS, VALID_ROWS, ApiTestCase, validate
+
+
+class ValidatorTests(ApiTestCase):
+
+    def test_errors_have_a_code(self):
+        cases = [
+            (FIELD_DATE, '2021/13/01', 'invalid_date'),
+            (FIELD_TRX_TYPE, 'Sael', 'invalid_transaction_type'),
+            (FIELD_CURRENCY, 'XXX', 'invalid_currency'),
+            (FIELD_MONEY, 'abc', 'invalid_amount'),
+        ]
+        for field_type, value, code in cases:
+            with self.subTest(field_type=field_type), self.assertRaises(ValidationError) as error:
+                VALIDATORS[field_type](value)
+            self.assertEqual(error.exception.code, code)
+            self.assertIn(value, str(error.exception))
+
+    def test_validate_column_matches_validating_each_value(self):
+        values = ['2021/12/06', 'bad', '2021/12/06', '2021/02/30', '2021/12/07', 'bad']
+        clean_values, errors = validate_column(FIELD_DATE, values)
+
+        for index, value in enumerate(values):
+            try:
+                expected = VALIDATORS[FIELD_DATE](value)
+            except ValidationError as e:
+                self.assertIsNone(clean_values[index])
+                self.assertIn((index, str(e), e.code), errors)
+            else:
+                self.assertEqual(clean_values[index], expected)
+        self.assertEqual([index for index, _, _ in errors], [1, 3, 5])
+
+    def test_dates_are_parsed_like_strptime(self):
+        values = [
+            '2021/12/06', '2021/1/6', '2021/12/ 6', '2020/02/29', '2021/02/29', '2021/12/6 ',
+            '21/12/06', '2021-12-06', '2021/00/10', '2021/12/32']
+        for value in values:
+            with self.subTest(value=value):
+                try:
+                    expected = datetime.datetime.strptime(value, '%Y/%m/%d')
+                except ValueError:
+                    with self.assertRaises(ValidationError):
+                        validate_date(value)
+                else:
+                    self.assertEqual(validate_date(value), expected)
+
+
+class FileValidationServiceTests(ApiTestCase):
+
+    def test_rows_and_columns_modes_give_the_same_results(self):
+        rows = (VALID_ROWS + INVALID_ROWS) * 3
+        rows_result = validate(rows, 'rows')
+        columns_result = validate(rows, 'columns')
+
+        self.assertFalse(rows_result[0])
+        self.assertEqual(rows_result, columns_result)
+        self.assertEqual(len(rows_result[1]), 6 * 3)
+        self.assertEqual(
+            [row_number for row_number, _, _ in rows_result[2]][:6], [5, 6, 6, 7, 9, 9])
+
+    def test_purchases_are_negated(self):
+        for mode in ['rows', 'columns']:
+            _, valid_transactions, _ = validate(VALID_ROWS, mode)
+            self.assertEqual(valid_transactions[1][4:], (Decimal('-40.00'), Decimal('-6.00')))
+
+    def test_row_offset(self):
+        for mode in ['rows', 'columns']:
+            file_validation = FileValidationService(
+                INVALID_ROWS, mode=mode, row_offset=100, parallel=False)
+            file_validation.validate(get_import_schema('vat'))
+            self.assertEqual(file_validation.validation_errors[0][0], 101)
+
+    def test_rows_with_missing_values_are_validated_row_by_row(self):
+        rows = VALID_ROWS + [VALID_ROWS[0][:4]]
+        result = validate(rows, 'columns')
+        self.assertEqual(result, validate(rows, 'rows'))
+        self.assertEqual(len(result[2]), 1)
+
+    def test_garbage_collector_is_resumed_once_every_validation_has_finished(self):
+        # Validations in other threads overlap, so the first to finish mustn't resume it
+        self.assertTrue(gc.isenabled())
+        with gc_paused():
+            with gc_paused():
+                self.assertFalse(gc.isenabled())
+            self.assertFalse(gc.isenabled())
+        self.assertTrue(gc.isenabled())
+
+        gc.disable()
+        self.addCleanup(gc.enable)
+        with gc_paused():
+            pass
+        self.assertFalse(gc.isenabled())
+
+    def test_parallel_validation_gives_the_same_results(self):
+        rows = (VALID_ROWS + INVALID_ROWS) * 3
+        for mode in ['rows', 'columns']:
+            with self.subTest(mode=mode), override_settings(
+                    PARALLEL_VALIDATION_THRESHOLD=10, PARALLEL_VALIDATION_WORKERS=2):
+                file_validation = FileValidationService(rows, mode=mode)
+                is_valid = file_validation.validate(get_import_schema('vat'))
+
+            self.assertEqual(
+                (is_valid, file_validation.valid_transactions,
+                 file_validation.validation_errors),
+                validate(rows, mode))
+
+    def test_max_errors_stops_at_the_same_error_in_both_modes(self):
+        rows = (VALID_ROWS + INVALID_ROWS) * 3
+        _, _, all_errors = validate(rows, 'rows')
+        for mode in ['rows', 'columns']:
+            for max_errors in [1, 3, 4]:
+                with self.subTest(mode=mode, max_errors=max_errors):
+                    _, _, errors = validate(
+                        rows, mode, validation_errors=ValidationErrorList(max_errors))
+                    self.assertTrue(errors.is_full)
+                    self.assertEqual(errors, all_errors[:max_errors])
+
+    def test_max_errors_stops_validating_columns(self):
+        # Every date is invalid, as is the currency of the first row - which comes before the
+        # errors of all but the first date
+        rows = [['2021/13/06', 'Sale', 'United States', 'USD', '100.00', '15.00']] * 10
+        rows[0] = ['2021/13/06', 'Sale', 'United States', 'XXX', '100.00', '15.00']
+        _, _, all_errors = validate(rows, 'rows')
+
+        with mock.patch(
+                'api.lib.file_validation_service.validate_column',
+                wraps=validate_column) as validate_column_mock:
+            _, _, errors = validate(rows, 'columns', validation_errors=ValidationErrorList(3))
+
+        self.assertEqual(validate_column_mock.call_count, 1)
+        self.assertEqual(errors, all_errors[:3])
+        self.assertEqual([row_number for row_number, _, _ in errors], [0, 0, 1])
+
+    def test_summarised_errors(self):
+        with tempfile.TemporaryDirectory() as report_dir, override_settings(
+                IMPORT_ERROR_REPORT_DIR=report_dir):
+            errors = ValidationErrorSummary('partner', sample_size=1)
+            validate(INVALID_ROWS * 2, 'columns', validation_errors=errors)
+            summary = errors.get_result()['error_summary']
+
+            with gzip.open(errors.report_path) as report_file:
+                report = [json.loads(line) for line in report_file]
+
+        _, _, all_errors = validate(INVALID_ROWS * 2, 'rows')
+        self.assertEqual(summary['error_count'], len(all_errors))
+        self.assertEqual(
+            [[row_number, value, message] for row_number, _, value, _, message in report],
+            all_errors)
+        date_errors = [group for group in summary['groups'] if group['column'] == 0]
+        self.assertEqual(date_errors, [{
+            'column': 0, 'code': 'invalid_date', 'count': 4, 'samples': [all_errors[0]]}])
@@ -1,86 +1,430 @@
-import datetime
+import csv
+import hashlib
+import os
 
-from django.http import HttpResponse, JsonResponse
+from django.conf import settings
+from django.db.transaction import atomic
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 
 from api.lib import FileImportService
-from api.decorators import require_api_authentication
-from api.models import Transaction
+from api.decorators import require_api_authentication, require_streamed_api_authentication
+from api.lib.file_import_service import get_import_result
+from api.lib.codecs import encoded_response, get_response_codec
+from api.lib.import_job_service import ImportJobService
+from api.lib.import_schemas import get_import_schema
+from api.lib.metrics import METRICS, count_rows, timed
+from api.lib.streaming_import_service import ROW_READERS, StreamingImportService
+from api.lib.transaction_query_service import (
+    CONTENT_TYPES, RESPONSE_FORMAT_JSON, RESPONSE_FORMATS, BatchTransactionQueryService,
+    InvalidCursor, TransactionQueryService, decode_cursor, get_export_filename,
+    is_format_available)
+from api.lib.validation_errors import (
+    create_validation_errors, get_error_report_path, validate_error_report_parameters)
+from api.lib.validators import parse_date
+from api.models import DailyTransactionSummary, ImportJob, ImportRequest, ImportRequestReclaimed
 
 
 def heartbeat_view(request):
     return HttpResponse("OK.")
 
 
+def metrics_view(request):
+    return HttpResponse(METRICS.export(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @csrf_exempt
 @require_api_authentication
 def import_transactions_view(request, json_body):
+    return handle_import_request(request, json_body)
+
+
+def handle_import_request(request, json_body):
+    """Handle an (authenticated) import request, for both the sync and async import views."""
     # The api_partner_id can be used to pair all of the requests from this one client with a
     # particular account - useful if the API contract has a rate limit or usage limit
     api_partner_id = json_body['api_partner_id']
 
+    # A retried import returns the response of the original import instead of importing again
+    with timed('claim'):
+        import_request, claimed = ImportRequest.objects.claim(
+            api_partner_id, _get_import_request_key(request))
+    if not claimed:
+        if import_request.is_complete:
+            return encoded_response(
+                request, import_request.response, status=import_request.status_code)
+        return encoded_response(
+            request, {'error': 'This import is already in progress'}, status=409)
+
+    try:
+        response_data, status_code = _import_transactions(
+            api_partner_id, json_body, import_request)
+    except ImportRequestReclaimed:
+        return encoded_response(
+            request, {'error': 'This import is already in progress'}, status=409)
+    except Exception:
+        import_request.delete()
+        raise
+
+    # Nothing is imported by an unsuccessful import, so it can simply be tried again
+    if not response_data.get('success', True):
+        import_request.delete()
+        return encoded_response(request, response_data, status=status_code)
+
+    if not import_request.is_complete:
+        import_request.complete(status_code, response_data)
+    return encoded_response(request, response_data, status=status_code)
+
+
+def _get_import_request_key(request):
+    """Return the key that identifies retries of the same import request."""
+    idempotency_key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+    if idempotency_key:
+        return hashlib.sha256(f'key:{idempotency_key}'.encode()).hexdigest()
+
+    return hashlib.sha256(b'body:' + request.body).hexdigest()
+
+
+def _import_transactions(api_partner_id, json_body, import_request):
+    """
+    Import the transactions, returning the response data and status code.
+
+    The transactions (or import job) are saved along with the response of the import request, in
+    one database transaction that first makes sure that the request is still claimed (see
+    ImportRequestManager.keep_claim), so that a request is never imported twice.
+    """
     ignore_errors = json_body['ignore_errors']
     ignore_first_row = json_body['ignore_first_row']
     transaction_data = json_body['transaction_data']
     transaction_count = len(transaction_data)
 
-    file_import_service = FileImportService(transaction_data, ignore_first_row)
-    if file_import_service.validate_transaction_data() or ignore_errors:
-        successful_rows = file_import_service.save_transactions(ignore_errors)
-        message = f'{successful_rows} / {transaction_count} row(s) were successfully imported'
+    schema = get_import_schema(json_body.get('import_schema'))
+    if schema is None:
+        return _get_unknown_import_schema_error(json_body['import_schema']), 400
 
-        invalid_row_count = len(file_import_service.file_validation.validation_errors)
-        if invalid_row_count:
-            message = f'{message}, {invalid_row_count} invalid row(s) were ignored'
+    error_report = json_body.get('error_report')
+    max_errors = json_body.get('max_errors')
+    errors = validate_error_report_parameters(error_report, max_errors)
+    if errors:
+        return {'errors': errors}, 400
 
-        response_data = {
-            'success': True,
-            'message': message,
-            'errors': file_import_service.file_validation.validation_errors
-        }
-    else:
-        invalid_row_count = len(file_import_service.file_validation.validation_errors)
-        response_data = {
-            'success': False,
-            'message': (
-                f'There were {invalid_row_count} / {transaction_count} invalid row(s) preventing '
-                'the import of the data - try setting the "ignore_errors" flag to True to import '
-                'all valid transactions and ignore the invalid transactions'),
-            'errors': file_import_service.file_validation.validation_errors
-        }
+    # Large files can be imported in the background, by an import job, instead
+    if json_body.get('run_as_job'):
+        with atomic():
+            _keep_claim(import_request)
+            job = ImportJobService.create_job(
+                api_partner_id, transaction_data, ignore_errors, ignore_first_row, schema,
+                error_report, max_errors)
+            response_data = ImportJobService.get_job_status(job)
+            import_request.complete(202, response_data)
+        return response_data, 202
+
+    validation_errors = create_validation_errors(api_partner_id, error_report, max_errors)
+    file_import_service = FileImportService(
+        transaction_data, ignore_first_row, schema=schema, validation_errors=validation_errors)
+    if file_import_service.validate_transaction_data() or (
+            ignore_errors and not validation_errors.is_full):
+        with atomic():
+            _keep_claim(import_request)
+            successful_rows = file_import_service.save_transactions(ignore_errors)
+            response_data = get_import_result(
+                True, successful_rows, transaction_count, validation_errors)
+            import_request.complete(200, response_data)
+        return response_data, 200
+
+    return get_import_result(False, 0, transaction_count, validation_errors), 200
+
+
+def _keep_claim(import_request):
+    if not ImportRequest.objects.keep_claim(import_request):
+        raise ImportRequestReclaimed()
+
+
+@csrf_exempt
+@require_streamed_api_authentication
+def import_transactions_stream_view(request, body_file):
+    """
+    Import transaction data streamed as CSV or newline-delimited JSON.
+
+    The parameters are given in the query string and the transaction data, one transaction per
+    line, is the body of the request (which has been authenticated and spooled to body_file - see
+    require_streamed_api_authentication). The data is read, validated and saved in windows of rows
+    so that files of any size can be imported.
+    """
+    return handle_import_stream_request(request, body_file)
+
+
+def handle_import_stream_request(request, body_file):
+    """Handle an (authenticated) streamed import request, for both the sync and async views."""
+    api_partner_id = request.GET['api_partner_id']
+
+    ignore_errors = _get_boolean_parameter(request, 'ignore_errors')
+    ignore_first_row = _get_boolean_parameter(request, 'ignore_first_row')
 
-    return JsonResponse(data=response_data, status=200)
+    if request.content_type not in ROW_READERS:
+        return encoded_response(
+            request, {'error': f'Unsupported content type "{request.content_type}"'}, status=415)
+
+    schema = get_import_schema(request.GET.get('import_schema'))
+    if schema is None:
+        return encoded_response(
+            request, _get_unknown_import_schema_error(request.GET['import_schema']), status=400)
+
+    error_report = request.GET.get('error_report')
+    max_errors = request.GET.get('max_errors')
+    if max_errors is not None and max_errors.isdigit():
+        max_errors = int(max_errors)
+    errors = validate_error_report_parameters(error_report, max_errors)
+    if errors:
+        return encoded_response(request, {'errors': errors}, status=400)
+
+    rows = ROW_READERS[request.content_type](body_file)
+    validation_errors = create_validation_errors(api_partner_id, error_report, max_errors)
+    streaming_import_service = StreamingImportService(
+        rows, ignore_first_row, schema=schema, validation_errors=validation_errors)
+    try:
+        imported = streaming_import_service.import_transactions(ignore_errors)
+    except (ValueError, csv.Error) as e:
+        validation_errors.discard()
+        return encoded_response(
+            request, {'error': f'Unable to read the transaction data: {e}'}, status=400)
+
+    return encoded_response(request, get_import_result(
+        imported, streaming_import_service.imported_count,
+        streaming_import_service.transaction_count, streaming_import_service.validation_errors))
 
 
 @csrf_exempt
 @require_api_authentication
-def query_transactions_view(request, json_body):
-    from api.lib import EXCHANGE_RATES
+def import_job_status_view(request, json_body, job_id):
+    return handle_import_job_status_request(request, json_body, job_id)
+
 
+def handle_import_job_status_request(request, json_body, job_id):
+    """Handle an (authenticated) import job status request, for both the sync and async views."""
     api_partner_id = json_body['api_partner_id']
 
-    country_code = json_body['country_code'].upper()
-    raw_query_date = json_body['query_date']
+    job = ImportJob.objects.filter(job_id=job_id, api_partner_id=api_partner_id).first()
+    if job is None:
+        return encoded_response(
+            request, {'errors': [f'Import job "{job_id}" does not exist']}, status=404)
 
-    # Validate the inputs
+    return encoded_response(request, ImportJobService.get_job_status(job))
+
+
+@csrf_exempt
+@require_api_authentication
+def import_error_report_view(request, json_body, report_id):
+    """
+    Download the error report of an import whose errors were summarised (see
+    api.lib.validation_errors): a gzipped newline-delimited JSON file of every validation error.
+    """
+    return handle_error_report_request(request, json_body, report_id)
+
+
+def handle_error_report_request(request, json_body, report_id):
+    """Handle an (authenticated) error report request, for both the sync and async views."""
+    report_path = get_error_report_path(json_body['api_partner_id'], report_id)
+    if not os.path.exists(report_path):
+        return JsonResponse(
+            data={'errors': [f'Error report "{report_id}" does not exist']}, status=404)
+
+    return FileResponse(
+        open(report_path, 'rb'), as_attachment=True,
+        filename=f'import_errors_{report_id}.ndjson.gz', content_type='application/gzip')
+
+
+def _get_boolean_parameter(request, name):
+    return request.GET.get(name, 'false').lower() == 'true'
+
+
+def _get_unknown_import_schema_error(name):
+    return {'errors': [f'Import schema "{name}" does not exist']}
+
+
+@csrf_exempt
+@require_api_authentication
+def query_transactions_view(request, json_body):
+    return handle_query_request(request, json_body)
+
+
+def handle_query_request(request, json_body):
+    """Handle an (authenticated) query request, for both the sync and async query views."""
+    from api.lib import QUERY_CACHE
+
+    country_code, query_date, errors = _validate_query(json_body)
+
+    # The transactions can be returned a page at a time (page_size), continuing from the cursor
+    # returned with the previous page, or streamed (stream or an NDJSON response_format)
+    page_size = json_body.get('page_size')
+    if page_size is not None and (
+            not isinstance(page_size, int) or isinstance(page_size, bool) or page_size < 1):
+        errors.append(f'Page size "{page_size}" must be a positive whole number')
+
+    response_format = json_body.get('response_format', RESPONSE_FORMAT_JSON)
+    if response_format not in RESPONSE_FORMATS:
+        errors.append(
+            f'Response format "{response_format}" is not supported '
+            f'({", ".join(RESPONSE_FORMATS)})')
+    elif not is_format_available(response_format):
+        errors.append(f'Response format "{response_format}" is not available on this server')
+
+    cursor = json_body.get('cursor')
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except InvalidCursor as e:
+            errors.append(str(e))
+
+    if errors:
+        return encoded_response(request, {'errors': errors}, status=400)
+
+    query_service = TransactionQueryService(country_code, query_date, cursor)
+
+    if json_body.get('stream') or response_format != RESPONSE_FORMAT_JSON:
+        response = StreamingHttpResponse(
+            query_service.stream(response_format), content_type=CONTENT_TYPES[response_format])
+
+        filename = get_export_filename(country_code, query_date, response_format)
+        if filename:
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
+
+        return response
+
+    # The encoded response is cached until transactions on that day are imported or converted (for
+    # each format that it's encoded in)
+    codec = get_response_codec(request)
+    with timed('cache'):
+        response_content = QUERY_CACHE.get_or_set(
+            country_code, query_date,
+            {'page_size': page_size, 'cursor': cursor, 'content_type': codec.content_type},
+            lambda: _encode_query_response(query_service, page_size, codec))
+
+    return HttpResponse(response_content, content_type=codec.content_type, status=200)
+
+
+def _encode_query_response(query_service, page_size, codec):
+    # Only the responses that aren't cached read the transactions, so only they count as read
+    with timed('read'):
+        if page_size:
+            transaction_data, next_cursor = query_service.get_page(page_size)
+            response_data = {'transactions': transaction_data, 'next_cursor': next_cursor}
+        else:
+            transaction_data = query_service.get_transactions()
+            response_data = {'transactions': transaction_data}
+    count_rows('read', len(transaction_data))
+
+    with timed('encode'):
+        return codec.encode(response_data)
+
+
+@csrf_exempt
+@require_api_authentication
+def batch_query_transactions_view(request, json_body):
+    """
+    Query the transactions of many countries over a range of days with a single request (and a
+    single database query), rather than one request per country and day.
+    """
+    return handle_batch_query_request(request, json_body)
+
+
+def handle_batch_query_request(request, json_body):
+    """Handle an (authenticated) batch query request, for both the sync and async views."""
+    country_codes = json_body['country_codes']
     errors = []
+    if not isinstance(country_codes, list) or not country_codes or not all(
+            isinstance(country_code, str) for country_code in country_codes):
+        errors.append('Country codes must be a list of at least one country code')
+    else:
+        country_codes = [country_code.upper() for country_code in country_codes]
+        errors.extend(_validate_country_codes(country_codes))
 
-    # Note! This is a bit hacky - assuming that country can be properly validated by being in the
-    # list of exchange rates but it'll do for now.
-    if country_code not in [code[:2] for code in EXCHANGE_RATES.keys()]:
-        errors.append(f'Country code "{country_code}" is not supported')
+    start_date = _parse_query_date(json_body['start_date'], 'Start date', errors)
+    end_date = _parse_query_date(json_body['end_date'], 'End date', errors)
+    if start_date and end_date:
+        if end_date < start_date:
+            errors.append('End date must not be before the start date')
+        elif (end_date - start_date).days >= settings.QUERY_BATCH_MAX_DAYS:
+            errors.append(f'Up to {settings.QUERY_BATCH_MAX_DAYS} days can be queried at once')
 
-    try:
-        query_date = datetime.datetime.strptime(raw_query_date, '%Y/%m/%d')
-    except ValueError:
-        errors.append(f'Query date "{raw_query_date}" is not in a supported format (YYYY/MM/DD)')
+    if errors:
+        return JsonResponse(data={'errors': errors}, status=400)
+
+    query_service = BatchTransactionQueryService(country_codes, start_date, end_date)
+    return StreamingHttpResponse(
+        query_service.stream(), content_type=CONTENT_TYPES[RESPONSE_FORMAT_JSON])
 
+
+@csrf_exempt
+@require_api_authentication
+def summarise_transactions_view(request, json_body):
+    return handle_summary_request(request, json_body)
+
+
+def handle_summary_request(request, json_body):
+    """Handle an (authenticated) summary request, for both the sync and async summary views."""
+    country_code, query_date, errors = _validate_query(json_body)
     if errors:
         return JsonResponse(data={'errors': errors}, status=400)
 
-    transactions = Transaction.objects.get_by_country_code_and_date(country_code, query_date)
-    transaction_data = [
-        [t.created_at.date(), t.country, t.currency, t.transaction_type, t.net, t.vat, t.net_euro,
-         t.vat_euro] for t in transactions]
+    # The totals are read from the daily summaries, which are kept up to date as transactions are
+    # imported, rather than by reading every transaction
+    summaries = DailyTransactionSummary.objects.get_by_country_code_and_date(
+        country_code, query_date)
+
+    total_fields = ['transaction_count', 'converted_count', 'net_euro', 'vat_euro']
+    summary_data = []
+    total = dict.fromkeys(total_fields, 0)
+    for summary in summaries:
+        summary_data.append({
+            'currency': summary.currency,
+            'transaction_type': summary.transaction_type,
+            'transaction_count': summary.transaction_count,
+            'converted_count': summary.converted_count,
+            'net': summary.net,
+            'vat': summary.vat,
+            'net_euro': summary.net_euro,
+            'vat_euro': summary.vat_euro
+        })
+        for field in total_fields:
+            total[field] += getattr(summary, field)
+
+    return JsonResponse(data={
+        'country_code': country_code,
+        'date': query_date.date(),
+        'summaries': summary_data,
+        'total': total
+    }, status=200)
+
+
+def _validate_query(json_body):
+    """Return the country code and date of a query along with any errors in them."""
+    country_code = json_body['country_code'].upper()
+
+    # Validate the inputs
+    errors = _validate_country_codes([country_code])
+    query_date = _parse_query_date(json_body['query_date'], 'Query date', errors)
+
+    return country_code, query_date, errors
+
+
+def _validate_country_codes(country_codes):
+    """Return the errors in the given (upper case) country codes."""
+    from api.lib import EXCHANGE_RATES
 
-    return JsonResponse(data={'transactions': transaction_data}, status=200)
+    # Note! This is a bit hacky - assuming that country can be properly validated by being in the
+    # list of exchange rates but it'll do for now.
+    supported_country_codes = {code[:2] for code in EXCHANGE_RATES.keys()}
+    return [
+        f'Country code "{country_code}" is not supported' for country_code in country_codes
+        if country_code not in supported_country_codes]
+
+
+def _parse_query_date(raw_query_date, description, errors):
+    """Return the given date (as a datetime), or None after adding an error if it's not valid."""
+    try:
+        return parse_date(raw_query_date)
+    except ValueError:
+        errors.append(
+            f'{description} "{raw_query_date}" is not in a supported format (YYYY/MM/DD)')
+        return None
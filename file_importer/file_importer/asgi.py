@@ -7,10 +7,15 @@ For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 """
 
+import django
 import os
 
-from django.core.asgi import get_asgi_application
-
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'file_importer.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+# Streamed responses are produced in the thread pool as they are sent (see
+# api.asgi.StreamingASGIHandler), which uses the app's models so is imported once Django is set up
+from api.asgi import StreamingASGIHandler  # noqa: E402
+
+application = StreamingASGIHandler()
@@ -10,11 +10,17 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import os
+
+from dotenv import load_dotenv
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Settings can be given in the environment or in a .env file (see dev.env)
+load_dotenv()
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/3.2/howto/deployment/checklist/
@@ -43,6 +49,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -77,11 +84,56 @@ WSGI_APPLICATION = 'file_importer.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
+#
+# The database is configured by the DB_* environment variables and is SQLite (db.sqlite3) by
+# default, see api.db_backends.sqlite3. Connections are kept open for DB_CONN_MAX_AGE seconds
+# rather than being opened for every request. When connecting to PostgreSQL through a
+# transaction-level pooler, eg. PgBouncer, set DB_DISABLE_SERVER_SIDE_CURSORS to true, as
+# server-side cursors don't survive from one transaction to the next
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'ENGINE': os.environ.get('DB_ENGINE', 'api.db_backends.sqlite3'),
+        'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+        'USER': os.environ.get('DB_USER', ''),
+        'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+        'HOST': os.environ.get('DB_HOST', ''),
+        'PORT': os.environ.get('DB_PORT', ''),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'DISABLE_SERVER_SIDE_CURSORS': (
+            os.environ.get('DB_DISABLE_SERVER_SIDE_CURSORS', 'false').lower() == 'true'),
+    }
+}
+
+# SQLite allows one connection to write at a time, so the others wait up to SQLITE_TIMEOUT seconds
+# for it (and then fail with "database is locked", eg. when too many imports are sent at once). In
+# WAL mode, queries aren't blocked by imports (nor imports by queries) and commits only need to be
+# synced to disk at checkpoints
+SQLITE_TIMEOUT = 20
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'temp_store': 'memory',
+    # In KiB when negative, ie. 64MB
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+}
+
+
+# Caches
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Shared between the web server and the import job workers, which invalidate it
+    'query_results': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'query_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
     }
 }
 
@@ -131,3 +183,110 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # App special variables
 API_SECRET_KEY = 'KFWfVAwv3b7cIuJrYN7t'
+
+# The number of transactions written per INSERT statement when saving an import
+IMPORT_BATCH_SIZE = 1000
+
+# When running on PostgreSQL, write imported transactions using COPY instead of INSERT statements
+IMPORT_USE_POSTGRES_COPY = False
+
+# The number of rows read, validated and saved at a time when importing streamed transaction data
+IMPORT_STREAM_WINDOW_SIZE = 10000
+
+# The largest request body (in bytes) that is read into memory, eg. the body of an import request -
+# 100MB is about 1.5 million rows of transaction data. Larger files can be streamed instead, see
+# IMPORT_STREAM_SPOOL_SIZE
+DATA_UPLOAD_MAX_MEMORY_SIZE = 100 * 1024 * 1024
+
+# Streamed transaction data is copied to a temporary file (in FILE_UPLOAD_TEMP_DIR, or the system's
+# temporary directory) while it is authenticated, and is kept in memory until it is larger than
+# IMPORT_STREAM_SPOOL_SIZE bytes
+IMPORT_STREAM_SPOOL_SIZE = 10 * 1024 * 1024
+
+# Import jobs save their transaction data to IMPORT_JOB_DIR until a worker runs them
+IMPORT_JOB_DIR = BASE_DIR / 'import_jobs'
+
+# A worker saves the progress (and heartbeat) of its job after every window of rows. A running job
+# whose heartbeat is older than IMPORT_JOB_TIMEOUT seconds is assumed to have been abandoned by its
+# worker (eg. it was killed) and is resumed by the next free worker
+IMPORT_JOB_TIMEOUT = 5 * 60
+
+# Imports whose errors are summarised ("error_report": "summary") write every error to a gzipped
+# report in IMPORT_ERROR_REPORT_DIR and return the first IMPORT_ERROR_SAMPLE_SIZE errors of each
+# column and kind of error. Validation stops after IMPORT_MAX_ERRORS errors, unless the import
+# gives its own "max_errors" (or None for no limit)
+IMPORT_ERROR_REPORT_DIR = BASE_DIR / 'error_reports'
+IMPORT_ERROR_SAMPLE_SIZE = 10
+IMPORT_MAX_ERRORS = None
+
+# The import schema (see api.lib.import_schemas) of imports that don't give one
+DEFAULT_IMPORT_SCHEMA = 'vat'
+
+# Validate import files column-by-column ('columns') or row-by-row ('rows')
+FILE_VALIDATION_MODE = 'columns'
+
+# Import files with at least PARALLEL_VALIDATION_THRESHOLD rows can be validated by multiple
+# processes (PARALLEL_VALIDATION_WORKERS, or None for one per CPU). Sending the rows to and from
+# the processes costs more than validating them column-by-column in one process, so this is only
+# worth enabling when validating row-by-row on a machine with many CPUs
+PARALLEL_VALIDATION_THRESHOLD = 200000
+PARALLEL_VALIDATION_WORKERS = 1
+
+# Exchange rates are cached for EXCHANGE_RATE_TTL seconds, after which they are refreshed in the
+# background (failed refreshes are retried after EXCHANGE_RATE_RETRY_INTERVAL seconds). The last
+# rates fetched are saved to EXCHANGE_RATE_SNAPSHOT_PATH so they are available when the app starts
+EXCHANGE_RATE_TTL = 24 * 60 * 60
+EXCHANGE_RATE_RETRY_INTERVAL = 5 * 60
+EXCHANGE_RATE_SNAPSHOT_PATH = BASE_DIR / 'exchange_rates.json'
+
+# The number of days of historical exchange rates kept for converting transactions at the exchange
+# rate of the day they were made (the rates of earlier transactions are fetched when they are
+# converted)
+EXCHANGE_RATE_HISTORY_DAYS = 365
+
+# Read the exchange rates from this file (in the ECB's format) instead of from the ECB, eg.
+# api/fixtures/ecb_exchange_rates.json
+EXCHANGE_RATE_FIXTURE = os.environ.get('EXCHANGE_RATE_FIXTURE')
+
+# The number of transactions read from the database at a time when streaming query results
+QUERY_STREAM_CHUNK_SIZE = 2000
+
+# The most days that a batch query (of many countries over a range of days) can cover
+QUERY_BATCH_MAX_DAYS = 92
+
+# Cache the encoded responses of transaction queries in one of the Django caches ('django', using
+# the QUERY_CACHE_ALIAS cache for up to QUERY_CACHE_TIMEOUT seconds), in process memory ('local',
+# up to QUERY_CACHE_MAX_BYTES - only if transactions are never imported by another process, eg. an
+# import job worker) or not at all (None)
+QUERY_CACHE_BACKEND = 'django'
+QUERY_CACHE_ALIAS = 'query_results'
+QUERY_CACHE_TIMEOUT = 24 * 60 * 60
+QUERY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# A repeated import request (with the same Idempotency-Key header or, without one, the same body)
+# returns the response of the first request for IMPORT_IDEMPOTENCY_TTL seconds instead of
+# importing the transactions again
+IMPORT_IDEMPOTENCY_TTL = 24 * 60 * 60
+
+# A repeated import request is refused (with a 409 status) while the original is being imported.
+# The original's heartbeat is renewed when it is claimed and again when it starts to be saved and,
+# if it is older than IMPORT_CLAIM_TIMEOUT seconds without the import finishing, the original is
+# assumed to have been abandoned and the request is imported again
+IMPORT_CLAIM_TIMEOUT = 15 * 60
+
+# Skip imported transactions that are identical to ones already imported (by their fingerprint).
+# Note that this also skips genuinely repeated transactions, ie. the same amounts, on the same day,
+# in the same currency, and it's never used with IMPORT_USE_POSTGRES_COPY
+IMPORT_SKIP_DUPLICATE_ROWS = False
+
+# Handle every API request with an async view (see api.async_views), which should be set when
+# running under an ASGI server. Async views run everything that blocks, eg. database queries and
+# streamed responses, in a pool of ASYNC_THREAD_POOL_SIZE threads (per process)
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'false').lower() == 'true'
+ASYNC_THREAD_POOL_SIZE = 8
+
+# Measure every request (the time taken by each stage, database queries, rows and bytes) for the
+# /metrics endpoint (in Prometheus' text format) and, when METRICS_SERVER_TIMING is set, return the
+# stages of each request in its Server-Timing header
+METRICS_ENABLED = True
+METRICS_SERVER_TIMING = False
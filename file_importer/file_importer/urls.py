@@ -1,12 +1,36 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
 
-from api import views
+from api import async_views, views
+
+# Every request (other than the admin's) is handled by an async view when running under ASGI
+request_views = async_views if settings.ASYNC_VIEWS else views
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('heartbeat/', views.heartbeat_view, name='heartbeat'),
-    path('api/v1/transactions/import', views.import_transactions_view, name='import_transactions'),
-    path('api/v1/transactions/query', views.query_transactions_view, name='query_transactions'),
+    path('heartbeat/', request_views.heartbeat_view, name='heartbeat'),
+    path('metrics', request_views.metrics_view, name='metrics'),
+    path(
+        'api/v1/transactions/import', request_views.import_transactions_view,
+        name='import_transactions'),
+    path(
+        'api/v1/transactions/import/stream', request_views.import_transactions_stream_view,
+        name='import_transactions_stream'),
+    path(
+        'api/v1/transactions/import/<uuid:job_id>', request_views.import_job_status_view,
+        name='import_job_status'),
+    path(
+        'api/v1/transactions/import/errors/<uuid:report_id>',
+        request_views.import_error_report_view, name='import_error_report'),
+    path(
+        'api/v1/transactions/query', request_views.query_transactions_view,
+        name='query_transactions'),
+    path(
+        'api/v1/transactions/query/batch', request_views.batch_query_transactions_view,
+        name='batch_query_transactions'),
+    path(
+        'api/v1/transactions/summary', request_views.summarise_transactions_view,
+        name='summarise_transactions'),
 ]